@@ -10,6 +10,66 @@ class BaseConfig:
     DEBUG = False
     LLM_COST_PER_TOKEN = 0.0004
     SECRET_KEY = os.getenv("SECRET_KEY", "default_secret")
-    API_TIMEOUT = 30  # seconds
+    API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))  # seconds per LLM request
     CLAIM_LOCATION = os.getenv("CLAIM_LOCATION", "/Users/deveshsurve/UNIVERSITY/PROJECT/classify-pdf/data_files")
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///results_v3.db")
+    NUM_WORKERS = int(os.getenv("NUM_WORKERS", "1"))  # documents processed in parallel, 1 = serial
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))  # pages of one document OCR'd in parallel
+    OCR_PAGE_WINDOW = int(os.getenv("OCR_PAGE_WINDOW", "4"))  # pages rasterized at a time, 0 = whole document
+    TEXT_LAYER_FAST_PATH = os.getenv("TEXT_LAYER_FAST_PATH", "true").lower() == "true"  # use embedded PDF text before OCR
+    MIN_TEXT_LAYER_CHARS = int(os.getenv("MIN_TEXT_LAYER_CHARS", "50"))  # shorter text layers over a page image are OCR'd
+    OCR_IMAGE_COVERAGE = float(os.getenv("OCR_IMAGE_COVERAGE", "0.5"))  # share of a page covered by images that marks it as scanned
+    LLM_ASYNC = os.getenv("LLM_ASYNC", "false").lower() == "true"  # send per-label LLM calls concurrently
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "6"))  # in-flight LLM calls per document
+    LLM_CLASSIFICATION_MODE = os.getenv("LLM_CLASSIFICATION_MODE", "per_label")  # per_label or multi_label
+    LLM_API_BASE = os.getenv("LLM_API_BASE", "")  # OpenAI-compatible endpoint to call instead of the provider's, e.g. a local mock
+    LLM_RPM = float(os.getenv("LLM_RPM", "500"))  # requests per minute per process, 0 = unlimited
+    LLM_TPM = float(os.getenv("LLM_TPM", "200000"))  # tokens per minute per process, 0 = unlimited
+    LLM_CONCURRENCY_LIMIT = int(os.getenv("LLM_CONCURRENCY_LIMIT", "16"))  # in-flight LLM calls per process; halves when throttled
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))  # retries of throttled or transient failures
+    LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1"))  # base of the exponential retry backoff
+    LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "60"))
+    LLM_EXCERPT_TOKENS = int(os.getenv("LLM_EXCERPT_TOKENS", "1500"))  # token budget of the document text sent to the LLM, 0 = whole document
+    LLM_EXCERPT_LEAD_SHARE = float(os.getenv("LLM_EXCERPT_LEAD_SHARE", "0.5"))  # share of the budget for the header and first page
+    LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")  # off, record, replay or mock
+    LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+    LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")  # seconds per replayed call, or "recorded"
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+    LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "512"))
+    LLM_CACHE_MAX_AGE_DAYS = int(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "30"))
+    PIPELINE_VERSION = os.getenv("PIPELINE_VERSION", "3.1")  # bump to reprocess documents after pipeline changes
+    OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+    OCR_LANG = os.getenv("OCR_LANG", "eng")
+    OCR_PSM = int(os.getenv("OCR_PSM", "3"))  # tesseract page segmentation mode
+    OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+    OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.db")
+    OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "256"))
+    OCR_CACHE_MAX_AGE_DAYS = int(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "90"))
+    CLASSIFIER = os.getenv("CLASSIFIER", "llm")  # llm, rules, embedding or cascade
+    CASCADE_TIERS = os.getenv("CASCADE_TIERS", "rules,llm")  # classifiers tried in order by the cascade
+    RULES_PATH = os.getenv("RULES_PATH", os.path.join(os.path.dirname(__file__), "classification_rules.json"))
+    RULES_MIN_SCORE = float(os.getenv("RULES_MIN_SCORE", "0.28"))  # rules score needed to skip the LLM
+    RULES_MIN_MARGIN = float(os.getenv("RULES_MIN_MARGIN", "0.12"))  # lead over the runner-up needed to skip the LLM
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")  # model name or local path
+    EMBEDDING_OFFLINE = os.getenv("EMBEDDING_OFFLINE", "false").lower() == "true"  # only load models already on disk
+    EMBEDDING_INDEX_PATH = os.getenv("EMBEDDING_INDEX_PATH", "label_index.npz")  # generated, rebuilt when the model or descriptions change
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_MIN_SCORE = float(os.getenv("EMBEDDING_MIN_SCORE", "0.3"))
+    EMBEDDING_MIN_MARGIN = float(os.getenv("EMBEDDING_MIN_MARGIN", "0.05"))
+    DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "100"))  # documents buffered per bulk upsert
+    DB_FLUSH_SECONDS = float(os.getenv("DB_FLUSH_SECONDS", "5"))  # longest time results wait in the buffer
+    DB_TEXT_COMPRESSION_LEVEL = int(os.getenv("DB_TEXT_COMPRESSION_LEVEL", "6"))  # zlib level for stored document text
+    PIPELINE_STAGED = os.getenv("PIPELINE_STAGED", "false").lower() == "true"  # overlap extraction, cleaning, classification and saving
+    PIPELINE_OCR_WORKERS = int(os.getenv("PIPELINE_OCR_WORKERS", "2"))  # documents extracted at once
+    PIPELINE_CLEAN_WORKERS = int(os.getenv("PIPELINE_CLEAN_WORKERS", "1"))
+    PIPELINE_CLASSIFY_CONCURRENCY = int(os.getenv("PIPELINE_CLASSIFY_CONCURRENCY", "4"))  # documents classified at once
+    PIPELINE_CLASSIFY_BATCH = int(os.getenv("PIPELINE_CLASSIFY_BATCH", "16"))  # ready documents a worker scores together with batching classifiers (embeddings)
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))  # documents buffered between two stages
+    PIPELINE_REPORT_SECONDS = float(os.getenv("PIPELINE_REPORT_SECONDS", "10"))  # interval of queue depth logs
+    JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "false").lower() == "true"  # process documents through the durable job queue
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))  # a job is handed out again if its worker stops renewing
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # attempts before a job is dead-lettered
+    JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "30"))  # base of the exponential retry backoff
+    JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "900"))
+    JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))  # idle wait between claims
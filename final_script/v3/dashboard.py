@@ -1,12 +1,22 @@
+import sys
+from pathlib import Path
 import streamlit as st
 import pandas as pd
-import seaborn as sns
 from sqlalchemy import create_engine
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, f1_score
-import matplotlib.pyplot as plt
 import json
 import plotly.express as px
-from config.base_config import BaseConfig
+
+# Add the project root to Python path
+project_root = str(Path(__file__).parent.parent.parent)
+sys.path.insert(0, project_root)
+
+from final_script.v3.config.base_config import BaseConfig
+from final_script.v3.modules import database
+from final_script.v3.modules.dashboard_queries import (
+    change_token, confusion_pairs, classification_summary, count_misclassified, misclassified_page,
+    stage_time_stats, cost_summary, daily_stage_times
+)
+from datetime import timedelta
 import plotly.graph_objects as go
 
 st.set_page_config(page_title="Document Classification Dashboard", layout="wide")
@@ -15,35 +25,59 @@ st.set_page_config(page_title="Document Classification Dashboard", layout="wide"
 DATABASE_URL = BaseConfig.DATABASE_URL
 engine = create_engine(DATABASE_URL)
 
-# Load data from SQLite database
-@st.cache_data
-def load_data():
-    query = "SELECT * FROM documents"
-    df = pd.read_sql(query, con=engine)
-    return df
+# Creating tables and applying migrations is only needed once per server process
+@st.cache_resource
+def init_database():
+    database.init_db(engine)
+
+init_database()
+
+# Aggregates are computed in SQL and cached per change token, so new results show up on the
+# next rerun while unchanged data is served from the cache.
+@st.cache_data(max_entries=4)
+def load_summary(token):
+    pairs = confusion_pairs(engine)
+    return {
+        "classification": classification_summary(pairs),
+        "confusion": pairs,
+    }
+
+# Only the rows on screen are fetched; each filter and page combination is cached per change token
+@st.cache_data(max_entries=64)
+def load_misclassified_page(token, after_id, page_size, filters):
+    return misclassified_page(engine, after_id=after_id, limit=page_size, **dict(filters))
+
+@st.cache_data(max_entries=64)
+def load_misclassified_count(token, filters):
+    return count_misclassified(engine, **dict(filters))
+
+@st.cache_data(max_entries=4)
+def load_process_metrics(token):
+    return {
+        "stage_times": stage_time_stats(engine),
+        "costs": cost_summary(engine),
+        "daily_times": daily_stage_times(engine),
+    }
+
+# Document text is stored compressed in document_texts and only loaded when inspected;
+# re-saved documents get a new change token, so their new text is not served from the cache
+@st.cache_data(max_entries=32)
+def load_document_text(token, file_name):
+    return database.load_document_text(file_name, engine)
 
 # Load data
-df = load_data()
+token = change_token(engine)
+summary = load_summary(token)
+classification = summary["classification"]
 
 # Header
 st.title("Document Classification Dashboard")
 st.markdown("An interactive dashboard to analyze document classification performance")
 
-# Convert JSON strings in `high_confidence_classes` to lists
-df['high_confidence_classes'] = df['high_confidence_classes'].apply(lambda x: json.loads(x) if x else [])
-
-# Filter out rows with missing ground truth or predictions
-df = df.dropna(subset=['classified_category', 'ground_truth'])
-y_pred = df['classified_category']
-y_true = df['ground_truth']
-
-# Compute summary metrics
-accuracy = accuracy_score(y_true, y_pred)
-f1 = f1_score(y_true, y_pred, average="weighted")
-try:
-    auc_score = roc_auc_score(pd.get_dummies(y_true), pd.get_dummies(y_pred), average="weighted", multi_class="ovr")
-except ValueError:
-    auc_score = None
+# Summary metrics over documents with both a ground truth and a prediction
+accuracy = classification["accuracy"] or 0.0
+f1 = classification["weighted_f1"] or 0.0
+auc_score = classification["auc"]
 
 # Organize the dashboard into four quadrants
 col1, col2 = st.columns(2)
@@ -58,9 +92,8 @@ with col1:
 # Quadrant 2: Classification Report
 with col2:
     st.subheader("Classification Report")
-    classification_rep = classification_report(y_true, y_pred, output_dict=True)
     # create a table with the classification report
-    st.table(classification_rep)
+    st.table(classification["report"])
 
 # Second row for distributions and misclassification analysis
 col3, col4 = st.columns(2)
@@ -68,23 +101,26 @@ col3, col4 = st.columns(2)
 # Quadrant 3: Ground Truth vs Predicted Distributions
 with col3:
     st.subheader("Ground Truth vs Predicted Category Distributions")
-    fig1 = px.histogram(df, x="ground_truth", title="Ground Truth Distribution", color_discrete_sequence=["#636EFA"])
-    fig2 = px.histogram(df, x="classified_category", title="Prediction Distribution", color_discrete_sequence=["#EF553B"])
+    true_df = pd.DataFrame(list(classification["true_counts"].items()), columns=["ground_truth", "count"])
+    predicted_df = pd.DataFrame(list(classification["predicted_counts"].items()), columns=["classified_category", "count"])
+    fig1 = px.bar(true_df, x="ground_truth", y="count", title="Ground Truth Distribution", color_discrete_sequence=["#636EFA"])
+    fig2 = px.bar(predicted_df, x="classified_category", y="count", title="Prediction Distribution", color_discrete_sequence=["#EF553B"])
     st.plotly_chart(fig1, use_container_width=True)
     st.plotly_chart(fig2, use_container_width=True)
 
 # Quadrant 4: Misclassifications Analysis & Error Analysis
 with col4:
     st.subheader("Misclassified Instances")
-    misclassified = df[df['classified_category'] != df['ground_truth']]
-    if not misclassified.empty:
-        st.write(f"### Misclassified samples: {len(misclassified)}")
-        st.write("Examples of misclassified instances:")
-        st.write(misclassified[['file_name', 'ground_truth', 'classified_category', 'high_confidence_classes']].head(5))
+    error_df = pd.DataFrame(
+        [pair for pair in summary["confusion"] if pair[0] != pair[1]],
+        columns=["ground_truth", "classified_category", "count"]
+    )
+    if not error_df.empty:
+        st.write(f"### Misclassified samples: {error_df['count'].sum()}")
+        st.write("Browse them in the Misclassified Documents section below.")
         
         # Error Analysis
         st.write("### Misclassification Analysis")
-        error_df = misclassified.groupby(['ground_truth', 'classified_category']).size().reset_index(name='count')
         fig = px.bar(error_df, x="ground_truth", y="count", color="classified_category",
                      title="Misclassification by Category", labels={"count": "Misclassification Count"},
                      color_discrete_sequence=px.colors.qualitative.Prism)
@@ -92,43 +128,76 @@ with col4:
     else:
         st.write("No misclassifications found!")
 
+# Misclassified documents browser, filtered and paginated in SQL
+st.markdown("---")
+st.subheader("Misclassified Documents")
+filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
+with filter_col1:
+    true_filter = st.selectbox("Ground truth", ["All"] + sorted(classification["true_counts"]))
+with filter_col2:
+    predicted_filter = st.selectbox("Predicted", ["All"] + sorted(classification["predicted_counts"]))
+with filter_col3:
+    confidence_range = st.slider("Confidence", 0.0, 1.0, (0.0, 1.0), step=0.05)
+with filter_col4:
+    date_range = st.date_input("Processed between", value=())
+page_size = st.select_slider("Rows per page", options=[10, 25, 50, 100], value=25)
+
+filters = {
+    "ground_truth": None if true_filter == "All" else true_filter,
+    "classified_category": None if predicted_filter == "All" else predicted_filter,
+    "min_confidence": confidence_range[0] if confidence_range[0] > 0.0 else None,
+    "max_confidence": confidence_range[1] if confidence_range[1] < 1.0 else None,
+    "processed_from": date_range[0].isoformat() if len(date_range) == 2 else None,
+    "processed_to": (date_range[1] + timedelta(days=1)).isoformat() if len(date_range) == 2 else None,
+}
+filter_key = tuple(sorted(filters.items()))
+
+# Keyset pagination: keep the after_id of every page visited so far; reset when filters change
+if st.session_state.get("misclassified_filters") != (filter_key, page_size):
+    st.session_state["misclassified_filters"] = (filter_key, page_size)
+    st.session_state["misclassified_cursors"] = [None]
+cursors = st.session_state["misclassified_cursors"]
+page = load_misclassified_page(token, cursors[-1], page_size, filter_key)
+total_misclassified = load_misclassified_count(token, filter_key)
+
+st.write(f"{total_misclassified} matching documents, page {len(cursors)} of {max(1, -(-total_misclassified // page_size))}")
+if page:
+    page_df = pd.DataFrame(page)
+    page_df['high_confidence_classes'] = page_df['high_confidence_classes'].apply(lambda x: json.loads(x) if x else [])
+    st.dataframe(page_df.drop(columns=["id"]), use_container_width=True, hide_index=True)
+else:
+    st.write("No misclassified documents match these filters.")
+
+prev_col, next_col = st.columns(2)
+with prev_col:
+    if st.button("Previous page", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+with next_col:
+    if st.button("Next page", disabled=len(page) < page_size):
+        cursors.append(page[-1]["id"])
+        st.rerun()
+
 # Add a new row for process metadata visualizations
 st.markdown("---")
 st.subheader("Process Metadata Analysis")
 col5, col6 = st.columns(2)
 
+process_metrics = load_process_metrics(token)
+
 with col5:
     st.subheader("Processing Time Distribution")
 
-    # Extract processing times
-    processing_times = []
-    for metadata_str in df['process_metadata']:
-        try:
-            if metadata_str and isinstance(metadata_str, str):
-                metadata = json.loads(metadata_str)
-                times = {
-                    'OCR': metadata.get('OCR', {}).get('time', 0),
-                    'Text Cleaning': metadata.get('Text Cleaning', {}).get('time', 0),
-                    'Classification': metadata.get('Classification', {}).get('time', 0)
-                }
-                processing_times.append(times)
-            elif isinstance(metadata_str, dict):  # If it's already a dictionary
-                times = {
-                    'OCR': metadata_str.get('OCR', {}).get('time', 0),
-                    'Text Cleaning': metadata_str.get('Text Cleaning', {}).get('time', 0),
-                    'Classification': metadata_str.get('Classification', {}).get('time', 0)
-                }
-                processing_times.append(times)
-        except (json.JSONDecodeError, AttributeError) as e:
-            st.warning(f"Skipping invalid metadata entry: {e}")
-            continue
-    
-    time_df = pd.DataFrame(processing_times)
-    
-    # Create box plot for processing times
+    # Box plot drawn from the percentiles computed in SQL
+    stage_times = process_metrics["stage_times"]
     fig_box = go.Figure()
-    for column in time_df.columns:
-        fig_box.add_trace(go.Box(y=time_df[column], name=column))
+    for stage, stats in stage_times.items():
+        if not stats["percentiles"]:
+            continue
+        minimum, q1, median, q3, maximum = (stats["percentiles"][p] for p in (0, 25, 50, 75, 100))
+        fig_box.add_trace(go.Box(
+            name=stage, x=[stage], q1=[q1], median=[median], q3=[q3], lowerfence=[minimum], upperfence=[maximum], mean=[stats["mean"]]
+        ))
     
     fig_box.update_layout(
         title="Distribution of Processing Times by Stage",
@@ -139,43 +208,46 @@ with col5:
     
     # Add average processing time metrics
     st.write("Average Processing Times:")
-    for column in time_df.columns:
-        st.metric(f"{column} Avg Time", f"{time_df[column].mean():.2f}s")
+    for stage, stats in stage_times.items():
+        st.metric(f"{stage} Avg Time", f"{stats['mean'] or 0:.2f}s")
 
 with col6:
     st.subheader("Cost Analysis")
     
-    costs = []
-    for metadata_str in df['process_metadata']:
-        try:
-            if isinstance(metadata_str, str):
-                metadata = json.loads(metadata_str)
-            else:
-                metadata = metadata_str
-            cost = metadata.get('Classification', {}).get('cost', 0)
-            costs.append(cost)
-        except (json.JSONDecodeError, AttributeError) as e:
-            costs.append(0)
-    # Create histogram for cost distribution
-    fig_cost = px.histogram(
-        x=costs,
+    costs = process_metrics["costs"]
+    # Create histogram for cost distribution from the SQL bins
+    cost_df = pd.DataFrame(costs["histogram"], columns=["start", "end", "count"])
+    fig_cost = px.bar(
+        cost_df,
+        x=(cost_df["start"] + cost_df["end"]) / 2,
+        y="count",
         title="Distribution of Classification Costs",
-        labels={'x': 'Cost ($)', 'y': 'Count'},
+        labels={'x': 'Cost ($)', 'count': 'Count'},
         color_discrete_sequence=["#00CC96"]
     )
     st.plotly_chart(fig_cost, use_container_width=True)
     
     # Add cost metrics
-    total_cost = sum(costs)
-    avg_cost = total_cost / len(costs) if costs else 0
-    st.metric("Total Classification Cost", f"${total_cost:.4f}")
-    st.metric("Average Cost per Document", f"${avg_cost:.4f}")
+    st.metric("Total Classification Cost", f"${costs['total']:.4f}")
+    st.metric("Average Cost per Document", f"${costs['mean']:.4f}")
     
-    # Create timeline plot of processing times
-    timeline_df = pd.DataFrame(processing_times).cumsum()
+    # Create timeline plot of processing times, summed per day
+    timeline_df = pd.DataFrame(process_metrics["daily_times"], columns=["day", *stage_times]).set_index("day").fillna(0).cumsum()
     fig_timeline = px.line(
         timeline_df,
         title="Cumulative Processing Time by Stage",
         labels={'value': 'Cumulative Time (s)', 'variable': 'Stage'},
     )
-    st.plotly_chart(fig_timeline, use_container_width=True)
\ No newline at end of file
+    st.plotly_chart(fig_timeline, use_container_width=True)
+
+# Document inspector: the text of one document is only fetched once it is selected
+st.markdown("---")
+st.subheader("Document Inspector")
+selected_file = st.text_input("File name")
+if selected_file:
+    raw_text, cleaned_text = load_document_text(token, selected_file)
+    text_col1, text_col2 = st.columns(2)
+    with text_col1:
+        st.text_area("Raw text", raw_text or "", height=400)
+    with text_col2:
+        st.text_area("Cleaned text", cleaned_text or "", height=400)
@@ -1,5 +1,6 @@
 import os
 from .modules.data_processor import process_pdfs
+from .modules.database import init_db
 
 # Load environment-specific config
 environment = os.getenv("ENV", "development")  # Default to 'development' if ENV is not set
@@ -14,7 +15,8 @@ Config.CLAIM_LOCATION = "/Users/deveshsurve/UNIVERSITY/PROJECT/classify-pdf/data
 def main():
     path_to_process = Config.CLAIM_LOCATION 
     print(f"Running {Config.APP_NAME} with {environment} configuration")
-    process_pdfs(path_to_process)
+    init_db()
+    process_pdfs(path_to_process, workers=Config.NUM_WORKERS)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,219 @@
+import random
+from collections import defaultdict
+from sqlalchemy import text
+from typing import Dict, List, Tuple
+
+# Dashboard label -> documents column
+STAGE_COLUMNS = {
+    "OCR": "ocr_time",
+    "Text Cleaning": "cleaning_time",
+    "Classification": "classification_time",
+}
+
+LABELLED = "classified_category IS NOT NULL AND ground_truth IS NOT NULL"
+
+def change_token(bind) -> Tuple:
+    """
+    Cheap fingerprint of the documents table: it changes when rows are added, deleted, re-saved
+    or edited in place, such as when ground truth is labelled, so cached aggregates can be keyed
+    on it. The revision column is bumped by a trigger on every write; its maximum is read from
+    the column index in a subquery of its own.
+    """
+    with bind.connect() as connection:
+        return tuple(connection.execute(text(
+            "SELECT (SELECT COUNT(*) FROM documents), (SELECT MAX(revision) FROM documents)"
+        )).one())
+
+def confusion_pairs(bind) -> List[Tuple[str, str, int]]:
+    """
+    (ground_truth, classified_category, count) for every pair seen among labelled documents.
+    """
+    with bind.connect() as connection:
+        return [tuple(row) for row in connection.execute(text(
+            f"SELECT ground_truth, classified_category, COUNT(*) FROM documents WHERE {LABELLED} "
+            "GROUP BY ground_truth, classified_category ORDER BY ground_truth, classified_category"
+        ))]
+
+def classification_summary(pairs: List[Tuple[str, str, int]]) -> Dict:
+    """
+    Accuracy, weighted F1, weighted one-vs-rest ROC AUC of the hard predictions, and a report in
+    the layout of sklearn's classification_report(output_dict=True), all from confusion_pairs.
+    """
+    true_counts, predicted_counts, correct = defaultdict(int), defaultdict(int), defaultdict(int)
+    for true_label, predicted_label, count in pairs:
+        true_counts[true_label] += count
+        predicted_counts[predicted_label] += count
+        if true_label == predicted_label:
+            correct[true_label] += count
+    total = sum(true_counts.values())
+    if not total:
+        return {"total": 0, "accuracy": None, "weighted_f1": None, "auc": None, "report": {},
+                "true_counts": {}, "predicted_counts": {}}
+
+    report = {}
+    for label in sorted(set(true_counts) | set(predicted_counts)):
+        hits, predicted, support = correct.get(label, 0), predicted_counts.get(label, 0), true_counts.get(label, 0)
+        precision = hits / predicted if predicted else 0.0
+        recall = hits / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        report[label] = {"precision": precision, "recall": recall, "f1-score": f1, "support": support}
+    accuracy = sum(correct.values()) / total
+    report["accuracy"] = accuracy
+    labels = [label for label in report if label != "accuracy"]
+    for name, weight in [("macro avg", lambda label: 1 / len(labels)), ("weighted avg", lambda label: report[label]["support"] / total)]:
+        report[name] = {metric: sum(report[label][metric] * weight(label) for label in labels) for metric in ("precision", "recall", "f1-score")}
+        report[name]["support"] = total
+
+    # With 0/1 scores the one-vs-rest AUC of a class is (1 + TPR - FPR) / 2
+    auc = None
+    if len(true_counts) > 1:
+        auc = 0.0
+        for label, support in true_counts.items():
+            hits = correct.get(label, 0)
+            false_positive_rate = (predicted_counts.get(label, 0) - hits) / (total - support)
+            auc += (1 + hits / support - false_positive_rate) / 2 * support / total
+
+    return {
+        "total": total,
+        "accuracy": accuracy,
+        "weighted_f1": report["weighted avg"]["f1-score"],
+        "auc": auc,
+        "report": report,
+        "true_counts": dict(true_counts),
+        "predicted_counts": dict(predicted_counts),
+    }
+
+def nearest_rank(values: List[float], percentile: float) -> float:
+    return values[min(len(values) - 1, round(percentile / 100 * (len(values) - 1)))]
+
+def sample_stage_times(connection, sample_size: int) -> Dict[str, List[float]]:
+    """
+    Sorted values of every stage time column: all of them when the table spans at most
+    sample_size ids, else those of sample_size rows drawn at random by primary key, so the cost
+    does not grow with the table. The seed is the highest id, so the sample only changes when
+    rows are added.
+    """
+    columns = list(STAGE_COLUMNS.values())
+    low_id, high_id = connection.execute(text(
+        "SELECT (SELECT MIN(id) FROM documents), (SELECT MAX(id) FROM documents)"
+    )).one()
+    if low_id is None:
+        return {column: [] for column in columns}
+    where = ""
+    if high_id - low_id >= sample_size:
+        # Generated integers are inlined: one statement, with no bound parameter limit to respect
+        ids = random.Random(high_id).sample(range(low_id, high_id + 1), sample_size)
+        where = f" WHERE id IN ({', '.join(str(row_id) for row_id in ids)})"
+    rows = connection.execute(text(f"SELECT {', '.join(columns)} FROM documents{where}")).all()
+    return {column: sorted(row[index] for row in rows if row[index] is not None) for index, column in enumerate(columns)}
+
+def stage_time_stats(bind, percentiles=(0, 25, 50, 75, 100), sample_size: int = 10000) -> Dict[str, Dict]:
+    """
+    Count, mean and percentiles of every stage time. PostgreSQL computes exact percentiles
+    with percentile_disc in a single aggregate. Elsewhere they are nearest-rank percentiles
+    estimated from sample_stage_times, exact on tables of up to sample_size rows; the 0th and
+    100th percentiles are always the exact minimum and maximum, read from the column indexes.
+    """
+    stats = {}
+    with bind.connect() as connection:
+        samples = sample_stage_times(connection, sample_size) if bind.dialect.name != "postgresql" else {}
+        for stage, column in STAGE_COLUMNS.items():
+            count, mean = connection.execute(text(
+                f"SELECT COUNT({column}), AVG({column}) FROM documents"
+            )).one()
+            values = {}
+            if count and bind.dialect.name == "postgresql":
+                results = connection.execute(text(
+                    f"SELECT percentile_disc(CAST(:fractions AS double precision[])) WITHIN GROUP (ORDER BY {column}) FROM documents"
+                ), {"fractions": [percentile / 100 for percentile in percentiles]}).scalar()
+                values = dict(zip(percentiles, results))
+            elif count:
+                # Separate subqueries, so each is a single index lookup
+                minimum, maximum = connection.execute(text(
+                    f"SELECT (SELECT MIN({column}) FROM documents), (SELECT MAX({column}) FROM documents)"
+                )).one()
+                sample = samples[column] or [minimum, maximum]
+                for percentile in percentiles:
+                    values[percentile] = minimum if percentile <= 0 else maximum if percentile >= 100 else nearest_rank(sample, percentile)
+            stats[stage] = {"count": count, "mean": mean, "percentiles": values}
+    return stats
+
+def cost_summary(bind, bins: int = 30) -> Dict:
+    """
+    Total and mean classification cost, and a histogram of equal-width bins computed in SQL.
+    """
+    with bind.connect() as connection:
+        count, total, mean, low, high = connection.execute(text(
+            "SELECT COUNT(classification_cost), SUM(classification_cost), AVG(classification_cost), "
+            "MIN(classification_cost), MAX(classification_cost) FROM documents"
+        )).one()
+        histogram = []
+        if count:
+            width = (high - low) / bins or 1.0
+            # CAST truncates on SQLite, which has no FLOOR in default builds, but rounds on PostgreSQL
+            bin_number = "(classification_cost - :low) / :width"
+            bin_number = f"FLOOR({bin_number})" if bind.dialect.name == "postgresql" else f"CAST({bin_number} AS INTEGER)"
+            rows = connection.execute(text(
+                f"SELECT {bin_number} AS bin, COUNT(*) "
+                "FROM documents WHERE classification_cost IS NOT NULL GROUP BY bin ORDER BY bin"
+            ), {"low": low, "width": width})
+            # The maximum lands in bin `bins`; fold it into the last bin
+            folded = defaultdict(int)
+            for bin_index, bin_count in rows:
+                folded[min(int(bin_index), bins - 1)] += bin_count
+            histogram = [(low + bin_index * width, low + (bin_index + 1) * width, bin_count) for bin_index, bin_count in sorted(folded.items())]
+    return {"count": count, "total": total or 0.0, "mean": mean or 0.0, "histogram": histogram}
+
+def daily_stage_times(bind) -> List[Tuple]:
+    """
+    (day, OCR, Text Cleaning, Classification) time totals per processing day.
+    """
+    sums = ", ".join(f"SUM({column})" for column in STAGE_COLUMNS.values())
+    with bind.connect() as connection:
+        return [tuple(row) for row in connection.execute(text(
+            f"SELECT DATE(processed_at) AS day, {sums} FROM documents "
+            "WHERE processed_at IS NOT NULL GROUP BY day ORDER BY day"
+        ))]
+
+def misclassified_filters(ground_truth=None, classified_category=None, min_confidence=None, max_confidence=None,
+                         processed_from=None, processed_to=None) -> Tuple[str, Dict]:
+    """
+    WHERE clause and parameters selecting misclassified documents, optionally narrowed to a
+    class pair, a confidence range and a processing date range. Dates are ISO strings such as
+    "2026-10-17", which compare correctly with stored timestamps on SQLite and PostgreSQL;
+    processed_to is exclusive.
+    """
+    conditions = [LABELLED, "classified_category <> ground_truth"]
+    params = {}
+    for column, operator, name, value in [
+        ("ground_truth", "=", "ground_truth", ground_truth),
+        ("classified_category", "=", "classified_category", classified_category),
+        ("confidence", ">=", "min_confidence", min_confidence),
+        ("confidence", "<=", "max_confidence", max_confidence),
+        ("processed_at", ">=", "processed_from", processed_from),
+        ("processed_at", "<", "processed_to", processed_to),
+    ]:
+        if value is not None:
+            conditions.append(f"{column} {operator} :{name}")
+            params[name] = value
+    return " AND ".join(conditions), params
+
+def count_misclassified(bind, **filters) -> int:
+    where, params = misclassified_filters(**filters)
+    with bind.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM documents WHERE {where}"), params).scalar()
+
+def misclassified_page(bind, after_id: int = None, limit: int = 25, **filters) -> List[Dict]:
+    """
+    One page of misclassified documents in id order. Pages are keyset-paginated: pass the id of
+    the last row of the previous page as after_id, so each page costs the same however deep it is.
+    """
+    where, params = misclassified_filters(**filters)
+    if after_id is not None:
+        where += " AND id > :after_id"
+        params["after_id"] = after_id
+    with bind.connect() as connection:
+        return [dict(row) for row in connection.execute(text(
+            "SELECT id, file_name, ground_truth, classified_category, confidence, high_confidence_classes, processed_at "
+            f"FROM documents WHERE {where} ORDER BY id LIMIT :limit"
+        ), {**params, "limit": limit}).mappings()]
@@ -1,18 +1,19 @@
 import os
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from loguru import logger
-from .database import save_processing_data
+from .database import DocumentWriter, find_processed_documents, copy_processed_document, engine as database_engine
 from .llm_classifier import LLMClassifier
+from .rules_classifier import RulesClassifier, CascadeClassifier
+from .embedding_classifier import EmbeddingClassifier
 from .data_cleaning import refined_clean_text
-from .log_config import track_time
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from .log_config import track_time, start_document_stats, count_document_stat
+from .ocr_cache import OCRCache
 from ..config.base_config import BaseConfig
 
-DATABASE_URL = BaseConfig.DATABASE_URL
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
-
 def get_pdf_files(path):
     logger.info(f"Checking if path is a file or directory: {path}")
     if os.path.isfile(path) and path.endswith(".pdf"):
@@ -25,46 +26,485 @@ def get_pdf_files(path):
         logger.error(f"Provided path is neither a PDF file nor a directory containing PDFs: {path}")
         raise ValueError("Provided path is neither a PDF file nor a directory containing PDFs.")
 
+_ocr_cache = None
+
+def get_ocr_cache():
+    """
+    Return this process's page OCR cache, or None when disabled.
+    """
+    global _ocr_cache
+    if _ocr_cache is None and BaseConfig.OCR_CACHE_ENABLED:
+        _ocr_cache = OCRCache()
+    return _ocr_cache
+
+def ocr_images(images, ocr_workers=None):
+    """
+    Run tesseract over a list of page images and return the page texts in order.
+    Pages already seen with the same OCR settings are served from the OCR cache.
+    """
+    import pytesseract
+    ocr_workers = ocr_workers or BaseConfig.OCR_WORKERS
+    tesseract_config = f"--psm {BaseConfig.OCR_PSM}"
+
+    def image_to_string(image):
+        return pytesseract.image_to_string(image, lang=BaseConfig.OCR_LANG, config=tesseract_config)
+
+    # Cache lookups stay on this thread; only the misses are OCR'd in the pool
+    cache = get_ocr_cache()
+    keys = [OCRCache.make_key(image, BaseConfig.OCR_DPI, BaseConfig.OCR_LANG, BaseConfig.OCR_PSM) for image in images] if cache else []
+    page_texts = [cache.get(key) for key in keys] if cache else [None] * len(images)
+    missing = [index for index, page_text in enumerate(page_texts) if page_text is None]
+    if cache:
+        count_document_stat("cache_hits", len(images) - len(missing))
+        count_document_stat("cache_misses", len(missing))
+    missing_images = [images[index] for index in missing]
+
+    if ocr_workers > 1 and len(missing_images) > 1:
+        # tesseract runs as a subprocess, so threads give real parallelism; map keeps page order
+        logger.info(f"Running OCR on {len(missing_images)} pages with {ocr_workers} workers")
+        with ThreadPoolExecutor(max_workers=ocr_workers) as executor:
+            ocr_texts = list(executor.map(image_to_string, missing_images))
+    else:
+        ocr_texts = [image_to_string(image) for image in missing_images]
+
+    for index, page_text in zip(missing, ocr_texts):
+        page_texts[index] = page_text
+        if cache:
+            cache.put(keys[index], page_text)
+    return page_texts
+
+def page_windows(pages, page_window):
+    """
+    Group sorted page numbers into contiguous (first_page, last_page) runs of at most page_window pages.
+    """
+    windows = []
+    for page in pages:
+        if windows and page == windows[-1][1] + 1 and page - windows[-1][0] < page_window:
+            windows[-1] = (windows[-1][0], page)
+        else:
+            windows.append((page, page))
+    return windows
+
+def iter_text_ocr(pdf_file, page_window=None, ocr_workers=None, pages=None):
+    """
+    Rasterize and OCR a PDF a window of pages at a time, yielding page text as it is produced.
+    Only page_window images are held in memory at once, whatever the page count.
+    pages restricts OCR to the given 1-based page numbers.
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    page_window = page_window or BaseConfig.OCR_PAGE_WINDOW
+    if pages is None:
+        pages = range(1, pdfinfo_from_path(pdf_file)["Pages"] + 1)
+    logger.info(f"Streaming OCR over {len(pages)} pages, {page_window} at a time")
+    for first_page, last_page in page_windows(sorted(pages), page_window):
+        images = convert_from_path(pdf_file, dpi=BaseConfig.OCR_DPI, first_page=first_page, last_page=last_page)
+        for page_text in ocr_images(images, ocr_workers):
+            yield page_text
+        del images
+
+# PyMuPDF does not support multithreading, so documents are read one at a time per process;
+# reading the text layer is fast next to OCR, which stays parallel
+_pymupdf_lock = threading.Lock()
+
+def extract_text_layer(pdf_file):
+    """
+    Return (embedded text, share of the page covered by images) for every page using PyMuPDF.
+    Scanned pages come back with little or no text and an image over most of the page.
+    """
+    import pymupdf
+    pages = []
+    with _pymupdf_lock, pymupdf.open(pdf_file) as doc:
+        for page in doc:
+            image_area = sum(abs(pymupdf.Rect(image["bbox"]) & page.rect) for image in page.get_image_info())
+            pages.append((page.get_text(), min(1.0, image_area / abs(page.rect)) if abs(page.rect) else 0.0))
+    return pages
+
+def is_usable_text(text, image_coverage=0.0, min_chars=None):
+    """
+    Decide whether a page's text layer can be used as-is or the page needs OCR.
+    A short or empty text layer only sends the page to OCR when images cover most of it, as on a
+    scan with a stamped fax header; short born-digital pages such as cover or signature pages
+    keep their text. Longer text layers are OCR'd when mostly non-printable or symbol noise.
+    """
+    min_chars = BaseConfig.MIN_TEXT_LAYER_CHARS if min_chars is None else min_chars
+    stripped = text.strip()
+    if len(stripped) < min_chars:
+        return image_coverage < BaseConfig.OCR_IMAGE_COVERAGE
+    readable = sum(1 for char in stripped if char.isalnum() or char.isspace() or char in ".,:;/%-()#$'")
+    return readable / len(stripped) >= 0.8
+
 @track_time
-def extract_text_ocr(pdf_file):
+def extract_text_ocr(pdf_file, ocr_workers=None, page_window=None):
     logger.info(f"Extracting text from PDF file: {pdf_file}")
-    from pdf2image import convert_from_path
-    import pytesseract
-    images = convert_from_path(pdf_file, dpi=300)
-    logger.info(f"Converted PDF to {len(images)} images")
-    text = ''.join(pytesseract.image_to_string(image) + "\n" for image in images)
+    page_window = BaseConfig.OCR_PAGE_WINDOW if page_window is None else page_window
+    if page_window > 0:
+        page_texts = iter_text_ocr(pdf_file, page_window, ocr_workers)
+    else:
+        from pdf2image import convert_from_path
+        images = convert_from_path(pdf_file, dpi=BaseConfig.OCR_DPI)
+        logger.info(f"Converted PDF to {len(images)} images")
+        page_texts = ocr_images(images, ocr_workers)
+    text = ''.join(page_text + "\n" for page_text in page_texts)
     logger.info(f"Extracted text from image successfully")
     return text
 
 @track_time
-def process_pdfs(path):
-    pdf_files = get_pdf_files(path)
-    classifier = LLMClassifier()
+def extract_text(pdf_file):
+    """
+    Extract text from a PDF, using the embedded text layer where it is usable and OCR only for the rest.
+
+    Returns:
+        Tuple of (text, extraction metadata with the path each page took)
+    """
+    cache = get_ocr_cache()
+    stats = start_document_stats()
+
+    def cache_stats():
+        if not cache:
+            return {}
+        return {"cache_hits": stats.get("cache_hits", 0), "cache_misses": stats.get("cache_misses", 0)}
+
+    if not BaseConfig.TEXT_LAYER_FAST_PATH:
+        raw_text, _ = extract_text_ocr(pdf_file)
+        return raw_text, {"method": "ocr", **cache_stats()}
+
+    logger.info(f"Reading text layer from PDF file: {pdf_file}")
+    start_time = time.time()
+    text_layer = extract_text_layer(pdf_file)
+    text_layer_time = time.time() - start_time
+    page_texts = [page_text for page_text, _ in text_layer]
+    page_sources = ["text_layer" if is_usable_text(page_text, image_coverage) else "ocr" for page_text, image_coverage in text_layer]
+    ocr_pages = [page for page, source in enumerate(page_sources, start=1) if source == "ocr"]
+    logger.info(f"{len(page_texts) - len(ocr_pages)} of {len(page_texts)} pages have a usable text layer")
 
-    for pdf_file in pdf_files:
-        logger.info(f"Processing file: {pdf_file}")
+    ocr_time = 0.0
+    if ocr_pages:
+        start_time = time.time()
+        for page, page_text in zip(ocr_pages, iter_text_ocr(pdf_file, pages=ocr_pages)):
+            page_texts[page - 1] = page_text
+        ocr_time = time.time() - start_time
+
+    text = ''.join(page_text + "\n" for page_text in page_texts)
+    return text, {
+        "method": "hybrid",
+        "text_layer_time": text_layer_time,
+        "ocr_time": ocr_time,
+        "pages": page_sources,
+        **cache_stats(),
+    }
+
+def file_hash(pdf_file):
+    """
+    SHA-256 of the file contents, read in chunks.
+    """
+    sha256 = hashlib.sha256()
+    with open(pdf_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def select_files_to_process(pdf_files, pipeline_version):
+    """
+    Hash every file and drop the ones already processed with this pipeline version.
+    Renamed or copied files whose content was already processed get the stored results
+    under their new name without being processed again.
+
+    Returns:
+        Tuple of ([(pdf_file, content_hash)] to process, {pdf_file: content_hash} of duplicates
+        within this run, to be copied once their original is processed)
+    """
+    content_hashes = {pdf_file: file_hash(pdf_file) for pdf_file in pdf_files}
+    processed = find_processed_documents(set(content_hashes.values()), pipeline_version)
+    to_process, duplicates, seen_hashes = [], {}, set()
+    for pdf_file, content_hash in content_hashes.items():
         file_name = os.path.basename(pdf_file)
-        file_location = pdf_file
-        process_metadata = {}
-
-        raw_text, ocr_time = extract_text_ocr(pdf_file)
-        process_metadata["OCR"] = {"time": ocr_time}
-
-        cleaned_text, clean_time = refined_clean_text(raw_text)
-        process_metadata["Text Cleaning"] = {"time": clean_time}
-
-        (predicted_class, confidence, high_conf_classes, classify_cost), classify_time = classifier.classify_document(cleaned_text, file_name)
-        process_metadata["Classification"] = {"time": classify_time, "cost": classify_cost}
-
-        save_processing_data(
-            file_name,
-            file_location,
-            raw_text,
-            cleaned_text,
-            predicted_class,
-            confidence,
-            process_metadata,
-            high_conf_classes
+        doc = processed.get(content_hash)
+        if doc is not None:
+            if doc.file_name != file_name:
+                logger.info(f"File {file_name} is identical to already processed {doc.file_name}, reusing results")
+                copy_processed_document(doc, file_name, pdf_file)
+            else:
+                logger.info(f"Skipping unchanged file: {file_name}")
+        elif content_hash in seen_hashes:
+            duplicates[pdf_file] = content_hash
+        else:
+            seen_hashes.add(content_hash)
+            to_process.append((pdf_file, content_hash))
+    return to_process, duplicates
+
+def new_result(pdf_file, content_hash=None):
+    """
+    Start the result record of a document; the run_* stages below fill it in.
+    """
+    return {
+        "file_name": os.path.basename(pdf_file),
+        "file_location": pdf_file,
+        "metadata": {},
+        "content_hash": content_hash,
+        "pipeline_version": BaseConfig.PIPELINE_VERSION,
+    }
+
+def run_extraction(result):
+    logger.info(f"Processing file: {result['file_location']}")
+    (raw_text, extraction_metadata), ocr_time = extract_text(result["file_location"])
+    result["raw_text"] = raw_text
+    result["metadata"]["OCR"] = {"time": ocr_time, **extraction_metadata}
+    return result
+
+def run_cleaning(result):
+    cleaned_text, clean_time = refined_clean_text(result["raw_text"])
+    result["cleaned_text"] = cleaned_text
+    result["metadata"]["Text Cleaning"] = {"time": clean_time}
+    return result
+
+def finish_classification(result, classifier, classification, classify_time, stats):
+    predicted_class, confidence, high_conf_classes, classify_cost = classification
+    result["classified_category"] = predicted_class
+    result["confidence"] = confidence
+    result["high_conf_classes"] = high_conf_classes
+    result["metadata"]["Classification"] = {
+        "time": classify_time,
+        "cost": classify_cost,
+        "mode": classifier.classification_mode,
+        "tier": stats.get("tier", classifier.last_tier),
+        "cache_hits": stats.get("cache_hits", 0),
+        "cache_misses": stats.get("cache_misses", 0),
+        "prompt_tokens": stats.get("prompt_tokens", 0),
+        "completion_tokens": stats.get("completion_tokens", 0),
+        "cached_tokens": stats.get("cached_tokens", 0),
+        "limiter_wait": stats.get("limiter_wait", 0.0),
+        "retries": stats.get("llm_retries", 0),
+        "excerpt": stats.get("excerpt"),
+    }
+    return result
+
+def run_classification(result, classifier):
+    stats = start_document_stats()
+    if BaseConfig.LLM_ASYNC:
+        classification, classify_time = asyncio.run(classifier.aclassify_document(result["cleaned_text"], result["file_name"]))
+    else:
+        classification, classify_time = classifier.classify_document(result["cleaned_text"], result["file_name"])
+    return finish_classification(result, classifier, classification, classify_time, stats)
+
+async def arun_classification(result, classifier):
+    """
+    Async variant of run_classification, for documents classified concurrently on one event loop.
+    """
+    stats = start_document_stats()
+    classification, classify_time = await classifier.aclassify_document(result["cleaned_text"], result["file_name"])
+    return finish_classification(result, classifier, classification, classify_time, stats)
+
+async def arun_classification_batch(results, classifier):
+    """
+    Classify documents that are ready at the same time together: classifier.decide_batch scores
+    them in one go (one embedding encode for the batch), and the documents it leaves undecided
+    are classified concurrently one by one. Each document keeps its own stats.
+
+    Returns:
+        The classified result, or the exception it failed with, for each document
+    """
+    start = time.perf_counter()
+    decisions = await asyncio.to_thread(classifier.decide_batch, [result["cleaned_text"] for result in results])
+    batch_time = (time.perf_counter() - start) / len(results)
+
+    async def finish(result, decision):
+        stats = start_document_stats()
+        if decision is None:
+            classification, classify_time = await classifier.aclassify_undecided(result["cleaned_text"], result["file_name"])
+            classify_time += batch_time
+        else:
+            classification, stats["tier"] = decision
+            classify_time = batch_time
+        return finish_classification(result, classifier, classification, classify_time, stats)
+
+    return await asyncio.gather(*(finish(result, decision) for result, decision in zip(results, decisions)), return_exceptions=True)
+
+def process_document(pdf_file, classifier, content_hash=None):
+    """
+    Run text extraction, cleaning and classification for a single PDF and return the result record.
+    """
+    result = new_result(pdf_file, content_hash)
+    return run_classification(run_cleaning(run_extraction(result)), classifier)
+
+def save_result(result, writer):
+    writer.add(
+        result["file_name"],
+        result["file_location"],
+        result["raw_text"],
+        result["cleaned_text"],
+        result["classified_category"],
+        result["confidence"],
+        result["metadata"],
+        result["high_conf_classes"],
+        result["content_hash"],
+        result["pipeline_version"]
+    )
+    logger.info(f"File: {result['file_location']}, Predicted Class: {result['classified_category']}, Confidence: {result['confidence']}")
+    logger.info(f"Process Metadata: {result['metadata']}")
+
+def create_classifier(classifier_name=None, classification_mode=None):
+    """
+    Build the classifier for a run: "llm", "rules", "embedding", or "cascade", which tries the
+    CASCADE_TIERS in order and only consults later tiers for ambiguous documents.
+    """
+    classifier_name = classifier_name or BaseConfig.CLASSIFIER
+    if classifier_name == "llm":
+        return LLMClassifier(classification_mode=classification_mode)
+    if classifier_name == "rules":
+        return RulesClassifier()
+    if classifier_name == "embedding":
+        return EmbeddingClassifier()
+    if classifier_name == "cascade":
+        tiers = [tier.strip() for tier in BaseConfig.CASCADE_TIERS.split(",")]
+        return CascadeClassifier([create_classifier(tier, classification_mode) for tier in tiers])
+    raise ValueError(f"Unknown classifier: {classifier_name}")
+
+DOCUMENT_QUEUE = "documents"
+
+def process_document_job(payload, classifier, writer):
+    result = process_document(payload["pdf_file"], classifier, payload["content_hash"])
+    save_result(result, writer)
+    writer.flush()  # the result must be stored before the job is marked done
+
+def work_document_queue(classifier_name=None, classification_mode=None, exit_when_drained=True):
+    """
+    Process jobs from the document queue until it is drained, or forever. Any number of these
+    can run at once, in other processes or on other hosts sharing the database.
+    """
+    from .job_queue import JobQueue, run_worker
+    classifier = create_classifier(classifier_name, classification_mode)
+    with DocumentWriter() as writer:
+        return run_worker(
+            JobQueue(DOCUMENT_QUEUE),
+            lambda payload: process_document_job(payload, classifier, writer),
+            exit_when_drained=exit_when_drained
         )
-        logger.info(f"File: {file_location}, Predicted Class: {predicted_class}, Confidence: {confidence}")
-        logger.info(f"Process Metadata: {process_metadata}")
+
+def enqueue_documents(to_process, pipeline_version):
+    """
+    Add a job per document. The key is the content hash and pipeline version, so rerunning over
+    the same files does not queue work that is already queued, done or dead-lettered.
+    """
+    from .job_queue import JobQueue
+    job_queue = JobQueue(DOCUMENT_QUEUE)
+    skipped = []
+    for pdf_file, content_hash in to_process:
+        key = f"{pipeline_version}:{content_hash}"
+        if not job_queue.enqueue(key, {"pdf_file": pdf_file, "content_hash": content_hash}):
+            skipped.append(key)
+    logger.info(f"Queued {len(to_process) - len(skipped)} of {len(to_process)} documents, queue status: {job_queue.counts()}")
+    dead = sum(status == "dead" for status in job_queue.statuses(skipped).values()) if skipped else 0
+    if dead:
+        logger.warning(f"{dead} documents were not queued because their jobs are dead-lettered; "
+                       "run worker.py --retry-dead-letters (make retry-dead-letters) to process them again")
+    return job_queue
+
+def retry_dead_documents():
+    """
+    Put the dead-lettered document jobs back in the queue with a fresh attempt budget, e.g. after
+    fixing what made them fail.
+    """
+    from .job_queue import JobQueue
+    retried = JobQueue(DOCUMENT_QUEUE).retry_dead_letters()
+    logger.info(f"Requeued {retried} dead-lettered documents")
+    return retried
+
+def _dispose_inherited_engines():
+    """
+    Pool initializer: drop the database connections a forked worker inherited from the parent,
+    without closing them, so the worker opens its own instead of sharing the parent's sockets
+    and SQLite file handles.
+    """
+    database_engine.dispose(close=False)
+
+# Each pool worker builds its own classifier once instead of pickling one per task
+_worker_classifier = None
+
+def _init_worker(classifier_name, classification_mode):
+    global _worker_classifier
+    _dispose_inherited_engines()
+    _worker_classifier = create_classifier(classifier_name, classification_mode)
+
+def _process_in_worker(pdf_file, content_hash):
+    return process_document(pdf_file, _worker_classifier, content_hash)
+
+def run_document_pool(to_process, writer, workers, task=_process_in_worker, initializer=_init_worker, initargs=(), mp_context=None):
+    """
+    Run task(pdf_file, content_hash) for [(pdf_file, content_hash)] in a process pool and save
+    each result from this process as it completes. Documents that fail are logged and skipped.
+
+    Returns:
+        Number of failed documents
+    """
+    logger.info(f"Processing {len(to_process)} files with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs, mp_context=mp_context) as executor:
+        futures = {executor.submit(task, pdf_file, content_hash): pdf_file for pdf_file, content_hash in to_process}
+        failed = 0
+        for future in as_completed(futures):
+            # One bad file must not discard the results of the documents still running
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(f"Failed to process file: {futures[future]}")
+                failed += 1
+                continue
+            save_result(result, writer)
+    if failed:
+        logger.warning(f"{failed} of {len(to_process)} files failed and were not saved")
+    return failed
+
+@track_time
+def process_pdfs(path, workers=None, classification_mode=None, classifier_name=None, staged=None, use_queue=None):
+    """
+    Process every PDF under path. With workers > 1 whole documents run in a process pool,
+    while results are saved from this process only so the database has a single writer.
+    With staged (default BaseConfig.PIPELINE_STAGED) documents flow through a StagedPipeline
+    instead, overlapping OCR, cleaning, classification and saving of different documents.
+    With use_queue (default BaseConfig.JOB_QUEUE_ENABLED) documents become jobs in the durable
+    job queue, drained by worker processes here and by any other worker sharing the database;
+    failures are retried and dead-lettered instead of aborting the run.
+    classification_mode and classifier_name override BaseConfig.LLM_CLASSIFICATION_MODE
+    and BaseConfig.CLASSIFIER for this run.
+    Files whose content was already processed by the current pipeline version are skipped.
+    Results are written in batches of BaseConfig.DB_BATCH_SIZE documents.
+    """
+    pdf_files = get_pdf_files(path)
+    workers = workers or BaseConfig.NUM_WORKERS
+    start_time = time.time()
+    to_process, duplicates = select_files_to_process(pdf_files, BaseConfig.PIPELINE_VERSION)
+    logger.info(f"{len(to_process)} of {len(pdf_files)} files need processing")
+
+    staged = BaseConfig.PIPELINE_STAGED if staged is None else staged
+    use_queue = BaseConfig.JOB_QUEUE_ENABLED if use_queue is None else use_queue
+    if use_queue:
+        job_queue = enqueue_documents(to_process, BaseConfig.PIPELINE_VERSION)
+        if workers <= 1:
+            work_document_queue(classifier_name, classification_mode)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_dispose_inherited_engines) as executor:
+                for future in [executor.submit(work_document_queue, classifier_name, classification_mode) for _ in range(workers)]:
+                    future.result()
+        logger.info(f"Document queue status: {job_queue.counts()}")
+    else:
+        # Results are buffered and upserted in batches; leaving the block flushes the rest
+        with DocumentWriter() as writer:
+            if staged and to_process:
+                from .pipeline import StagedPipeline
+                StagedPipeline(create_classifier(classifier_name, classification_mode), writer).run(to_process)
+            elif workers <= 1:
+                classifier = create_classifier(classifier_name, classification_mode)
+                for pdf_file, content_hash in to_process:
+                    save_result(process_document(pdf_file, classifier, content_hash), writer)
+            elif to_process:
+                run_document_pool(to_process, writer, workers, initargs=(classifier_name, classification_mode))
+
+    if duplicates:
+        processed = find_processed_documents(set(duplicates.values()), BaseConfig.PIPELINE_VERSION)
+        for pdf_file, content_hash in duplicates.items():
+            if content_hash in processed:  # the original may have failed
+                copy_processed_document(processed[content_hash], os.path.basename(pdf_file), pdf_file)
+
+    elapsed_time = time.time() - start_time
+    docs_per_min = len(to_process) / elapsed_time * 60 if elapsed_time > 0 else 0.0
+    logger.info(f"Processed {len(to_process)} documents in {elapsed_time:.2f} seconds ({docs_per_min:.2f} docs/min), "
+                f"{len(pdf_files) - len(to_process)} unchanged or duplicate files reused")
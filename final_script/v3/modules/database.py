@@ -1,6 +1,10 @@
 import json
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text
-from sqlalchemy.orm import declarative_base, sessionmaker
+import time
+import zlib
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, event, inspect, select, update, text, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, String, Float, Text
+from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
 from loguru import logger
 from ..config.base_config import BaseConfig
 
@@ -8,45 +12,385 @@ DATABASE_URL = BaseConfig.DATABASE_URL
 engine = create_engine(DATABASE_URL)
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
-session = Session()
 
 class Document(Base):
     __tablename__ = 'documents'
     id = Column(Integer, primary_key=True)
     file_name = Column(String, unique=True)
     file_location = Column(Text)
-    raw_text = Column(Text)
-    cleaned_text = Column(Text)
-    classified_category = Column(String)
+    classified_category = Column(String, index=True)
     confidence = Column(Float)
     high_confidence_classes = Column(Text)
     process_metadata = Column(Text)
-    ground_truth = Column(String)  # Store the ground truth label
+    ground_truth = Column(String, index=True)  # Store the ground truth label
+    content_hash = Column(String, index=True)  # SHA-256 of the PDF bytes
+    pipeline_version = Column(String)
+    # Typed copies of the process_metadata values that the dashboard aggregates
+    processed_at = Column(DateTime, index=True)
+    revision = Column(Integer, index=True)  # bumped by a trigger on every insert and update, see REVISION_TRIGGERS
+    ocr_time = Column(Float, index=True)  # indexed for percentile lookups
+    cleaning_time = Column(Float, index=True)
+    classification_time = Column(Float, index=True)
+    classification_cost = Column(Float, index=True)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    cached_tokens = Column(Integer)  # prompt tokens served from the provider's prefix cache
+    classifier_tier = Column(String)
+    # Covers the confusion-pair GROUP BY of the dashboard
+    __table_args__ = (Index("ix_documents_labels", "ground_truth", "classified_category"),)
+    # Text bodies live in document_texts and are only loaded when accessed
+    document_text = relationship("DocumentText", uselist=False, lazy="select", cascade="all, delete-orphan")
 
-Base.metadata.create_all(engine)
+    @property
+    def raw_text(self):
+        return decompress_text(self.document_text.raw_text) if self.document_text else None
 
-def save_processing_data(file_name, file_location, raw_text, cleaned_text, classified_category, confidence, metadata, high_conf_classes):
-    process_metadata_json = json.dumps(metadata)
-    high_conf_classes_json = json.dumps(high_conf_classes)
+    @raw_text.setter
+    def raw_text(self, value):
+        self.text_row().raw_text = compress_text(value)
 
-    doc = session.query(Document).filter_by(file_name=file_name).first()
+    @property
+    def cleaned_text(self):
+        return decompress_text(self.document_text.cleaned_text) if self.document_text else None
+
+    @cleaned_text.setter
+    def cleaned_text(self, value):
+        self.text_row().cleaned_text = compress_text(value)
+
+    def text_row(self):
+        if self.document_text is None:
+            self.document_text = DocumentText(file_name=self.file_name)
+        return self.document_text
+
+class DocumentText(Base):
+    """
+    Compressed OCR and cleaned text of a document, kept apart from the compact documents rows
+    so listing and metrics queries do not read the text bodies.
+    """
+    __tablename__ = 'document_texts'
+    file_name = Column(String, ForeignKey('documents.file_name'), primary_key=True)
+    raw_text = Column(LargeBinary)  # zlib-compressed UTF-8
+    cleaned_text = Column(LargeBinary)
+
+class SchemaMigration(Base):
+    """
+    One-time data migrations already applied to this database.
+    """
+    __tablename__ = 'schema_migrations'
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime)
+
+TEXT_COLUMNS = ("raw_text", "cleaned_text")
+# Bound parameters per statement; SQLite builds before 3.32 allow at most 999
+MAX_QUERY_PARAMETERS = 900
+
+def chunked(items, size):
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def compress_text(value):
+    return zlib.compress(value.encode("utf-8"), BaseConfig.DB_TEXT_COMPRESSION_LEVEL) if value is not None else None
+
+def decompress_text(value):
+    return zlib.decompress(value).decode("utf-8") if value is not None else None
+
+# Give every inserted or updated documents row a new, higher revision, whatever wrote it, so
+# MAX(revision) tells cached dashboard aggregates about edits such as ground truth labelling.
+# SQLite triggers do not fire themselves again, and the WHEN clause skips the trigger's own update.
+REVISION_TRIGGERS = {
+    "sqlite": [
+        "CREATE TRIGGER IF NOT EXISTS documents_revision_insert AFTER INSERT ON documents BEGIN "
+        "UPDATE documents SET revision = (SELECT COALESCE(MAX(revision), 0) + 1 FROM documents) WHERE id = NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS documents_revision_update AFTER UPDATE ON documents WHEN NEW.revision IS OLD.revision BEGIN "
+        "UPDATE documents SET revision = (SELECT COALESCE(MAX(revision), 0) + 1 FROM documents) WHERE id = NEW.id; END",
+    ],
+    "postgresql": [
+        "CREATE SEQUENCE IF NOT EXISTS documents_revision_seq",
+        "CREATE OR REPLACE FUNCTION documents_next_revision() RETURNS trigger AS $$ "
+        "BEGIN NEW.revision := nextval('documents_revision_seq'); RETURN NEW; END; $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS documents_revision ON documents",
+        "CREATE TRIGGER documents_revision BEFORE INSERT OR UPDATE ON documents "
+        "FOR EACH ROW EXECUTE FUNCTION documents_next_revision()",
+    ],
+}
+
+def create_revision_triggers(bind=None):
+    bind = bind or engine
+    with bind.begin() as connection:
+        for statement in REVISION_TRIGGERS.get(bind.dialect.name, []):
+            connection.execute(text(statement))
+
+@event.listens_for(Document.__table__, "after_create")
+def _documents_created(table, connection, **kw):
+    for statement in REVISION_TRIGGERS.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+def add_missing_columns(table, bind=None):
+    """
+    create_all does not alter existing tables, so add columns introduced after a database was created.
+    """
+    bind = bind or engine
+    existing_columns = {column["name"] for column in inspect(bind).get_columns(table.name)}
+    with bind.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logger.info(f"Adding column {column.name} to table {table.name}")
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def move_text_columns(bind=None, batch_size=500):
+    """
+    Databases created before document_texts existed keep the text bodies in documents.raw_text
+    and cleaned_text. Compress them into document_texts and clear the old columns.
+    """
+    bind = bind or engine
+    existing_columns = {column["name"] for column in inspect(bind).get_columns(Document.__tablename__)}
+    legacy_columns = [column for column in TEXT_COLUMNS if column in existing_columns]
+    if not legacy_columns:
+        return
+    not_empty = " OR ".join(f"{column} IS NOT NULL" for column in legacy_columns)
+    clear = ", ".join(f"{column} = NULL" for column in legacy_columns)
+    moved = 0
+    with bind.begin() as connection:
+        while True:
+            rows = connection.execute(text(
+                f"SELECT id, file_name, {', '.join(legacy_columns)} FROM documents WHERE {not_empty} LIMIT {batch_size}"
+            )).mappings().all()
+            if not rows:
+                break
+            for row in rows:
+                exists = connection.execute(select(DocumentText.file_name).where(DocumentText.file_name == row["file_name"])).first()
+                if row["file_name"] is not None and exists is None:
+                    connection.execute(DocumentText.__table__.insert().values(
+                        file_name=row["file_name"], **{column: compress_text(row.get(column)) for column in TEXT_COLUMNS}
+                    ))
+                connection.execute(text(f"UPDATE documents SET {clear} WHERE id = :id"), {"id": row["id"]})
+            moved += len(rows)
+    if moved:
+        logger.info(f"Moved the text of {moved} documents to {DocumentText.__tablename__}")
+
+def apply_migration(name, migrate, bind=None):
+    """
+    Run migrate(bind) unless the database records it as applied, then record it, so opening the
+    database only costs a primary key lookup per migration once it has run.
+
+    Returns:
+        True if the migration ran
+    """
+    bind = bind or engine
+    with Session(bind=bind) as session:
+        if session.get(SchemaMigration, name) is not None:
+            return False
+    migrate(bind)
+    with Session(bind=bind) as session:
+        session.merge(SchemaMigration(name=name, applied_at=datetime.now(timezone.utc)))
+        session.commit()
+    logger.info(f"Applied database migration {name}")
+    return True
+
+# Typed column -> (process_metadata stage, key)
+METRIC_FIELDS = {
+    "ocr_time": ("OCR", "time"),
+    "cleaning_time": ("Text Cleaning", "time"),
+    "classification_time": ("Classification", "time"),
+    "classification_cost": ("Classification", "cost"),
+    "prompt_tokens": ("Classification", "prompt_tokens"),
+    "completion_tokens": ("Classification", "completion_tokens"),
+    "cached_tokens": ("Classification", "cached_tokens"),
+    "classifier_tier": ("Classification", "tier"),
+}
+
+def metric_columns(metadata):
+    """
+    Typed metric columns from process_metadata, given as a dict or a JSON string.
+    """
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            metadata = None
+    if not isinstance(metadata, dict):
+        metadata = {}
+    return {column: (metadata.get(stage) or {}).get(key) for column, (stage, key) in METRIC_FIELDS.items()}
+
+def backfill_metrics(bind=None):
+    """
+    Fill the typed metric columns of rows saved before they existed from their process_metadata.
+    Runs once per database through apply_migration; rows written since then have the columns set.
+    """
+    bind = bind or engine
+    with bind.begin() as connection:
+        rows = connection.execute(
+            select(Document.id, Document.process_metadata)
+            .where(Document.process_metadata.is_not(None), Document.classification_time.is_(None))
+        ).all()
+        filled = 0
+        for row_id, metadata in rows:
+            metrics = metric_columns(metadata)
+            if any(value is not None for value in metrics.values()):
+                connection.execute(update(Document).where(Document.id == row_id).values(**metrics))
+                filled += 1
+    if filled:
+        logger.info(f"Backfilled metric columns for {filled} documents")
+
+def init_db(bind=None):
+    """
+    Create missing tables, columns and indexes and apply pending migrations. Importing this
+    module does not touch the database; the entry points call this once at startup.
+    """
+    bind = bind or engine
+    Base.metadata.create_all(bind)
+    add_missing_columns(Document.__table__, bind)
+    apply_migration("move_text_columns", move_text_columns, bind)
+    apply_migration("backfill_metrics", backfill_metrics, bind)
+    apply_migration("revision_triggers", create_revision_triggers, bind)
+
+def find_processed_documents(content_hashes, pipeline_version):
+    """
+    Return {content_hash: Document} for documents already processed with this pipeline version.
+    The hashes are looked up in chunks to stay under the bound parameter limit.
+    """
+    docs = []
+    with Session() as session:
+        for hashes in chunked(content_hashes, MAX_QUERY_PARAMETERS):
+            docs.extend(session.query(Document).filter(
+                Document.content_hash.in_(hashes),
+                Document.pipeline_version == pipeline_version
+            ).all())
+    return {doc.content_hash: doc for doc in docs}
+
+def document_row(file_name, file_location, raw_text, cleaned_text, classified_category, confidence, metadata, high_conf_classes, content_hash=None, pipeline_version=None):
+    """
+    Column values of a documents row, with metadata and high-confidence classes serialized to JSON
+    and the per-stage metrics also stored as typed columns.
+    """
+    return {
+        "file_name": file_name,
+        "file_location": file_location,
+        "raw_text": raw_text,
+        "cleaned_text": cleaned_text,
+        "classified_category": classified_category,
+        "confidence": confidence,
+        "process_metadata": metadata if isinstance(metadata, str) else json.dumps(metadata),
+        "high_confidence_classes": high_conf_classes if isinstance(high_conf_classes, str) else json.dumps(high_conf_classes),
+        "content_hash": content_hash,
+        "pipeline_version": pipeline_version,
+        "processed_at": datetime.now(timezone.utc),
+        **metric_columns(metadata),
+    }
+
+def save_processing_data(file_name, file_location, raw_text, cleaned_text, classified_category, confidence, metadata, high_conf_classes, content_hash=None, pipeline_version=None):
+    row = document_row(file_name, file_location, raw_text, cleaned_text, classified_category, confidence, metadata, high_conf_classes, content_hash, pipeline_version)
+    with Session() as session:
+        store_document(session, row)
+        session.commit()
+
+def store_document(session, row):
+    doc = session.query(Document).filter_by(file_name=row["file_name"]).first()
     if not doc:
-        doc = Document(
-            file_name=file_name,
-            file_location=file_location,
-            raw_text=raw_text,
-            cleaned_text=cleaned_text,
-            classified_category=classified_category,
-            confidence=confidence,
-            process_metadata=process_metadata_json,
-            high_confidence_classes=high_conf_classes_json
-        )
-        session.add(doc)
+        session.add(Document(**row))
     else:
-        doc.raw_text = raw_text
-        doc.cleaned_text = cleaned_text
-        doc.classified_category = classified_category
-        doc.confidence = confidence
-        doc.process_metadata = process_metadata_json
-        doc.high_confidence_classes = high_conf_classes_json
-    session.commit()
+        for column, value in row.items():
+            setattr(doc, column, value)
+
+def upsert_documents(rows, bind=None):
+    """
+    Insert or update many documents rows with multi-row statements, resolving conflicts on
+    file_name, and their compressed text in further statements of the same transaction. Each
+    statement holds as many rows as fit in MAX_QUERY_PARAMETERS bound parameters.
+    Dialects without ON CONFLICT support fall back to one upsert per row.
+    """
+    bind = bind or engine
+    dialects = {"sqlite": sqlite, "postgresql": postgresql}
+    dialect = dialects.get(bind.dialect.name)
+    if dialect is None:
+        with Session(bind=bind) as session:
+            for row in rows:
+                store_document(session, row)
+            session.commit()
+        return
+    document_rows = [{column: value for column, value in row.items() if column not in TEXT_COLUMNS} for row in rows]
+    text_rows = [{"file_name": row["file_name"], **{column: compress_text(row[column]) for column in TEXT_COLUMNS}} for row in rows]
+    with bind.begin() as connection:
+        for table, table_rows in [(Document.__table__, document_rows), (DocumentText.__table__, text_rows)]:
+            for batch in chunked(table_rows, max(1, MAX_QUERY_PARAMETERS // len(table_rows[0]))):
+                statement = dialect.insert(table).values(batch)
+                statement = statement.on_conflict_do_update(
+                    index_elements=["file_name"],
+                    set_={column: statement.excluded[column] for column in batch[0] if column != "file_name"}
+                )
+                connection.execute(statement)
+
+def load_document_text(file_name, bind=None):
+    """
+    Return (raw_text, cleaned_text) of one document, or (None, None) if it has no stored text.
+    """
+    with Session(bind=bind or engine) as session:
+        doc_text = session.get(DocumentText, file_name)
+        if doc_text is None:
+            return None, None
+        return decompress_text(doc_text.raw_text), decompress_text(doc_text.cleaned_text)
+
+class DocumentWriter:
+    """
+    Buffer processed documents and write them with bulk upserts every batch_size documents or
+    every flush_seconds, whichever comes first. The time limit is checked when documents are
+    added. Use as a context manager so the buffer is flushed on shutdown, even after an error.
+    """
+    def __init__(self, batch_size=None, flush_seconds=None, bind=None):
+        self.batch_size = batch_size or BaseConfig.DB_BATCH_SIZE
+        self.flush_seconds = BaseConfig.DB_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.bind = bind or engine
+        self.buffer = {}
+        self.last_flush = time.time()
+        self.written = 0
+
+    def add(self, *args, **kwargs):
+        """
+        Queue a document; takes the same arguments as save_processing_data.
+        """
+        row = document_row(*args, **kwargs)
+        self.buffer[row["file_name"]] = row  # a later result for the same file replaces the earlier one
+        if len(self.buffer) >= self.batch_size or time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            rows = list(self.buffer.values())
+            upsert_documents(rows, self.bind)
+            self.written += len(rows)
+            logger.info(f"Saved {len(rows)} documents to the database")
+            self.buffer = {}
+        self.last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def copy_processed_document(doc, file_name, file_location):
+    """
+    Record the results of an already processed document under another file name,
+    for renamed or duplicated files with identical content. The compressed text is
+    copied as stored, without decompressing it.
+    """
+    columns = ["classified_category", "confidence", "process_metadata", "high_confidence_classes", "content_hash", "pipeline_version", *METRIC_FIELDS]
+    with Session() as session:
+        copy = session.query(Document).filter_by(file_name=file_name).first()
+        if not copy:
+            copy = Document(file_name=file_name)
+            session.add(copy)
+        copy.file_location = file_location
+        copy.processed_at = datetime.now(timezone.utc)
+        for column in columns:
+            setattr(copy, column, getattr(doc, column))
+        source_text = session.get(DocumentText, doc.file_name)
+        if source_text is not None:
+            copy_text = copy.text_row()
+            copy_text.raw_text, copy_text.cleaned_text = source_text.raw_text, source_text.cleaned_text
+        session.commit()
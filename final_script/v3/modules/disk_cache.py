@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import time
+from loguru import logger
+
+class DiskCache:
+    """
+    Persistent SQLite key-value store for text values. Entries older than max_age_seconds are
+    dropped, and the least recently used entries are evicted once the stored values exceed
+    max_size_bytes. One instance can be shared by threads; access is serialized by a lock.
+
+    The stored size is kept as a running total, so a put costs a few indexed statements however
+    large the table. Every MAINTENANCE_INTERVAL puts, expired entries are swept and the total is
+    recounted, which also picks up what other processes sharing the file have written. Hits
+    are reads only: access times are kept to TOUCH_INTERVAL_SECONDS, so read-heavy traffic
+    does not turn into write transactions.
+    """
+    MAINTENANCE_INTERVAL = 256  # puts between expiry sweeps and size recounts
+    TOUCH_INTERVAL_SECONDS = 3600  # a hit only rewrites accessed_at once it is older than this
+    EVICT_BATCH = 100  # least recently used entries read per eviction query
+
+    def __init__(self, path: str, table: str, max_size_bytes: int, max_age_seconds: float):
+        self.path = path
+        self.table = table
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        # Several pipeline processes may share the file, so wait on locks instead of failing
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed_at ON {table} (accessed_at)")
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table} (created_at)")
+        self.connection.commit()
+        self.total_size = self.stored_size()
+        self.puts = 0
+
+    def get_value(self, key: str):
+        with self.lock:
+            return self._get_value(key)
+
+    def _get_value(self, key: str):
+        row = self.connection.execute(
+            f"SELECT value, created_at, size, accessed_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created_at, size, accessed_at = row
+        now = time.time()
+        if now - created_at > self.max_age_seconds:
+            self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.connection.commit()
+            self.total_size -= size
+            return None
+        # Hits stay read-only unless the recorded access is stale enough to matter for LRU order
+        if now - accessed_at >= self.TOUCH_INTERVAL_SECONDS:
+            self.connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+        return value
+
+    def put_value(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            replaced = self.connection.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self.total_size += len(value) - (replaced[0] if replaced else 0)
+            self.puts += 1
+            if self.puts % self.MAINTENANCE_INTERVAL == 0:
+                self._expire(now)
+            self._evict_lru()
+            self.connection.commit()
+
+    def stored_size(self) -> int:
+        return self.connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def evict(self, now: float = None):
+        """
+        Drop expired entries, then least recently used ones until the cache fits in max_size_bytes.
+        """
+        with self.lock:
+            self._expire(now or time.time())
+            self._evict_lru()
+            self.connection.commit()
+
+    def _expire(self, now: float):
+        self.connection.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.max_age_seconds,))
+        self.total_size = self.stored_size()
+
+    def _evict_lru(self):
+        evicted = 0
+        while self.total_size > self.max_size_bytes:
+            rows = self.connection.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY accessed_at LIMIT ?", (self.EVICT_BATCH,)
+            ).fetchall()
+            if not rows:
+                self.total_size = 0
+                break
+            for key, size in rows:
+                if self.total_size <= self.max_size_bytes:
+                    break
+                self.connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.total_size -= size
+                evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} entries from {self.table}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+import numpy as np
+from loguru import logger
+from .llm_classifier import BaseClassifier
+from .log_config import track_time
+from ..config.base_config import BaseConfig
+
+class EmbeddingClassifier(BaseClassifier):
+    """
+    Classify documents by cosine similarity between sentence embeddings of the document and of
+    several descriptions per class. The description embeddings are computed once and persisted
+    as a label index, so a run only encodes documents. Runs on CPU without network access once
+    the model and index are available locally.
+    """
+    def __init__(self, model_name: str = None, threshold: float = None, min_margin: float = None,
+                 index_path: str = None, model=None):
+        super().__init__(model_name or BaseConfig.EMBEDDING_MODEL, BaseConfig.EMBEDDING_MIN_SCORE if threshold is None else threshold)
+        self.min_margin = BaseConfig.EMBEDDING_MIN_MARGIN if min_margin is None else min_margin
+        self.index_path = index_path or BaseConfig.EMBEDDING_INDEX_PATH
+        self.model = model or self.load_model()
+        self.label_descriptions = self.create_label_descriptions()
+        self.labels, self.label_ids, self.label_matrix = self.load_label_index()
+        self.supports_batch = True
+
+    def load_model(self):
+        from sentence_transformers import SentenceTransformer
+        logger.info(f"Loading embedding model {self.model_name} on CPU")
+        return SentenceTransformer(self.model_name, device="cpu", local_files_only=BaseConfig.EMBEDDING_OFFLINE)
+
+    def create_label_descriptions(self) -> Dict[str, List[str]]:
+        """
+        Multiple descriptions per class to capture various aspects.
+        """
+        return {
+            "Compliance": [
+                "Document showing patient compliance with medical device usage and therapy adherence",
+                "Report containing compliance percentage, usage hours, and therapy effectiveness metrics",
+                "Medical device usage tracking report with detailed usage statistics and compliance data",
+                "Patient therapy compliance summary with usage patterns and achievement metrics"
+            ],
+            "Sleep": [
+                "Clinical sleep study report with detailed polysomnography results and analysis",
+                "Sleep disorder diagnostic report with sleep patterns and respiratory events",
+                "Overnight sleep study data with comprehensive sleep metrics and observations",
+                "Sleep laboratory report containing detailed sleep architecture and parameters"
+            ],
+            "Order": [
+                "Medical equipment or supply order form with patient and provider details",
+                "Healthcare supply requisition document with order specifications",
+                "Medical device order authorization with insurance and billing information",
+                "Equipment order form with delivery instructions and product details"
+            ],
+            "Delivery": [
+                "Medical equipment delivery confirmation document with receipt details",
+                "Healthcare supply delivery ticket with shipping and handling information",
+                "Equipment delivery acknowledgment form with customer signatures",
+                "Medical supply delivery record with inventory and tracking details"
+            ],
+            "Physician": [
+                "Clinical progress notes from physician consultation or examination",
+                "Doctor's medical assessment and treatment recommendations",
+                "Patient consultation notes with medical observations and plan",
+                "Physician documentation of patient encounter and clinical findings"
+            ],
+            "Prescription": [
+                "Medical prescription with medication details and dosing instructions",
+                "Drug prescription form with pharmacy instructions and refill information",
+                "Medication order with specific dosage and administration details",
+                "Prescription document with drug name, strength, and usage directions"
+            ]
+        }
+
+    def index_fingerprint(self) -> str:
+        """
+        Identifies the model and descriptions an index was built from, so a stale index is rebuilt.
+        """
+        payload = json.dumps({"model": self.model_name, "descriptions": self.label_descriptions}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts in batches into L2-normalized float32 rows.
+        """
+        embeddings = self.model.encode(texts, batch_size=BaseConfig.EMBEDDING_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def build_label_index(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Encode every class description in one batch and save the matrix to index_path.
+        """
+        logger.info(f"Building label index at {self.index_path}")
+        labels = list(self.label_descriptions.keys())
+        descriptions = [description for label in labels for description in self.label_descriptions[label]]
+        label_ids = np.array([label_id for label_id, label in enumerate(labels) for _ in self.label_descriptions[label]])
+        label_matrix = self.encode(descriptions)
+        np.savez(self.index_path, labels=np.array(labels), label_ids=label_ids, label_matrix=label_matrix,
+                 fingerprint=np.array(self.index_fingerprint()))
+        return labels, label_ids, label_matrix
+
+    def load_label_index(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as index:
+                if str(index["fingerprint"]) == self.index_fingerprint():
+                    logger.info(f"Loaded label index from {self.index_path}")
+                    return list(index["labels"]), index["label_ids"], index["label_matrix"]
+            logger.info("Label index is stale")
+        return self.build_label_index()
+
+    def score_documents(self, texts: List[str]) -> List[Dict[str, float]]:
+        """
+        Score a batch of documents against every class with one matrix product.
+        A class scores the best similarity among its descriptions.
+
+        Returns:
+            List of dictionaries of class name to cosine similarity, one per document
+        """
+        similarities = self.encode(texts) @ self.label_matrix.T  # documents x descriptions
+        # Descriptions of a class are contiguous, so reduce each run to its maximum
+        starts = np.flatnonzero(np.r_[True, self.label_ids[1:] != self.label_ids[:-1]])
+        class_scores = np.maximum.reduceat(similarities, starts, axis=1)
+        return [{label: float(score) for label, score in zip(self.labels, row)} for row in class_scores]
+
+    def score_document(self, text: str) -> Dict[str, float]:
+        return self.score_documents([text])[0]
+
+    def is_decisive(self, scores: Dict[str, float]) -> bool:
+        """
+        Decisive when the best class clears the threshold and leads the runner-up by at least min_margin.
+        """
+        ranked = sorted(scores.values(), reverse=True)
+        runner_up = ranked[1] if len(ranked) > 1 else 0.0
+        return ranked[0] >= self.threshold and ranked[0] - runner_up >= self.min_margin
+
+    def result_from_scores(self, scores: Dict[str, float]) -> Tuple[str, float, Dict[str, float], float]:
+        predicted_class = max(scores, key=scores.get)
+        confidence = scores[predicted_class]
+        if confidence < self.threshold:
+            predicted_class = "notsure"
+        high_confidence_classes = {label: score for label, score in scores.items() if score >= self.threshold}
+        return predicted_class, confidence, high_confidence_classes, 0.0
+
+    @track_time
+    def classify_document(self, text: str, file_name: str):
+        """
+        Classify a document by embedding similarity.
+
+        Returns:
+            Tuple of (predicted_class, confidence, high_confidence_classes, cost)
+        """
+        logger.info(f"Classifying document with embeddings: {file_name}")
+        result = self.result_from_scores(self.score_document(text))
+        logger.info(f"Predicted class: {result[0]}, Confidence: {result[1]}")
+        return result
+
+    def classify_batch(self, texts: List[str]) -> List[Tuple[str, float, Dict[str, float], float]]:
+        """
+        Classify many documents with batched encoding.
+        """
+        return [self.result_from_scores(scores) for scores in self.score_documents(texts)]
+
+    def decide_batch(self, texts: List[str]):
+        return [(result, self.model_name) for result in self.classify_batch(texts)]
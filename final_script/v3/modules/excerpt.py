@@ -0,0 +1,87 @@
+from itertools import accumulate
+from typing import Dict, List, Tuple
+from litellm import encode, decode
+from loguru import logger
+from .keyword_matcher import KeywordMatcher
+from ..config.base_config import BaseConfig
+
+class DocumentExcerpter:
+    """
+    Cut a document down to a token budget before it is sent to the LLM, so the cost and latency
+    of classifying it stop growing with its page count. The excerpt keeps, in document order,
+    the opening lines up to lead_share of the budget, which hold the header and the first page
+    (cleaned text no longer marks page breaks, so the first page is approximated by tokens), and
+    then the lines matching the most class keywords from the rules file. Tokens are counted with
+    the model's tokenizer.
+    """
+    FEATURE_TYPES = ("keywords", "structure_starts", "measurements", "required_fields")
+    GAP = "...\n"  # marks lines left out between two parts of the excerpt
+
+    def __init__(self, model_name: str, budget_tokens: int = None, lead_share: float = None, rules_path: str = None):
+        self.model_name = model_name
+        self.budget_tokens = budget_tokens or BaseConfig.LLM_EXCERPT_TOKENS
+        self.lead_share = BaseConfig.LLM_EXCERPT_LEAD_SHARE if lead_share is None else lead_share
+        self.matcher = KeywordMatcher.from_rules_file(rules_path or BaseConfig.RULES_PATH, self.FEATURE_TYPES)
+
+    def count_tokens(self, text: str) -> int:
+        return len(encode(model=self.model_name, text=text))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        return decode(model=self.model_name, tokens=encode(model=self.model_name, text=text)[:tokens])
+
+    def excerpt(self, text: str) -> Tuple[str, Dict]:
+        """
+        Returns:
+            Tuple of (excerpt, metadata with the budget, the token counts, the number of keyword
+            lines and the [start, end) character spans of the text that were kept)
+        """
+        lines = text.splitlines(keepends=True)
+        offsets = [0] + list(accumulate(len(line) for line in lines))
+        tokens = [self.count_tokens(line) for line in lines]
+        document_tokens = sum(tokens)
+        metadata = {"budget": self.budget_tokens, "document_tokens": document_tokens}
+        if document_tokens <= self.budget_tokens:
+            return text, {**metadata, "tokens": document_tokens, "keyword_lines": 0, "spans": [[0, len(text)]]}
+
+        # Opening lines first, cutting the last one at the lead budget
+        selected: Dict[int, str] = {}
+        used = 0
+        lead_budget = int(self.budget_tokens * self.lead_share)
+        for index, line in enumerate(lines):
+            if used + tokens[index] > lead_budget:
+                if lead_budget > used:
+                    selected[index] = self.truncate(line, lead_budget - used)
+                    used = lead_budget
+                break
+            selected[index] = line
+            used += tokens[index]
+
+        # Then the remaining lines with the most keyword matches, while they fit
+        candidates = []
+        for index, line in enumerate(lines):
+            if index not in selected:
+                matches = sum(self.matcher.match(line).values())
+                if matches:
+                    candidates.append((-matches, index))
+        keyword_lines = 0
+        for _, index in sorted(candidates):
+            if used + tokens[index] <= self.budget_tokens:
+                selected[index] = lines[index]
+                used += tokens[index]
+                keyword_lines += 1
+
+        parts: List[str] = []
+        spans: List[List[int]] = []
+        for index in sorted(selected):
+            start, end = offsets[index], offsets[index] + len(selected[index])
+            if spans and spans[-1][1] == start:
+                spans[-1][1] = end
+            else:
+                if parts:
+                    parts.append(self.GAP if parts[-1].endswith("\n") else "\n" + self.GAP)
+                spans.append([start, end])
+            parts.append(selected[index])
+        excerpt = "".join(parts)
+        excerpt_tokens = self.count_tokens(excerpt)
+        logger.info(f"Excerpted {excerpt_tokens} of {document_tokens} tokens in {len(spans)} spans ({keyword_lines} keyword lines)")
+        return excerpt, {**metadata, "tokens": excerpt_tokens, "keyword_lines": keyword_lines, "spans": spans}
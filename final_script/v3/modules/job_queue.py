@@ -0,0 +1,264 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Iterable
+from sqlalchemy import select, update, func, Column, Float, Integer, String, Text, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
+from loguru import logger
+from .database import Base, engine, chunked, MAX_QUERY_PARAMETERS
+from ..config.base_config import BaseConfig
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    __table_args__ = (UniqueConstraint("queue", "key", name="uq_jobs_queue_key"),)
+    id = Column(Integer, primary_key=True)
+    queue = Column(String, nullable=False)
+    key = Column(String, nullable=False)  # idempotency key: enqueuing the same key again is a no-op
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, leased, done or dead
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(Float, nullable=False, index=True)  # epoch seconds; later than now while backing off
+    lease_owner = Column(String)
+    lease_expires_at = Column(Float)
+    last_error = Column(Text)
+    created_at = Column(Float, nullable=False)
+    completed_at = Column(Float)
+
+class DeadLetterJob(Base):
+    __tablename__ = 'dead_letter_jobs'
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, index=True)
+    queue = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text)
+    failed_at = Column(Float, nullable=False)
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class JobQueue:
+    """
+    Durable job queue in the results database, safe for several worker processes and hosts
+    sharing it. Workers lease jobs with a compare-and-set UPDATE, so exactly one of them wins a
+    job without database-specific locking. A worker that crashes simply stops renewing its lease
+    and the job is handed out again once the lease expires. Failed jobs are retried with
+    exponential backoff and moved to dead_letter_jobs after max_attempts.
+    """
+    def __init__(self, name: str, bind=None, lease_seconds: float = None, max_attempts: int = None,
+                 backoff_seconds: float = None, backoff_max_seconds: float = None):
+        self.name = name
+        self.bind = bind or engine
+        self.lease_seconds = lease_seconds or BaseConfig.JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts or BaseConfig.JOB_MAX_ATTEMPTS
+        self.backoff_seconds = BaseConfig.JOB_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds or BaseConfig.JOB_BACKOFF_MAX_SECONDS
+        Base.metadata.create_all(self.bind, tables=[Job.__table__, DeadLetterJob.__table__])
+
+    def enqueue(self, key: str, payload: dict) -> bool:
+        """
+        Add a job unless one with the same key is already queued, running, done or dead-lettered.
+
+        Returns:
+            True if the job was added
+        """
+        now = time.time()
+        row = {"queue": self.name, "key": key, "payload": json.dumps(payload), "status": "pending",
+               "attempts": 0, "available_at": now, "created_at": now}
+        dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(self.bind.dialect.name)
+        with self.bind.begin() as connection:
+            if dialect is not None:
+                statement = dialect.insert(Job.__table__).values(row).on_conflict_do_nothing(index_elements=["queue", "key"])
+                return connection.execute(statement).rowcount == 1
+            exists = connection.execute(select(Job.id).where(Job.queue == self.name, Job.key == key)).first()
+            if exists is None:
+                connection.execute(Job.__table__.insert().values(row))
+            return exists is None
+
+    def claim(self, worker_id: str):
+        """
+        Lease the next available job: a pending job whose backoff has passed, or a leased job whose
+        lease expired. Jobs that reach max_attempts through expired leases are dead-lettered.
+
+        Returns:
+            Dict with id, key, payload and attempts, or None when nothing is available
+        """
+        while True:
+            now = time.time()
+            available = (
+                ((Job.status == "pending") & (Job.available_at <= now))
+                | ((Job.status == "leased") & (Job.lease_expires_at < now))
+            )
+            with self.bind.connect() as connection:
+                candidates = connection.execute(
+                    select(Job.id).where(Job.queue == self.name, available).order_by(Job.available_at, Job.id).limit(10)
+                ).scalars().all()
+            if not candidates:
+                return None
+            # Each compare-and-set is its own short write transaction; losing one just means another
+            # worker got there first
+            job = None
+            for job_id in candidates:
+                with self.bind.begin() as connection:
+                    claimed = connection.execute(
+                        update(Job).where(Job.id == job_id, available).values(
+                            status="leased", lease_owner=worker_id, lease_expires_at=now + self.lease_seconds,
+                            attempts=Job.attempts + 1
+                        )
+                    ).rowcount
+                    if claimed:
+                        job = connection.execute(select(Job.id, Job.key, Job.payload, Job.attempts).where(Job.id == job_id)).one()
+                        break
+            if job is None:
+                continue
+            job = {"id": job.id, "key": job.key, "payload": json.loads(job.payload), "attempts": job.attempts}
+            if job["attempts"] > self.max_attempts:
+                self.dead_letter(job, worker_id, "lease expired on the last attempt")
+                continue
+            return job
+
+    def extend_lease(self, job: dict, worker_id: str) -> bool:
+        with self.bind.begin() as connection:
+            return connection.execute(
+                update(Job).where(Job.id == job["id"], Job.status == "leased", Job.lease_owner == worker_id)
+                .values(lease_expires_at=time.time() + self.lease_seconds)
+            ).rowcount == 1
+
+    def complete(self, job: dict, worker_id: str) -> bool:
+        """
+        Mark a job done. Idempotent: completing a job again, or after its lease moved to another
+        worker, changes nothing and returns False.
+        """
+        with self.bind.begin() as connection:
+            completed = connection.execute(
+                update(Job).where(Job.id == job["id"], Job.status == "leased", Job.lease_owner == worker_id)
+                .values(status="done", completed_at=time.time(), lease_owner=None, lease_expires_at=None)
+            ).rowcount == 1
+        if not completed:
+            logger.warning(f"Job {job['key']} was no longer leased by {worker_id} when it completed")
+        return completed
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Exponential backoff with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempts - 1)))
+
+    def fail(self, job: dict, worker_id: str, error: str) -> bool:
+        """
+        Record a failed attempt: retry after a backoff, or dead-letter the job after max_attempts.
+
+        Returns:
+            True if the job will be retried
+        """
+        if job["attempts"] >= self.max_attempts:
+            self.dead_letter(job, worker_id, error)
+            return False
+        delay = self.backoff(job["attempts"])
+        with self.bind.begin() as connection:
+            connection.execute(
+                update(Job).where(Job.id == job["id"], Job.status == "leased", Job.lease_owner == worker_id)
+                .values(status="pending", available_at=time.time() + delay, last_error=error,
+                        lease_owner=None, lease_expires_at=None)
+            )
+        logger.warning(f"Job {job['key']} failed (attempt {job['attempts']} of {self.max_attempts}), retrying in {delay:.1f}s: {error}")
+        return True
+
+    def dead_letter(self, job: dict, worker_id: str, error: str):
+        with self.bind.begin() as connection:
+            moved = connection.execute(
+                update(Job).where(Job.id == job["id"], Job.status == "leased", Job.lease_owner == worker_id)
+                .values(status="dead", last_error=error, lease_owner=None, lease_expires_at=None)
+            ).rowcount
+            if moved:
+                connection.execute(DeadLetterJob.__table__.insert().values(
+                    job_id=job["id"], queue=self.name, key=job["key"], payload=json.dumps(job["payload"]),
+                    attempts=job["attempts"], last_error=error, failed_at=time.time()
+                ))
+        if moved:
+            logger.error(f"Job {job['key']} moved to the dead-letter table after {job['attempts']} attempts: {error}")
+
+    def retry_dead_letters(self) -> int:
+        """
+        Put every dead-lettered job of this queue back in line with a fresh attempt budget.
+        """
+        with self.bind.begin() as connection:
+            retried = connection.execute(
+                update(Job).where(Job.queue == self.name, Job.status == "dead")
+                .values(status="pending", attempts=0, available_at=time.time())
+            ).rowcount
+            connection.execute(DeadLetterJob.__table__.delete().where(DeadLetterJob.queue == self.name))
+        return retried
+
+    def statuses(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Status of the jobs with the given keys; keys without a job are left out.
+        """
+        statuses = {}
+        with self.bind.connect() as connection:
+            for batch in chunked(keys, MAX_QUERY_PARAMETERS):
+                statuses.update(connection.execute(
+                    select(Job.key, Job.status).where(Job.queue == self.name, Job.key.in_(batch))
+                ).all())
+        return statuses
+
+    def counts(self) -> dict:
+        with self.bind.connect() as connection:
+            rows = connection.execute(
+                select(Job.status, func.count()).where(Job.queue == self.name).group_by(Job.status)
+            ).all()
+        return {status: count for status, count in rows}
+
+    def is_drained(self) -> bool:
+        """
+        True when no job is pending or running, including ones waiting out a backoff.
+        """
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("leased")
+
+
+def run_worker(job_queue: JobQueue, handler, worker_id: str = None, poll_seconds: float = None, exit_when_drained: bool = True) -> dict:
+    """
+    Claim and run jobs until the queue is drained (or forever). handler(payload) must be idempotent,
+    since a job whose lease expired mid-run can be picked up again. The lease is renewed in the
+    background while the handler runs.
+
+    Returns:
+        Counts of completed, retried and dead-lettered jobs
+    """
+    worker_id = worker_id or default_worker_id()
+    poll_seconds = poll_seconds or BaseConfig.JOB_POLL_SECONDS
+    outcomes = {"completed": 0, "retried": 0, "dead": 0}
+    while True:
+        job = job_queue.claim(worker_id)
+        if job is None:
+            if exit_when_drained and job_queue.is_drained():
+                return outcomes
+            time.sleep(poll_seconds)
+            continue
+
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(job_queue.lease_seconds / 3):
+                job_queue.extend_lease(job, worker_id)
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            handler(job["payload"])
+        except Exception as error:
+            logger.exception(f"Job {job['key']} failed")
+            outcome = "retried" if job_queue.fail(job, worker_id, f"{type(error).__name__}: {error}") else "dead"
+        else:
+            job_queue.complete(job, worker_id)
+            outcome = "completed"
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+        outcomes[outcome] += 1
@@ -0,0 +1,129 @@
+import json
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over every rule term of every class, so one linear pass over a
+    document finds all of them however many terms there are. Matching is case-insensitive and
+    follows the word-boundary semantics of re.search(rf'\\b{re.escape(term)}\\b', text, re.IGNORECASE).
+    """
+    def __init__(self, terms: Iterable[Tuple[str, str, str]]):
+        """
+        Args:
+            terms: (class_name, feature_type, term) triples
+        """
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # For each state, the (term length, term ids) ending there, including via fail links
+        self.outputs: List[List[Tuple[int, List[int]]]] = [[]]
+        self.term_keys: List[Tuple[str, str]] = []
+        self.term_totals: Dict[Tuple[str, str], int] = {}
+
+        terminal_terms: Dict[int, List[int]] = {}
+        for class_name, feature_type, term in terms:
+            key = (class_name, feature_type)
+            self.term_totals[key] = self.term_totals.get(key, 0) + 1
+            if not term:
+                continue
+            term_id = len(self.term_keys)
+            self.term_keys.append(key)
+            state = 0
+            for char in term.lower():
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            terminal_terms.setdefault(state, []).append(term_id)
+        self.build_links(terminal_terms)
+
+    def build_links(self, terminal_terms: Dict[int, List[int]]):
+        """
+        Compute fail links breadth-first and merge the outputs reachable through them.
+        """
+        depth = [0] * len(self.goto)
+        queue = deque()
+        for state in self.goto[0].values():
+            depth[state] = 1
+            queue.append(state)
+        order = []
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for char, next_state in self.goto[state].items():
+                depth[next_state] = depth[state] + 1
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                queue.append(next_state)
+        for state in order:
+            own = [(depth[state], terminal_terms[state])] if state in terminal_terms else []
+            self.outputs[state] = own + self.outputs[self.fail[state]]
+
+    @classmethod
+    def from_rules(cls, rules, feature_types: Iterable[str]) -> "KeywordMatcher":
+        """
+        Build the matcher from {class_name: DocumentFeatures} for the given feature types.
+        """
+        return cls(
+            (class_name, feature_type, term)
+            for class_name, features in rules.items()
+            for feature_type in feature_types
+            for term in getattr(features, feature_type)
+        )
+
+    @classmethod
+    def from_rules_file(cls, path: str, feature_types: Iterable[str]) -> "KeywordMatcher":
+        """
+        Build the matcher straight from a classification_rules.json file.
+        """
+        with open(path, 'r') as f:
+            rules = json.load(f)
+        return cls(
+            (class_name, feature_type, term)
+            for class_name, features in rules.items()
+            for feature_type in feature_types
+            for term in features.get(feature_type, [])
+        )
+
+    @staticmethod
+    def _is_word(char: str) -> bool:
+        return char.isalnum() or char == "_"
+
+    def match(self, text: str) -> Dict[Tuple[str, str], int]:
+        """
+        Count the distinct terms found in the text for every (class_name, feature_type).
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # A few characters lowercase to several; keep positions aligned with the original text
+            lowered = "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+        is_word = self._is_word
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found = set()
+        state = 0
+        text_length = len(lowered)
+        for end, char in enumerate(lowered, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            after_is_word = end < text_length and is_word(text[end])
+            before_end_is_word = is_word(text[end - 1])
+            if after_is_word == before_end_is_word:
+                continue  # no word boundary after the match
+            for length, term_ids in outputs[state]:
+                start = end - length
+                before_is_word = start > 0 and is_word(text[start - 1])
+                if before_is_word != is_word(text[start]):
+                    found.update(term_ids)
+        counts = {key: 0 for key in self.term_totals}
+        for term_id in found:
+            counts[self.term_keys[term_id]] += 1
+        return counts
@@ -0,0 +1,28 @@
+import hashlib
+import json
+from .disk_cache import DiskCache
+from ..config.base_config import BaseConfig
+
+class LLMCache(DiskCache):
+    """
+    Persistent cache of LLM responses keyed by a hash of the model, messages and parameters.
+    """
+    def __init__(self, path: str = None, max_size_bytes: int = None, max_age_seconds: float = None):
+        super().__init__(
+            path or BaseConfig.LLM_CACHE_PATH,
+            "llm_response_cache",
+            BaseConfig.LLM_CACHE_MAX_MB * 1024 * 1024 if max_size_bytes is None else max_size_bytes,
+            BaseConfig.LLM_CACHE_MAX_AGE_DAYS * 24 * 3600 if max_age_seconds is None else max_age_seconds
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: list, **params) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        response = self.get_value(key)
+        return json.loads(response) if response is not None else None
+
+    def put(self, key: str, response: dict):
+        self.put_value(key, json.dumps(response))
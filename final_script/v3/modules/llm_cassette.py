@@ -0,0 +1,204 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from loguru import logger
+from .keyword_matcher import KeywordMatcher
+from .llm_cache import LLMCache
+from ..config.base_config import BaseConfig
+
+class MockProvider:
+    """
+    Offline stand-in for the LLM that answers the classifier's prompts deterministically. The
+    document is scored against the keyword rules, the best-scoring class answers Yes and the
+    others No, so results are plausible and identical from run to run. Prompts it does not
+    recognise get "No 0%".
+    """
+    FEATURE_TYPES = ("keywords", "structure_starts", "measurements", "required_fields")
+    LABEL_QUESTION = re.compile(r"the (\w+) class\?")
+    CANDIDATES = re.compile(r"one of these classes: (.+)\.$")
+
+    def __init__(self, rules_path: str = None):
+        self.matcher = KeywordMatcher.from_rules_file(rules_path or BaseConfig.RULES_PATH, self.FEATURE_TYPES)
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """
+        Share of each class's terms found in the text.
+        """
+        found, totals = {}, {}
+        for (class_name, _), count in self.matcher.match(text).items():
+            found[class_name] = found.get(class_name, 0) + count
+        for (class_name, _), total in self.matcher.term_totals.items():
+            totals[class_name] = totals.get(class_name, 0) + total
+        return {class_name: found[class_name] / totals[class_name] if totals[class_name] else 0.0 for class_name in totals}
+
+    @staticmethod
+    def confidence(label: str, scores: Dict[str, float]) -> int:
+        """
+        Percentage confidence: 60 to 99 for the best class, below 50 for the rest.
+        """
+        best = max(scores, key=scores.get) if any(scores.values()) else None
+        score = scores.get(label, 0.0)
+        return round(60 + 39 * score) if label == best else round(45 * score)
+
+    def answer(self, messages: List[Dict[str, str]]) -> str:
+        from .llm_classifier import split_document_message  # llm_classifier imports this module
+        document, question = split_document_message(messages[-1]["content"])
+        scores = self.scores(document)
+        label = self.LABEL_QUESTION.search(question)
+        if label:
+            confidence = self.confidence(label.group(1), scores)
+            return f"{'Yes' if confidence >= 50 else 'No'} {confidence}%"
+        if "JSON object" in question:
+            return json.dumps({class_name: self.confidence(class_name, scores) for class_name in scores})
+        candidates = self.CANDIDATES.search(question)
+        if candidates:
+            names = [name.strip() for name in candidates.group(1).split(",")]
+            return f"Class: {max(names, key=lambda name: scores.get(name, 0.0))}"
+        return "No 0%"
+
+    def complete(self, model: str, messages: List[Dict[str, str]]) -> dict:
+        content = self.answer(messages)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = max(1, len(content) // 4)
+        return {
+            "id": "mock",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+
+class LLMCassette:
+    """
+    Record and replay of LLM calls for offline benchmarks and regression runs.
+
+    record: calls go to the provider and every request and response is appended to a JSON Lines
+        cassette, with the latency of the call.
+    replay: recorded responses are served back after a simulated latency; requests that were
+        never recorded are answered by the MockProvider.
+    mock: every request is answered by the MockProvider.
+
+    Latency is a fixed number of seconds per call, or "recorded" to reproduce the recorded
+    latency of each call (mock answers, and calls recorded from a cache hit with no latency,
+    then take the mean recorded latency). Cassettes hold the
+    full prompts, document text included, so keep them with the rest of the results.
+    """
+    MODES = ("record", "replay", "mock")
+
+    def __init__(self, mode: str, path: str = None, latency=None, mock: MockProvider = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.mode = mode
+        self.path = path or BaseConfig.LLM_CASSETTE_PATH
+        latency = BaseConfig.LLM_REPLAY_LATENCY if latency is None else latency
+        self.recorded_latency = latency == "recorded"
+        self.latency = 0.0 if self.recorded_latency else float(latency)
+        self.mock = mock or MockProvider()
+        self.lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "mocked": 0}
+        self.entries = self.load() if mode == "replay" else {}
+        self.mock_latency = self.mean_latency() if self.recorded_latency else self.latency
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode != "record"
+
+    def load(self) -> Dict[str, dict]:
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["key"]] = entry
+        logger.info(f"Loaded {len(entries)} recorded LLM calls from {self.path}")
+        return entries
+
+    def mean_latency(self) -> float:
+        latencies = [entry["latency"] for entry in self.entries.values() if entry.get("latency") is not None]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def record(self, key: str, model: str, messages: List[Dict[str, str]], params: dict, response, latency: Optional[float]):
+        entry = {
+            "key": key,
+            "model": model,
+            "messages": messages,
+            "params": params,
+            "response": response.model_dump() if hasattr(response, "model_dump") else dict(response),
+            "latency": latency,
+        }
+        line = json.dumps(entry, default=str) + "\n"
+        with self.lock:
+            # Appended in one write, so several recording processes can share the file
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.stats["recorded"] += 1
+
+    def lookup(self, model: str, messages: List[Dict[str, str]], params: dict):
+        """
+        The recorded or mock response to a request, and how long to wait before returning it.
+        """
+        entry = self.entries.get(LLMCache.make_key(model, messages, **params))
+        with self.lock:
+            self.stats["replayed" if entry else "mocked"] += 1
+        if entry is None:
+            return self.mock.complete(model, messages), self.mock_latency
+        latency = entry.get("latency") if self.recorded_latency else self.latency
+        return json.loads(json.dumps(entry["response"])), self.mock_latency if latency is None else latency
+
+    def wrap(self, model: str, messages: List[Dict[str, str]], params: dict, request):
+        """
+        Wrap request(), the live provider call, so it is recorded or replaced by a replay.
+        """
+        if self.replaying:
+            def replay():
+                response, latency = self.lookup(model, messages, params)
+                time.sleep(latency)
+                return response
+            return replay
+
+        def record():
+            start = time.perf_counter()
+            response = request()
+            self.record(LLMCache.make_key(model, messages, **params), model, messages, params, response, time.perf_counter() - start)
+            return response
+        return record
+
+    def awrap(self, model: str, messages: List[Dict[str, str]], params: dict, request):
+        """
+        Async variant of wrap; request() returns an awaitable.
+        """
+        if self.replaying:
+            async def replay():
+                response, latency = self.lookup(model, messages, params)
+                await asyncio.sleep(latency)
+                return response
+            return replay
+
+        async def record():
+            start = time.perf_counter()
+            response = await request()
+            self.record(LLMCache.make_key(model, messages, **params), model, messages, params, response, time.perf_counter() - start)
+            return response
+        return record
+
+
+_default_cassette = None
+_default_cassette_lock = threading.Lock()
+
+def default_cassette():
+    """
+    The process-wide cassette selected by LLM_CASSETTE_MODE, or None when calls go straight to the provider.
+    """
+    global _default_cassette
+    if BaseConfig.LLM_CASSETTE_MODE in ("", "off"):
+        return None
+    with _default_cassette_lock:
+        if _default_cassette is None or _default_cassette.mode != BaseConfig.LLM_CASSETTE_MODE:
+            _default_cassette = LLMCassette(BaseConfig.LLM_CASSETTE_MODE)
+        return _default_cassette
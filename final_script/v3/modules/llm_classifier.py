@@ -1,8 +1,32 @@
-from tokencost import calculate_prompt_cost, calculate_completion_cost
-from litellm import completion
+import asyncio
+import json
+import re
+from tokencost import calculate_prompt_cost, calculate_completion_cost, calculate_cost_by_tokens
+from litellm import completion, acompletion
 from loguru import logger
-from .log_config import track_time
-from typing import Dict, Tuple
+from .log_config import track_time, track_time_async, count_document_stat, document_stats
+from .llm_cache import LLMCache
+from .rate_limiter import RateLimiter, shared_rate_limiter
+from .excerpt import DocumentExcerpter
+from .llm_cassette import LLMCassette, default_cassette
+from ..config.base_config import BaseConfig
+from typing import Dict, List, Optional, Tuple
+
+# User message of every call: the document, then the question about it
+DOCUMENT_PROMPT = 'Document: "{text}"\n\n{question}'
+
+_DOCUMENT_PATTERN = re.compile(
+    re.escape(DOCUMENT_PROMPT).replace(r"\{text\}", "(?P<text>.*)").replace(r"\{question\}", "(?P<question>.*?)"), re.DOTALL
+)
+
+def split_document_message(content: str) -> Tuple[str, str]:
+    """
+    The (text, question) a user message was built from with DOCUMENT_PROMPT; other messages
+    come back as an empty text and the whole content as the question.
+    """
+    match = _DOCUMENT_PATTERN.fullmatch(content)
+    return (match["text"], match["question"]) if match else ("", content)
+
 
 class BaseClassifier:
     """
@@ -11,6 +35,11 @@ class BaseClassifier:
     def __init__(self, model_name: str = "base-model", threshold: float = 0.5):
         self.model_name = model_name
         self.threshold = threshold
+        self.classification_mode = None
+        self.cache_stats = {"hits": 0, "misses": 0}
+        self.token_stats = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        self.last_tier = model_name  # classifier that produced the latest result
+        self.supports_batch = False  # decide_batch scores batches faster than single documents
 
     def classify_document(self, text: str, file_name: str):
         """
@@ -18,15 +47,51 @@ class BaseClassifier:
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
+    async def aclassify_document(self, text: str, file_name: str):
+        """
+        Async entry point; classifiers without network calls run the sync method in a worker
+        thread so they do not block the event loop.
+        """
+        return await asyncio.to_thread(self.classify_document, text, file_name)
+
+    def decide_batch(self, texts: List[str]) -> List[Optional[Tuple[Tuple[str, float, Dict[str, float], float], str]]]:
+        """
+        Classify several documents together where the classifier scores batches more cheaply
+        than single documents. Returns a (result, tier) pair per document, or None for the
+        documents that have to go through aclassify_undecided one at a time.
+        """
+        return [None] * len(texts)
+
+    async def aclassify_undecided(self, text: str, file_name: str):
+        """
+        Classify a document decide_batch left undecided.
+        """
+        return await self.aclassify_document(text, file_name)
+
 
 class LLMClassifier(BaseClassifier):
     """
     Classify documents using a LLM.
     """
-    def __init__(self, model_name: str = "gpt-4o-mini", threshold: float = 0.5):
+    def __init__(self, model_name: str = "gpt-4o-mini", threshold: float = 0.5, max_concurrency: int = None, classification_mode: str = None, cache: LLMCache = None, rate_limiter: RateLimiter = None, excerpt_tokens: int = None, cassette: LLMCassette = None):
         super().__init__(model_name, threshold)
+        self.max_concurrency = max_concurrency or BaseConfig.LLM_MAX_CONCURRENCY
+        self.classification_mode = classification_mode or BaseConfig.LLM_CLASSIFICATION_MODE
+        if self.classification_mode not in ("per_label", "multi_label"):
+            raise ValueError(f"Unknown classification mode: {self.classification_mode}")
+        self.cassette = cassette or default_cassette()
+        # Replayed and mock answers must not end up in the cache of real responses, and a recording
+        # must see every call, so the default cache is off while a cassette is in use
+        if cache is None and BaseConfig.LLM_CACHE_ENABLED and not self.cassette:
+            cache = LLMCache()
+        self.cache = cache
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        excerpt_tokens = BaseConfig.LLM_EXCERPT_TOKENS if excerpt_tokens is None else excerpt_tokens
+        self.excerpter = DocumentExcerpter(model_name, excerpt_tokens) if excerpt_tokens else None
         self.label_prompts = self.create_class_prompts()
         self.examples = self.create_few_shot_examples()
+        self.prompt_prefix = self.create_prompt_prefix()
+        self.examples_prefix = self.create_examples_prefix()
 
     def create_few_shot_examples(self) -> Dict[str, str]:
         """
@@ -83,7 +148,188 @@ class LLMClassifier(BaseClassifier):
             "Physician": "This document contains physician notes from a patient consultation or examination, likely including medical assessments, observations, treatment plans, and clinical findings.",
             "Prescription": "This document is a medical prescription, detailing medication names, dosages, refills, and instructions for medication usage."
         }
-    
+
+    def create_prompt_prefix(self) -> str:
+        """
+        Short system prompt of the per-label calls. It is the same for every call, and the document
+        follows it, so the per-label calls for one document share a cacheable prefix while each
+        carries only its own class description, in the question.
+        """
+        return "You classify medical documents. The user sends a document followed by a question about it. Answer only what the question asks, in the format it asks for."
+
+    def create_examples_prefix(self) -> str:
+        """
+        System prompt of the multi-label and few-shot calls, which compare classes: the
+        instructions, all class descriptions and all few-shot examples. It is byte-identical for
+        every document, so providers that cache prompt prefixes can reuse it.
+        """
+        descriptions = "\n".join(f"- {label}: {prompt}" for label, prompt in self.label_prompts.items())
+        examples = "\n\n".join(self.examples[label] for label in self.label_prompts.keys())
+        return (
+            "You classify medical documents. The classes are:\n"
+            f"{descriptions}\n\n"
+            f"Examples of classified documents:\n{examples}\n\n"
+            "The user sends a document followed by a question about it. Answer only what the question asks, in the format it asks for."
+        )
+
+    def document_messages(self, text: str, question: str, prefix: str = None) -> List[Dict[str, str]]:
+        """
+        Chat messages for one call: the system prefix (prompt_prefix by default), then the
+        document, then the question. The short question goes last so the calls made for one
+        document also share the document.
+        """
+        return [
+            {"role": "system", "content": prefix or self.prompt_prefix},
+            {"role": "user", "content": DOCUMENT_PROMPT.format(text=text, question=question)}
+        ]
+
+    def complete(self, messages: List[Dict[str, str]], **params) -> dict:
+        """
+        Call the LLM, serving the response from the cache when the same request was seen before.
+        """
+        key = self.cache.make_key(self.model_name, messages, **params) if self.cache else None
+        cached = self.cached_response(key)
+        if cached is not None:
+            self.record_cache_hit(messages, params, cached)
+            return cached
+        request = lambda: completion(model=self.model_name, messages=messages, **params, **self.request_options())
+        if self.cassette:
+            request = self.cassette.wrap(self.model_name, messages, params, request)
+        response = self.rate_limiter.call(request, self.estimate_tokens(messages))
+        return self.store_response(key, response)
+
+    async def acomplete(self, messages: List[Dict[str, str]], **params) -> dict:
+        """
+        Async variant of complete.
+        """
+        key = self.cache.make_key(self.model_name, messages, **params) if self.cache else None
+        cached = self.cached_response(key)
+        if cached is not None:
+            self.record_cache_hit(messages, params, cached)
+            return cached
+        request = lambda: acompletion(model=self.model_name, messages=messages, **params, **self.request_options())
+        if self.cassette:
+            request = self.cassette.awrap(self.model_name, messages, params, request)
+        response = await self.rate_limiter.acall(request, self.estimate_tokens(messages))
+        return self.store_response(key, response)
+
+    @staticmethod
+    def request_options() -> dict:
+        """
+        Transport options passed with every call but kept out of the cache key. Retries are left
+        to the rate limiter, so the provider client's own are turned off.
+        """
+        options = {"timeout": BaseConfig.API_TIMEOUT, "max_retries": 0}
+        if BaseConfig.LLM_API_BASE:
+            options["api_base"] = BaseConfig.LLM_API_BASE
+        return options
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, str]], completion_tokens: int = 20) -> int:
+        """
+        Rough token count of a request (about 4 characters per token) used to reserve rate limit
+        capacity before the call; the reservation is corrected from the reported usage afterwards.
+        """
+        return sum(len(message["content"]) for message in messages) // 4 + completion_tokens
+
+    def cached_response(self, key: str):
+        if key is None:
+            return None
+        response = self.cache.get(key)
+        if response is None:
+            self.cache_stats["misses"] += 1
+            count_document_stat("cache_misses")
+            return None
+        self.cache_stats["hits"] += 1
+        count_document_stat("cache_hits")
+        response["cache_hit"] = True
+        return response
+
+    def record_cache_hit(self, messages: List[Dict[str, str]], params: dict, response: dict):
+        """
+        Write a response served from an explicitly passed cache to a recording cassette, so a
+        replay of the run finds it too.
+        """
+        if self.cassette and not self.cassette.replaying:
+            response = {field: value for field, value in response.items() if field != "cache_hit"}
+            key = LLMCache.make_key(self.model_name, messages, **params)
+            self.cassette.record(key, self.model_name, messages, params, response, None)
+
+    def store_response(self, key: str, response) -> dict:
+        if key is not None:
+            self.cache.put(key, response.model_dump() if hasattr(response, "model_dump") else dict(response))
+        return response
+
+    def response_cost(self, messages: List[Dict[str, str]], response: dict) -> float:
+        """
+        Cost of a call; responses served from the cache were not billed, and prompt tokens the
+        provider served from its prefix cache are billed at the cached rate.
+        """
+        if response.get("cache_hit"):
+            return 0.0
+        self.count_tokens(response)
+        response_text = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+        prompt_cost = float(calculate_prompt_cost(messages, self.model_name))
+        cached_tokens = self.usage_value(response.get("usage") or {}, "cached_tokens")
+        if cached_tokens:
+            prompt_cost -= float(calculate_cost_by_tokens(cached_tokens, self.model_name, "input")
+                                 - calculate_cost_by_tokens(cached_tokens, self.model_name, "cached"))
+        completion_cost = calculate_completion_cost(response_text, self.model_name)
+        return prompt_cost + float(completion_cost)
+
+    def count_tokens(self, response: dict):
+        """
+        Add the token usage reported with a response to token_stats and the document's counters.
+        """
+        usage = response.get("usage") or {}
+        for field in self.token_stats:
+            count = self.usage_value(usage, field)
+            self.token_stats[field] += count
+            count_document_stat(field, count)
+
+    @staticmethod
+    def usage_value(usage, field: str) -> int:
+        """
+        One token count from a response's usage, given as a dict or an object. cached_tokens is
+        the part of the prompt the provider served from its prefix cache, reported as
+        prompt_tokens_details.cached_tokens (OpenAI) or cache_read_input_tokens (Anthropic).
+        """
+        def get(source, name):
+            return source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+
+        if field == "cached_tokens":
+            return get(get(usage, "prompt_tokens_details") or {}, "cached_tokens") or get(usage, "cache_read_input_tokens") or 0
+        return get(usage, field) or 0
+
+    def excerpt_text(self, text: str) -> str:
+        """
+        Cut the document to the excerpt token budget, recording the chosen spans with the document's stats.
+        """
+        if self.excerpter is None:
+            return text
+        text, excerpt = self.excerpter.excerpt(text)
+        document_stats()["excerpt"] = excerpt
+        return text
+
+    def label_messages(self, label: str, text: str) -> List[Dict[str, str]]:
+        """
+        Build the chat messages asking whether the document matches one class description.
+        """
+        return self.document_messages(
+            text,
+            f"Does the document match the description of the {label} class? {self.label_prompts[label]} "
+            "Return only Yes/No and confidence in percentage format."
+        )
+
+    def score_label_response(self, messages: List[Dict[str, str]], response: dict) -> Tuple[float, float]:
+        """
+        Extract the confidence and the cost of a single per-label response.
+
+        Returns:
+            Tuple of (confidence, cost)
+        """
+        return self.extract_confidence(response), self.response_cost(messages, response)
+
     @track_time
     def classify_document(self, text: str, file_name: str):
         """
@@ -96,111 +342,189 @@ class LLMClassifier(BaseClassifier):
             Tuple of (predicted_class, confidence, all_scores)
         """
         logger.info("Classifying document")
-        scores = {}
-        total_cost = 0.0  # Initialize total cost
-        for label, prompt in self.label_prompts.items():
-            logger.info(f"Classifying document for class: {label}")
-            
-            # Calculate prompt cost
-            prompt_cost = calculate_prompt_cost(prompt, self.model_name)
-            total_cost += float(prompt_cost)
-
-            response = completion(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": f"Identify if the following document matches the description: {prompt}. Return only Yes/No and confidence in percentage format."},
-                    {"role": "user", "content": text}
-                ]
-            )
-            response_text = response.get("choices", [{}])[0].get("message", {}).get("content", "").lower()
-            completion_cost = calculate_completion_cost(response_text, self.model_name)
-            total_cost += float(completion_cost)    
-            score = self.extract_confidence(response)
-            scores[label] = score
-
-        # Filter classes with high confidence ("Yes" responses)
-        high_confidence_classes = {label: conf for label, conf in scores.items() if conf >= self.threshold}
-        logger.info(f"High confidence classes: {high_confidence_classes}")
+        text = self.excerpt_text(text)
+        scores, total_cost = self.score_labels(text)
 
-        # Check for unique high-confidence classification
+        high_confidence_classes = self.select_high_confidence(scores)
         if len(high_confidence_classes) == 1:
-            
-            predicted_class = next(iter(high_confidence_classes))
-            if "Physician" in predicted_class:
-                predicted_class = "Physician"
-            elif "Prescription" in predicted_class:
-                predicted_class = "Prescription"
-            elif "Delivery" in predicted_class:
-                predicted_class = "Delivery"
-            elif "Sleep" in predicted_class:
-                predicted_class = "Sleep"
-            elif "Compliance" in predicted_class:
-                predicted_class = "Compliance"
-            elif "Order" in predicted_class:
-                predicted_class = "Order"
-            confidence = high_confidence_classes[predicted_class]
-            logger.info(f"Predicted Class: {predicted_class}, Confidence: {confidence}")
-        elif len(high_confidence_classes) == 0:
-            # Use few-shot example classification with all classes
-            logger.info("No high-confidence classification found, using few-shot example classification")
-            high_conf_classes = {label: 0.0 for label in self.label_prompts.keys()}
-            predicted_class, confidence, few_shot_cost = self.classify_with_few_shot(text, high_conf_classes)
-            total_cost += few_shot_cost
-        elif len(high_confidence_classes) > 1:
-            # Use few-shot example classification
-            logger.info("Multiple high-confidence classifications found, using few-shot example classification")
-            predicted_class, confidence, few_shot_cost = self.classify_with_few_shot(text, high_confidence_classes)
+            predicted_class, confidence = self.single_class_prediction(high_confidence_classes)
+        else:
+            candidates = self.few_shot_candidates(high_confidence_classes)
+            predicted_class, confidence, few_shot_cost = self.classify_with_few_shot(text, candidates)
             total_cost += few_shot_cost
+
+        self.log_result(file_name, total_cost, high_confidence_classes, predicted_class, confidence)
+        return predicted_class, confidence, high_confidence_classes, total_cost
+
+    @track_time_async
+    async def aclassify_document(self, text: str, file_name: str):
+        """
+        Async variant of classify_document that sends the per-label calls concurrently,
+        at most max_concurrency at a time. Returns the same tuple as classify_document.
+        """
+        logger.info("Classifying document asynchronously")
+        text = self.excerpt_text(text)
+        scores, total_cost = await self.ascore_labels(text)
+
+        high_confidence_classes = self.select_high_confidence(scores)
+        if len(high_confidence_classes) == 1:
+            predicted_class, confidence = self.single_class_prediction(high_confidence_classes)
         else:
-            logger.info("No high-confidence classifications found, defaulting to 'notsure'")
-            predicted_class = "notsure"
-            confidence = 0.0
-        
-        # Save classification result
-        logger.info(f"Saving classification result for file: {file_name}")
-        logger.info(f"Total cost: {total_cost}")
-        logger.info(f"High confidence classes: {high_confidence_classes}")
-        logger.info(f"Predicted class: {predicted_class}, Confidence: {confidence}")
+            candidates = self.few_shot_candidates(high_confidence_classes)
+            predicted_class, confidence, few_shot_cost = await self.aclassify_with_few_shot(text, candidates)
+            total_cost += few_shot_cost
+
+        self.log_result(file_name, total_cost, high_confidence_classes, predicted_class, confidence)
         return predicted_class, confidence, high_confidence_classes, total_cost
 
-    def classify_with_few_shot(self, text: str, high_conf_classes: Dict[str, float]) -> Tuple[str, float, Dict[str, float]]:
+    def score_labels(self, text: str) -> Tuple[Dict[str, float], float]:
         """
-        Classify document using few-shot examples for high-confidence classes.
+        Score the document against every class, one call per label or a single
+        multi-label call depending on classification_mode.
 
-        Args:
-            text: Document text to classify
-            high_conf_classes: Dictionary of high-confidence classes
+        Returns:
+            Tuple of (scores per class, cost)
+        """
+        if self.classification_mode == "multi_label":
+            logger.info("Classifying document for all classes in one call")
+            messages = self.multi_label_messages(text)
+            response = self.complete(messages)
+            return self.score_multi_label_response(messages, response)
+
+        scores = {}
+        total_cost = 0.0
+        for label in self.label_prompts.keys():
+            logger.info(f"Classifying document for class: {label}")
+            messages = self.label_messages(label, text)
+            response = self.complete(messages)
+            scores[label], cost = self.score_label_response(messages, response)
+            total_cost += cost
+        return scores, total_cost
+
+    async def ascore_labels(self, text: str) -> Tuple[Dict[str, float], float]:
+        """
+        Async variant of score_labels; per-label calls run concurrently, at most max_concurrency at a time.
+        """
+        if self.classification_mode == "multi_label":
+            logger.info("Classifying document for all classes in one call")
+            messages = self.multi_label_messages(text)
+            response = await self.acomplete(messages)
+            return self.score_multi_label_response(messages, response)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def score_label(label: str) -> Tuple[float, float]:
+            messages = self.label_messages(label, text)
+            async with semaphore:
+                logger.info(f"Classifying document for class: {label}")
+                response = await self.acomplete(messages)
+            return self.score_label_response(messages, response)
+
+        labels = list(self.label_prompts.keys())
+        results = await asyncio.gather(*(score_label(label) for label in labels))
+        scores = {label: score for label, (score, _) in zip(labels, results)}
+        return scores, sum(cost for _, cost in results)
+
+    def multi_label_messages(self, text: str) -> List[Dict[str, str]]:
+        """
+        Build the chat messages asking for a JSON map of the confidence in every class.
+        """
+        labels = ", ".join(f'"{label}"' for label in self.label_prompts.keys())
+        return self.document_messages(
+            text,
+            "For each class, how confident are you that the document matches its description? "
+            f"Return only a JSON object with the keys {labels} and each confidence as a percentage from 0 to 100.",
+            self.examples_prefix
+        )
+
+    def score_multi_label_response(self, messages: List[Dict[str, str]], response: dict) -> Tuple[Dict[str, float], float]:
+        """
+        Parse the per-class confidence map of a multi-label response. Classes missing from
+        the response, or an unparseable response, score 0.
 
         Returns:
-            Tuple of (predicted_class, confidence)
+            Tuple of (scores per class, cost)
         """
-        total_cost = 0.0  # Initialize total cost
-        logger.info("Classifying document with few-shot examples")
-        # Generate few-shot examples for high-confidence classes
-        few_shot_examples = "\n\n".join(self.examples[label] for label in high_conf_classes.keys())
-        
-        prompt = f"""
-        {few_shot_examples}
-        
-        Classify the following document into one of these classes: {', '.join(high_conf_classes.keys())}.
-        Document: "{text}"
+        response_text = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+        confidences = {}
+        json_start, json_end = response_text.find("{"), response_text.rfind("}")
+        try:
+            confidences = json.loads(response_text[json_start:json_end + 1])
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse multi-label response: {response_text}")
+        scores = {}
+        for label in self.label_prompts.keys():
+            try:
+                scores[label] = float(str(confidences.get(label, 0)).rstrip("%")) / 100
+            except ValueError:
+                scores[label] = 0.0
+        return scores, self.response_cost(messages, response)
+
+    def select_high_confidence(self, scores: Dict[str, float]) -> Dict[str, float]:
         """
+        Filter classes with high confidence ("Yes" responses).
+        """
+        high_confidence_classes = {label: conf for label, conf in scores.items() if conf >= self.threshold}
+        logger.info(f"High confidence classes: {high_confidence_classes}")
+        return high_confidence_classes
 
-        # Calculate prompt cost
-        prompt_cost = calculate_prompt_cost(prompt, self.model_name)
-        total_cost += float(prompt_cost)
+    def single_class_prediction(self, high_confidence_classes: Dict[str, float]) -> Tuple[str, float]:
+        """
+        Resolve the prediction when exactly one class passed the threshold.
+        """
+        predicted_class = next(iter(high_confidence_classes))
+        if "Physician" in predicted_class:
+            predicted_class = "Physician"
+        elif "Prescription" in predicted_class:
+            predicted_class = "Prescription"
+        elif "Delivery" in predicted_class:
+            predicted_class = "Delivery"
+        elif "Sleep" in predicted_class:
+            predicted_class = "Sleep"
+        elif "Compliance" in predicted_class:
+            predicted_class = "Compliance"
+        elif "Order" in predicted_class:
+            predicted_class = "Order"
+        confidence = high_confidence_classes[predicted_class]
+        logger.info(f"Predicted Class: {predicted_class}, Confidence: {confidence}")
+        return predicted_class, confidence
 
-        # Make the single API call for this document with few-shot examples
-        response = completion(
-            model=self.model_name,
-            messages=[{"role": "user", "content": prompt}]
+    def few_shot_candidates(self, high_confidence_classes: Dict[str, float]) -> Dict[str, float]:
+        """
+        Pick the classes to disambiguate with few-shot examples: all classes when none passed
+        the threshold, otherwise the ones that did.
+        """
+        if len(high_confidence_classes) == 0:
+            logger.info("No high-confidence classification found, using few-shot example classification")
+            return {label: 0.0 for label in self.label_prompts.keys()}
+        logger.info("Multiple high-confidence classifications found, using few-shot example classification")
+        return high_confidence_classes
+
+    def log_result(self, file_name: str, total_cost: float, high_confidence_classes: Dict[str, float], predicted_class: str, confidence: float):
+        logger.info(f"Saving classification result for file: {file_name}")
+        logger.info(f"Total cost: {total_cost}")
+        logger.info(f"High confidence classes: {high_confidence_classes}")
+        logger.info(f"Predicted class: {predicted_class}, Confidence: {confidence}")
+
+    def few_shot_messages(self, text: str, high_conf_classes: Dict[str, float]) -> List[Dict[str, str]]:
+        """
+        Build the chat messages asking to choose between the candidate classes. The examples of
+        every class are already in the examples prefix, so only the question names the candidates.
+        """
+        return self.document_messages(
+            text, f"Classify the document into one of these classes: {', '.join(high_conf_classes.keys())}.", self.examples_prefix
         )
 
-        # Parse the response to extract the predicted class
+    def parse_few_shot_response(self, messages: List[Dict[str, str]], response: dict) -> Tuple[str, float, float]:
+        """
+        Parse the predicted class out of a few-shot response.
+
+        Returns:
+            Tuple of (predicted_class, confidence, cost)
+        """
         response_text = response.get("choices", [{}])[0].get("message", {}).get("content", "")
-        completion_cost = calculate_completion_cost(response_text, self.model_name)
-        total_cost += float(completion_cost)
-        # predicted_class, confidence = self.extract_class_and_confidence(response_text)
+        total_cost = self.response_cost(messages, response)
+        predicted_class = "notsure"
         if "Physician" in response_text:
             predicted_class = "Physician"
         elif "Prescription" in response_text:
@@ -216,6 +540,32 @@ class LLMClassifier(BaseClassifier):
 
         return predicted_class, 0.9, total_cost
 
+    def classify_with_few_shot(self, text: str, high_conf_classes: Dict[str, float]) -> Tuple[str, float, float]:
+        """
+        Classify document using few-shot examples for high-confidence classes.
+
+        Args:
+            text: Document text to classify
+            high_conf_classes: Dictionary of high-confidence classes
+
+        Returns:
+            Tuple of (predicted_class, confidence, cost)
+        """
+        logger.info("Classifying document with few-shot examples")
+        messages = self.few_shot_messages(text, high_conf_classes)
+        # Make the single API call for this document with few-shot examples
+        response = self.complete(messages)
+        return self.parse_few_shot_response(messages, response)
+
+    async def aclassify_with_few_shot(self, text: str, high_conf_classes: Dict[str, float]) -> Tuple[str, float, float]:
+        """
+        Async variant of classify_with_few_shot.
+        """
+        logger.info("Classifying document with few-shot examples")
+        messages = self.few_shot_messages(text, high_conf_classes)
+        response = await self.acomplete(messages)
+        return self.parse_few_shot_response(messages, response)
+
     def extract_confidence(self, response: dict) -> float:
         """
         Extract confidence level from LLM response.
@@ -1,5 +1,6 @@
 import datetime
 import time
+from contextvars import ContextVar
 from loguru import logger
 
 log_filename = f"process_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"
@@ -14,3 +15,37 @@ def track_time(func):
         logger.info(f"Time taken for {func.__name__}: {elapsed_time:.2f} seconds")
         return result, elapsed_time
     return wrapper
+
+def track_time_async(func):
+    async def wrapper(*args, **kwargs):
+        start_time = time.time()
+        result = await func(*args, **kwargs)
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        logger.info(f"Time taken for {func.__name__}: {elapsed_time:.2f} seconds")
+        return result, elapsed_time
+    return wrapper
+
+# Counters of the document being processed. Each thread and asyncio task has its own context,
+# so documents processed concurrently are counted apart; tasks spawned while classifying one
+# document (e.g. per-label calls) share its counters.
+_document_stats = ContextVar("document_stats", default=None)
+
+def start_document_stats():
+    """
+    Start a fresh set of per-document counters in the current context and return it.
+    """
+    stats = {}
+    _document_stats.set(stats)
+    return stats
+
+def document_stats():
+    """
+    Counters started by start_document_stats in this context, or a throwaway dict if none were.
+    """
+    stats = _document_stats.get()
+    return stats if stats is not None else {}
+
+def count_document_stat(name, value=1):
+    stats = document_stats()
+    stats[name] = stats.get(name, 0) + value
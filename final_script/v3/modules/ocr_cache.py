@@ -0,0 +1,28 @@
+import hashlib
+from .disk_cache import DiskCache
+from ..config.base_config import BaseConfig
+
+class OCRCache(DiskCache):
+    """
+    Persistent cache of page OCR text keyed by a hash of the rasterized page and the OCR settings,
+    so repeated cover sheets and boilerplate pages are only OCR'd once.
+    """
+    def __init__(self, path: str = None, max_size_bytes: int = None, max_age_seconds: float = None):
+        super().__init__(
+            path or BaseConfig.OCR_CACHE_PATH,
+            "ocr_cache",
+            BaseConfig.OCR_CACHE_MAX_MB * 1024 * 1024 if max_size_bytes is None else max_size_bytes,
+            BaseConfig.OCR_CACHE_MAX_AGE_DAYS * 24 * 3600 if max_age_seconds is None else max_age_seconds
+        )
+
+    @staticmethod
+    def make_key(image, dpi: int, lang: str, psm: int) -> str:
+        sha256 = hashlib.sha256(f"{image.mode}:{image.size}:{dpi}:{lang}:{psm}:".encode("utf-8"))
+        sha256.update(image.tobytes())
+        return sha256.hexdigest()
+
+    def get(self, key: str):
+        return self.get_value(key)
+
+    def put(self, key: str, text: str):
+        self.put_value(key, text)
@@ -0,0 +1,284 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from .data_processor import new_result, run_extraction, run_cleaning, arun_classification, arun_classification_batch, save_result
+from ..config.base_config import BaseConfig
+
+_DONE = object()  # end-of-stream marker passed down the queues
+
+class StageMetrics:
+    """
+    Items, failures and busy time of one stage. Utilization is the share of the stage's worker
+    slots that were busy over the run; the stage closest to 1.0 is the bottleneck.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.running = workers
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, failed: bool = False):
+        with self.lock:
+            self.items += 1
+            self.failed += failed
+            self.busy_seconds += seconds
+
+    def worker_finished(self) -> bool:
+        """
+        Returns True for the last worker of the stage to finish.
+        """
+        with self.lock:
+            self.running -= 1
+            return self.running == 0
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "failed": self.failed,
+            "busy_seconds": self.busy_seconds,
+            "utilization": self.busy_seconds / (elapsed * self.workers) if elapsed > 0 else 0.0,
+        }
+
+
+class StagedPipeline:
+    """
+    Process documents as a pipeline of concurrent stages connected by bounded queues:
+    extraction threads (OCR is CPU-bound in tesseract subprocesses), cleaning threads, async
+    classification workers sharing one event loop (LLM calls are network-bound) and a single
+    writer in the calling thread. Full queues block the stage feeding them, so a slow stage
+    throttles the ones before it instead of buffering documents in memory.
+    """
+    def __init__(self, classifier, writer, ocr_workers: int = None, clean_workers: int = None,
+                 classify_concurrency: int = None, queue_size: int = None, report_seconds: float = None,
+                 classify_batch: int = None):
+        """
+        Args:
+            classifier: classifier shared by the classification workers
+            writer: DocumentWriter the results are saved to
+            classify_batch: most documents a classification worker takes at once when the
+                classifier supports batches
+        """
+        self.classifier = classifier
+        self.writer = writer
+        self.workers = {
+            "extraction": ocr_workers or BaseConfig.PIPELINE_OCR_WORKERS,
+            "cleaning": clean_workers or BaseConfig.PIPELINE_CLEAN_WORKERS,
+            "classification": classify_concurrency or BaseConfig.PIPELINE_CLASSIFY_CONCURRENCY,
+            "saving": 1,
+        }
+        self.queue_size = queue_size or BaseConfig.PIPELINE_QUEUE_SIZE
+        self.classify_batch = (classify_batch or BaseConfig.PIPELINE_CLASSIFY_BATCH) if getattr(classifier, "supports_batch", False) else 1
+        self.report_seconds = report_seconds or BaseConfig.PIPELINE_REPORT_SECONDS
+        # Queue feeding each stage after extraction
+        self.queues = {stage: queue.Queue(self.queue_size) for stage in ("cleaning", "classification", "saving")}
+        self.metrics = {stage: StageMetrics(workers) for stage, workers in self.workers.items()}
+        self.depth_samples = {stage: [] for stage in self.queues}
+        self.stopping = threading.Event()  # set when a stage fails and the run is being shut down
+        self.error = None
+
+    def run(self, documents) -> dict:
+        """
+        Process [(pdf_file, content_hash)] and return the stage and queue report.
+        """
+        start_time = time.time()
+        inputs = queue.Queue()
+        for document in documents:
+            inputs.put(document)
+
+        threads = self.start_thread_stage(
+            "extraction", lambda document: run_extraction(new_result(*document)),
+            inputs, self.queues["cleaning"], downstream_workers=self.workers["cleaning"]
+        )
+        for _ in range(self.workers["extraction"]):
+            inputs.put(_DONE)
+        threads += self.start_thread_stage(
+            "cleaning", run_cleaning,
+            self.queues["cleaning"], self.queues["classification"], downstream_workers=1
+        )
+        classification_thread = threading.Thread(target=self.run_classification_stage, name="classification", daemon=True)
+        classification_thread.start()
+        threads.append(classification_thread)
+
+        stop_monitor = threading.Event()
+        monitor = threading.Thread(target=self.monitor, args=(stop_monitor, start_time), name="pipeline-monitor", daemon=True)
+        monitor.start()
+        try:
+            self.saving_stage()
+        finally:
+            stop_monitor.set()
+        for thread in threads:
+            thread.join()
+        monitor.join()
+
+        report = self.report(time.time() - start_time)
+        self.log_report(report)
+        if self.error is not None:
+            raise RuntimeError("Pipeline stopped after the classification stage failed") from self.error
+        return report
+
+    def start_thread_stage(self, stage, function, inputs, outputs, downstream_workers):
+        metrics = self.metrics[stage]
+
+        def work():
+            while True:
+                item = inputs.get()
+                if item is _DONE:
+                    break
+                if self.stopping.is_set():
+                    continue  # shutting down: discard the item, keep reading until the marker
+                start = time.perf_counter()
+                try:
+                    result = function(item)
+                except Exception:
+                    logger.exception(f"{stage} failed for {item}")
+                    metrics.record(time.perf_counter() - start, failed=True)
+                    continue
+                metrics.record(time.perf_counter() - start)
+                outputs.put(result)
+            if metrics.worker_finished():
+                for _ in range(downstream_workers):
+                    outputs.put(_DONE)
+
+        threads = [threading.Thread(target=work, name=f"{stage}-{index}", daemon=True) for index in range(self.workers[stage])]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run_classification_stage(self):
+        try:
+            asyncio.run(self.classification_stage())
+        except BaseException as error:
+            logger.exception("classification stage failed, stopping the pipeline")
+            self.error = error
+            self.stopping.set()
+            self.drain(self.queues["classification"])
+        finally:
+            self.queues["saving"].put(_DONE)
+
+    @staticmethod
+    def drain(stage_queue):
+        """
+        Discard items until the end-of-stream marker, so the threads feeding a stage that has
+        stopped never block on its full queue.
+        """
+        while stage_queue.get() is not _DONE:
+            pass
+
+    async def classification_stage(self):
+        """
+        Run classify_concurrency workers on this thread's event loop. Blocking queue operations go
+        to a small dedicated pool, one thread per worker, so they never wait on each other. With a
+        classifier that supports batches, a worker takes every document already waiting, up to
+        classify_batch, and scores them together.
+        """
+        loop = asyncio.get_running_loop()
+        inputs, outputs = self.queues["classification"], self.queues["saving"]
+        metrics = self.metrics["classification"]
+        with ThreadPoolExecutor(max_workers=self.workers["classification"], thread_name_prefix="classification-io") as io_pool:
+            async def worker():
+                finished = False
+                while not finished:
+                    result = await loop.run_in_executor(io_pool, inputs.get)
+                    if result is _DONE:
+                        inputs.put(_DONE)  # let the other workers see it too
+                        break
+                    batch = [result]
+                    finished = self.take_ready(inputs, batch)
+                    start = time.perf_counter()
+                    try:
+                        if len(batch) > 1:
+                            outcomes = await arun_classification_batch(batch, self.classifier)
+                        else:
+                            outcomes = [await arun_classification(result, self.classifier)]
+                    except Exception as error:
+                        outcomes = [error] * len(batch)
+                    seconds = (time.perf_counter() - start) / len(batch)
+                    for result, outcome in zip(batch, outcomes):
+                        if isinstance(outcome, BaseException):
+                            if not isinstance(outcome, Exception):
+                                raise outcome
+                            logger.opt(exception=outcome).error(f"classification failed for {result['file_location']}")
+                            metrics.record(seconds, failed=True)
+                            continue
+                        metrics.record(seconds)
+                        await loop.run_in_executor(io_pool, outputs.put, outcome)
+
+            await asyncio.gather(*(worker() for _ in range(self.workers["classification"])))
+
+    def take_ready(self, inputs, batch) -> bool:
+        """
+        Add the documents already waiting in inputs to batch, up to classify_batch, without
+        blocking. Returns True when the end-of-stream marker was reached.
+        """
+        while len(batch) < self.classify_batch:
+            try:
+                item = inputs.get_nowait()
+            except queue.Empty:
+                return False
+            if item is _DONE:
+                inputs.put(_DONE)
+                return True
+            batch.append(item)
+        return False
+
+    def saving_stage(self):
+        metrics = self.metrics["saving"]
+        inputs = self.queues["saving"]
+        while True:
+            result = inputs.get()
+            if result is _DONE:
+                break
+            start = time.perf_counter()
+            try:
+                save_result(result, self.writer)
+            except Exception:
+                logger.exception(f"saving failed for {result['file_location']}")
+                metrics.record(time.perf_counter() - start, failed=True)
+                continue
+            metrics.record(time.perf_counter() - start)
+
+    def monitor(self, stop, start_time, sample_seconds: float = 0.2):
+        """
+        Sample queue depths until stopped, logging progress every report_seconds.
+        """
+        last_report = time.time()
+        while not stop.wait(sample_seconds):
+            for stage, stage_queue in self.queues.items():
+                self.depth_samples[stage].append(stage_queue.qsize())
+            if time.time() - last_report >= self.report_seconds:
+                last_report = time.time()
+                depths = ", ".join(f"{stage} {stage_queue.qsize()}/{self.queue_size}" for stage, stage_queue in self.queues.items())
+                done = ", ".join(f"{stage} {metrics.items}" for stage, metrics in self.metrics.items())
+                logger.info(f"Pipeline after {last_report - start_time:.0f}s: queued {depths}; done {done}")
+
+    def report(self, elapsed: float) -> dict:
+        stages = {stage: metrics.report(elapsed) for stage, metrics in self.metrics.items()}
+        queues = {
+            stage: {
+                "capacity": self.queue_size,
+                "max_depth": max(samples, default=0),
+                "mean_depth": sum(samples) / len(samples) if samples else 0.0,
+            }
+            for stage, samples in self.depth_samples.items()
+        }
+        return {
+            "elapsed": elapsed,
+            "stages": stages,
+            "queues": queues,
+            "bottleneck": max(stages, key=lambda stage: stages[stage]["utilization"]),
+        }
+
+    @staticmethod
+    def log_report(report: dict):
+        logger.info(f"Pipeline finished in {report['elapsed']:.2f} seconds, bottleneck: {report['bottleneck']}")
+        for stage, stats in report["stages"].items():
+            logger.info(f"  {stage}: {stats['items']} items ({stats['failed']} failed), {stats['workers']} workers, "
+                        f"busy {stats['busy_seconds']:.2f}s, utilization {stats['utilization']:.0%}")
+        for stage, stats in report["queues"].items():
+            logger.info(f"  queue to {stage}: mean depth {stats['mean_depth']:.1f}, max {stats['max_depth']}/{stats['capacity']}")
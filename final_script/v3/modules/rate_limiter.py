@@ -0,0 +1,278 @@
+import asyncio
+import random
+import threading
+import time
+from litellm.exceptions import APIConnectionError, RateLimitError, Timeout
+from loguru import logger
+from .log_config import count_document_stat
+from ..config.base_config import BaseConfig
+
+# Status codes worth retrying: throttling, timeouts and transient server errors
+THROTTLED_STATUS = {429}
+TRANSIENT_STATUS = {408, 409, 500, 502, 503, 504, 529}
+
+class TokenBucket:
+    """
+    Allows per_minute units a minute with bursts of up to a minute's worth. reserve() takes the
+    units at once, letting the bucket go into debt, and returns how long the caller must wait
+    before using them, so concurrent callers are spaced out in arrival order without polling.
+    """
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A request larger than the bucket waits for a full bucket rather than forever
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """
+        Correct an earlier reservation once the real amount is known (positive takes more).
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on in-flight calls that adapts to the provider (AIMD): it halves whenever a call is
+    throttled and grows by one slot per limit's worth of successful calls, up to maximum.
+    """
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self) -> bool:
+        with self.condition:
+            if not self._has_slot():
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self.condition:
+            self.condition.wait_for(self._has_slot)
+            self.in_flight += 1
+
+    async def aacquire(self, poll_seconds: float = 0.01):
+        """
+        Async variant of acquire. Slots are shared with threads and other event loops, so it polls
+        instead of waiting on a loop-bound primitive.
+        """
+        while not self.try_acquire():
+            await asyncio.sleep(poll_seconds)
+
+    def release(self, throttled: bool = False, succeeded: bool = True):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+                logger.warning(f"LLM calls throttled, concurrency limit lowered to {int(self.limit)}")
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+    """
+    Client-side limiter shared by every LLM call of the process: token buckets on requests and
+    tokens per minute, an adaptive concurrency limit, and retries with jittered exponential
+    backoff on throttling and transient errors. A Retry-After from the provider pauses all
+    callers, not just the one that was throttled. Time spent waiting on the limiter, including
+    backoff, is added to the document's limiter_wait counter.
+    """
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrency: int = None,
+                 max_retries: int = None, backoff_seconds: float = None, backoff_max_seconds: float = None):
+        requests_per_minute = BaseConfig.LLM_RPM if requests_per_minute is None else requests_per_minute
+        tokens_per_minute = BaseConfig.LLM_TPM if tokens_per_minute is None else tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency or BaseConfig.LLM_CONCURRENCY_LIMIT)
+        self.max_retries = BaseConfig.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = BaseConfig.LLM_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds or BaseConfig.LLM_BACKOFF_MAX_SECONDS
+        self.paused_until = 0.0  # monotonic time before which no call starts
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "wait_seconds": 0.0}
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserve one request and the estimated tokens, returning the seconds to wait first.
+        """
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def settle(self, estimated_tokens: int, response):
+        """
+        Charge the token bucket for the difference between the estimate and the reported usage.
+        """
+        usage = response.get("usage") if hasattr(response, "get") else None
+        total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+        if self.tokens and total:
+            self.tokens.adjust(total - estimated_tokens)
+
+    @staticmethod
+    def is_throttled(error: Exception) -> bool:
+        return isinstance(error, RateLimitError) or getattr(error, "status_code", None) in THROTTLED_STATUS
+
+    @classmethod
+    def is_retryable(cls, error: Exception) -> bool:
+        return (
+            cls.is_throttled(error)
+            or isinstance(error, (Timeout, APIConnectionError, asyncio.TimeoutError, TimeoutError, ConnectionError))
+            or getattr(error, "status_code", None) in TRANSIENT_STATUS
+        )
+
+    @staticmethod
+    def retry_after(error: Exception):
+        """
+        Seconds asked for by a Retry-After header on the error, if any.
+        """
+        headers = getattr(error, "litellm_response_headers", None)
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
+        value = headers.get("retry-after") if headers is not None else None
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def backoff(self, error: Exception, attempt: int) -> float:
+        """
+        Full-jitter exponential backoff, or the provider's Retry-After when it asks for longer.
+        A Retry-After on a throttled call also pauses every other caller.
+        """
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2 ** attempt))
+        retry_after = self.retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max_seconds))
+            if self.is_throttled(error):
+                with self.lock:
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    def _record_wait(self, seconds: float):
+        with self.lock:
+            self.stats["wait_seconds"] += seconds
+        count_document_stat("limiter_wait", seconds)
+
+    def _refund(self, estimated_tokens: int):
+        """
+        Return the token reservation of a call that did not complete, so its retry is not charged twice.
+        """
+        if self.tokens:
+            self.tokens.adjust(-estimated_tokens)
+
+    def _record_abandoned(self, estimated_tokens: int):
+        """
+        Give back the slot and tokens of a call cancelled or interrupted while in flight.
+        """
+        self.concurrency.release(succeeded=False)
+        self._refund(estimated_tokens)
+
+    def _record_failure(self, error: Exception, attempt: int, estimated_tokens: int) -> float:
+        """
+        Release the slot of a failed call and return the backoff before retrying it, or re-raise.
+        """
+        throttled = self.is_throttled(error)
+        self.concurrency.release(throttled=throttled, succeeded=False)
+        self._refund(estimated_tokens)
+        with self.lock:
+            self.stats["throttled"] += throttled
+        if not self.is_retryable(error) or attempt >= self.max_retries:
+            raise error
+        delay = self.backoff(error, attempt)
+        with self.lock:
+            self.stats["retries"] += 1
+        count_document_stat("llm_retries")
+        logger.warning(f"LLM call failed (attempt {attempt + 1} of {self.max_retries + 1}), retrying in {delay:.2f}s: {type(error).__name__}: {error}")
+        return delay
+
+    def _record_success(self, estimated_tokens: int, response):
+        self.concurrency.release()
+        self.settle(estimated_tokens, response)
+        with self.lock:
+            self.stats["calls"] += 1
+
+    def call(self, request, estimated_tokens: int = 0):
+        """
+        Run request() once the limits allow it, retrying throttled and transient failures.
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            time.sleep(self.reserve(estimated_tokens))
+            self.concurrency.acquire()
+            self._record_wait(time.monotonic() - start)
+            try:
+                response = request()
+            except Exception as error:
+                delay = self._record_failure(error, attempt, estimated_tokens)
+                time.sleep(delay)
+                self._record_wait(delay)
+                continue
+            except BaseException:
+                # Cancelled (a timeout or a cancelled gather) or interrupted: the slot must not leak
+                self._record_abandoned(estimated_tokens)
+                raise
+            self._record_success(estimated_tokens, response)
+            return response
+
+    async def acall(self, request, estimated_tokens: int = 0):
+        """
+        Async variant of call; request() returns an awaitable.
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            await asyncio.sleep(self.reserve(estimated_tokens))
+            await self.concurrency.aacquire()
+            self._record_wait(time.monotonic() - start)
+            try:
+                response = await request()
+            except Exception as error:
+                delay = self._record_failure(error, attempt, estimated_tokens)
+                await asyncio.sleep(delay)
+                self._record_wait(delay)
+                continue
+            except BaseException:
+                # Cancelled (a timeout or a cancelled gather) or interrupted: the slot must not leak
+                self._record_abandoned(estimated_tokens)
+                raise
+            self._record_success(estimated_tokens, response)
+            return response
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def shared_rate_limiter() -> RateLimiter:
+    """
+    The process-wide limiter used by LLM classifiers that are not given one. Limits apply per
+    process, so with several workers set LLM_RPM and LLM_TPM to each worker's share.
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
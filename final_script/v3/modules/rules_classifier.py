@@ -0,0 +1,187 @@
+import asyncio
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from loguru import logger
+from .llm_classifier import BaseClassifier
+from .keyword_matcher import KeywordMatcher
+from .log_config import track_time, track_time_async, document_stats
+from ..config.base_config import BaseConfig
+
+@dataclass
+class DocumentFeatures:
+    """Data class to store document classification features"""
+    keywords: List[str]
+    structure_starts: List[str]
+    measurements: List[str]
+    required_fields: List[str]
+    semantic_patterns: List[str]
+
+
+class RulesClassifier(BaseClassifier):
+    """
+    Classify documents with the weighted keyword and pattern rules from classification_rules.json.
+    Costs no API calls, so it can run as the first tier ahead of the LLM.
+    """
+    # Weight of each feature type in the class score
+    FEATURE_WEIGHTS = {
+        "keywords": 1.0,
+        "structure_starts": 1.5,
+        "measurements": 0.8,
+        "required_fields": 2.0,
+    }
+    PATTERN_WEIGHT = 1.5
+
+    def __init__(self, rules_path: str = None, threshold: float = None, min_margin: float = None):
+        super().__init__("rules", BaseConfig.RULES_MIN_SCORE if threshold is None else threshold)
+        self.min_margin = BaseConfig.RULES_MIN_MARGIN if min_margin is None else min_margin
+        self.rules = self.load_rules(rules_path or BaseConfig.RULES_PATH)
+        self.compiled_rules = self.compile_rules(self.rules)
+        self.matcher = KeywordMatcher.from_rules(self.rules, self.FEATURE_WEIGHTS)
+
+    def load_rules(self, filepath: str) -> Dict[str, DocumentFeatures]:
+        """Load classification rules from a JSON file."""
+        logger.info(f"Loading classification rules from {filepath}")
+        with open(filepath, 'r') as f:
+            rules_dict = json.load(f)
+        return {
+            class_name: DocumentFeatures(**features)
+            for class_name, features in rules_dict.items()
+        }
+
+    def compile_rules(self, rules: Dict[str, DocumentFeatures]) -> Dict[str, List[re.Pattern]]:
+        """
+        Compile the semantic patterns once so scoring a document does not recompile them.
+        """
+        return {
+            class_name: [re.compile(pattern, re.IGNORECASE) for pattern in features.semantic_patterns]
+            for class_name, features in rules.items()
+        }
+
+    def score_document(self, text: str) -> Dict[str, float]:
+        """
+        Score the document against every class. All keyword-like terms of all classes are
+        found in a single pass of the keyword matcher.
+
+        Returns:
+            Dictionary of class name to score in the 0-1 range
+        """
+        term_counts = self.matcher.match(text)
+        scores = {}
+        for class_name, features in self.rules.items():
+            total_score, max_score = 0.0, 0.0
+            for feature_type, weight in self.FEATURE_WEIGHTS.items():
+                total_score += int(term_counts.get((class_name, feature_type), 0) * weight)
+                max_score += int(len(getattr(features, feature_type)) * weight)
+            patterns = self.compiled_rules[class_name]
+            pattern_matches = sum(1 for pattern in patterns if pattern.search(text))
+            total_score += pattern_matches * self.PATTERN_WEIGHT
+            max_score += len(patterns) * self.PATTERN_WEIGHT
+            scores[class_name] = total_score / max_score if max_score > 0 else 0.0
+        return scores
+
+    def is_decisive(self, scores: Dict[str, float]) -> bool:
+        """
+        The rules decide on their own when the best class clears the threshold and leads the
+        runner-up by at least min_margin.
+        """
+        ranked = sorted(scores.values(), reverse=True)
+        runner_up = ranked[1] if len(ranked) > 1 else 0.0
+        return ranked[0] >= self.threshold and ranked[0] - runner_up >= self.min_margin
+
+    @track_time
+    def classify_document(self, text: str, file_name: str):
+        """
+        Classify a document with the rules.
+
+        Returns:
+            Tuple of (predicted_class, confidence, high_confidence_classes, cost)
+        """
+        logger.info(f"Classifying document with rules: {file_name}")
+        scores = self.score_document(text)
+        predicted_class = max(scores, key=scores.get)
+        confidence = scores[predicted_class]
+        if confidence < self.threshold:
+            predicted_class = "notsure"
+        high_confidence_classes = {label: score for label, score in scores.items() if score >= self.threshold}
+        logger.info(f"Predicted class: {predicted_class}, Confidence: {confidence}")
+        return predicted_class, confidence, high_confidence_classes, 0.0
+
+
+class CascadeClassifier(BaseClassifier):
+    """
+    Run cheap classifiers first and only fall through to the next tier when a tier is not decisive.
+    Every tier but the last must provide score_document and is_decisive.
+    """
+    def __init__(self, tiers: List[BaseClassifier]):
+        super().__init__("cascade", tiers[-1].threshold)
+        self.tiers = tiers
+        self.final_tier = tiers[-1]
+        self.classification_mode = getattr(self.final_tier, "classification_mode", None)
+        self.cache_stats = self.final_tier.cache_stats
+        self.token_stats = self.final_tier.token_stats
+        self.supports_batch = any(tier.supports_batch for tier in tiers[:-1])
+
+    @staticmethod
+    def tier_result(tier: BaseClassifier, scores: Dict[str, float]) -> Tuple[str, float, Dict[str, float], float]:
+        predicted_class = max(scores, key=scores.get)
+        logger.info(f"Tier {tier.model_name} decided: {predicted_class} ({scores[predicted_class]:.2f})")
+        high_confidence_classes = {label: score for label, score in scores.items() if score >= tier.threshold}
+        return predicted_class, scores[predicted_class], high_confidence_classes, 0.0
+
+    def decide_early(self, text: str) -> Tuple[str, float, Dict[str, float], float]:
+        """
+        Return the result of the first decisive tier, or None when the final tier has to decide.
+        """
+        for tier in self.tiers[:-1]:
+            scores = tier.score_document(text)
+            if tier.is_decisive(scores):
+                self.last_tier = document_stats()["tier"] = tier.model_name
+                return self.tier_result(tier, scores)
+        self.last_tier = document_stats()["tier"] = self.final_tier.model_name
+        return None
+
+    def decide_batch(self, texts: List[str]):
+        """
+        Run the cheap tiers over a batch, each tier scoring the documents still undecided together.
+        """
+        decisions = [None] * len(texts)
+        pending = list(range(len(texts)))
+        for tier in self.tiers[:-1]:
+            if not pending:
+                break
+            batch = [texts[index] for index in pending]
+            batch_scores = tier.score_documents(batch) if hasattr(tier, "score_documents") else [tier.score_document(text) for text in batch]
+            undecided = []
+            for index, scores in zip(pending, batch_scores):
+                if tier.is_decisive(scores):
+                    decisions[index] = (self.tier_result(tier, scores), tier.model_name)
+                else:
+                    undecided.append(index)
+            pending = undecided
+        return decisions
+
+    async def aclassify_undecided(self, text: str, file_name: str):
+        self.last_tier = document_stats()["tier"] = self.final_tier.model_name
+        logger.info(f"No decisive tier for {file_name}, using {self.final_tier.model_name}")
+        return await self.final_tier.aclassify_document(text, file_name)
+
+    @track_time
+    def classify_document(self, text: str, file_name: str):
+        result = self.decide_early(text)
+        if result is not None:
+            return result
+        logger.info(f"No decisive tier for {file_name}, using {self.final_tier.model_name}")
+        result, _ = self.final_tier.classify_document(text, file_name)
+        return result
+
+    @track_time_async
+    async def aclassify_document(self, text: str, file_name: str):
+        # The cheap tiers are sync, so they run in a worker thread to keep the event loop free
+        result = await asyncio.to_thread(self.decide_early, text)
+        if result is not None:
+            return result
+        logger.info(f"No decisive tier for {file_name}, using {self.final_tier.model_name}")
+        result, _ = await self.final_tier.aclassify_document(text, file_name)
+        return result
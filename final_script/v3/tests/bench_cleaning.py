@@ -0,0 +1,42 @@
+"""
+Micro-benchmark of the text cleaning engine against the original sequence of re.sub calls.
+
+Run from the project root:
+    python -m final_script.v3.tests.bench_cleaning
+"""
+import json
+import re
+import timeit
+from pathlib import Path
+from final_script.v3.modules.data_cleaning import text_cleaner
+
+CORPUS_PATH = Path(__file__).parent.parent.parent.parent / "experiments" / "1_data_processing" / "selected_results.json"
+
+def original_clean_text(text):
+    """The passes of refined_clean_text before the engine, as the baseline."""
+    text = re.sub(r'[^\w\s:/.,%-]+', '', text)
+    text = re.sub(r'\boor\b|\be\b|\baye\b|\beee\b', '', text)
+    text = re.sub(r'\n+', '\n', text)
+    text = re.sub(r'\s{2,}', ' ', text)
+    text = re.sub(r'(?<=[.,])(?=\S)', ' ', text)
+    text = re.sub(r'(Phone|Fax|Email):? [^\n]*\n', '', text)
+    text = re.sub(r'^[^\w]+', '', text)
+    text = re.sub(r'(\d)(cmH20|L/min|%)', r'\1 \2', text)
+    text = re.sub(r'\s+([:,])', r'\1', text)
+    text = re.sub(r'([:,])\s+', r'\1 ', text)
+    return text.strip()
+
+def main(copies=20, repeat=7):
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        text = ''.join(json.load(f)["texts"].values()) * copies
+    assert text_cleaner.clean(text) == original_clean_text(text)
+
+    original_time = min(timeit.repeat(lambda: original_clean_text(text), number=1, repeat=repeat))
+    engine_time = min(timeit.repeat(lambda: text_cleaner.clean(text), number=1, repeat=repeat))
+    print(f"Text size: {len(text) / 1e6:.2f} MB")
+    print(f"Original passes: {original_time * 1000:.1f} ms")
+    print(f"Cleaning engine: {engine_time * 1000:.1f} ms")
+    print(f"Speedup: {original_time / engine_time:.2f}x")
+
+if __name__ == "__main__":
+    main()
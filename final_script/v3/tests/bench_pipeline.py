@@ -0,0 +1,251 @@
+"""
+End-to-end benchmark of the document pipeline on a synthetic corpus (see synthetic_corpus.py).
+Times every stage (text layer extraction, OCR, cleaning, classification, persistence), the
+throughput in documents and pages per minute and the peak RSS, and writes them as JSON.
+Classification runs against the offline mock LLM (or a recorded cassette), so runs are free
+and comparable; pass --baseline to print the change against an earlier result file.
+Extraction needs the full requirements.txt install (pymupdf, and tesseract for scanned
+documents). Results go to bench_results/, which git ignores.
+
+Run from the project root:
+    python -m final_script.v3.tests.bench_pipeline --per-class 3 --pages 1,5 --output bench_results/run.json
+    python -m final_script.v3.tests.bench_pipeline --mode staged --baseline bench_results/run.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+from loguru import logger
+from sqlalchemy import create_engine, text
+from final_script.v3.config.base_config import BaseConfig
+from final_script.v3.tests.synthetic_corpus import KINDS, generate_corpus
+
+STAGES = ("extraction", "ocr", "cleaning", "classification", "persistence")
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def summarize(values: List[float]) -> Dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0, "total": 0.0}
+
+    def percentile(share):
+        return ordered[min(len(ordered) - 1, round(share * (len(ordered) - 1)))]
+
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "max": ordered[-1],
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_corpus(args) -> List[Dict]:
+    """
+    Reuse the corpus in corpus_dir when it was generated with the same settings, else generate it.
+    """
+    settings = {"per_class": args.per_class, "page_counts": args.pages, "kinds": args.kinds, "seed": args.seed, "scan_dpi": args.scan_dpi}
+    manifest_path = Path(args.corpus_dir) / "manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["settings"] == settings:
+            logger.warning(f"Reusing the corpus in {args.corpus_dir}")
+            return manifest["documents"]
+    logger.warning(f"Generating the corpus in {args.corpus_dir}")
+    return generate_corpus(args.corpus_dir, args.per_class, args.pages, args.kinds, args.seed, args.scan_dpi)
+
+def configure(args, database_path: Path):
+    """
+    Settings that keep runs comparable: a fresh results database, no OCR or LLM response
+    caches, the mock LLM or a cassette instead of the provider, and no client-side rate limits.
+    Applied before the pipeline modules are imported, so that importing them does not create
+    the default results database either.
+    """
+    BaseConfig.DATABASE_URL = f"sqlite:///{database_path}"
+    BaseConfig.OCR_CACHE_ENABLED = False
+    BaseConfig.LLM_CACHE_ENABLED = False
+    BaseConfig.LLM_CASSETTE_MODE = args.llm
+    BaseConfig.LLM_REPLAY_LATENCY = args.llm_latency
+    if args.cassette:
+        BaseConfig.LLM_CASSETTE_PATH = args.cassette
+    BaseConfig.LLM_RPM = 0
+    BaseConfig.LLM_TPM = 0
+
+def run_serial(corpus, classifier, writer) -> Dict[str, List[float]]:
+    """
+    Run the stages one document at a time, timing each of them.
+    """
+    from final_script.v3.modules.data_processor import new_result, run_extraction, run_cleaning, run_classification, save_result, file_hash
+    times = {stage: [] for stage in STAGES}
+    for entry in corpus:
+        result = new_result(entry["file"], file_hash(entry["file"]))
+        start = time.perf_counter()
+        run_extraction(result)
+        extraction_time = time.perf_counter() - start
+        ocr_metadata = result["metadata"]["OCR"]
+        ocr_time = ocr_metadata.get("ocr_time", extraction_time if ocr_metadata.get("method") == "ocr" else 0.0)
+        times["ocr"].append(ocr_time)
+        times["extraction"].append(max(0.0, extraction_time - ocr_time))
+        for stage, function in [("cleaning", run_cleaning), ("classification", lambda result: run_classification(result, classifier)),
+                                ("persistence", lambda result: save_result(result, writer))]:
+            start = time.perf_counter()
+            function(result)
+            times[stage].append(time.perf_counter() - start)
+    return times
+
+def run_staged(corpus, classifier, writer) -> Dict:
+    """
+    Run the corpus through the StagedPipeline; stage times are its busy seconds, and
+    extraction includes OCR.
+    """
+    from final_script.v3.modules.data_processor import file_hash
+    from final_script.v3.modules.pipeline import StagedPipeline
+    report = StagedPipeline(classifier, writer).run([(entry["file"], file_hash(entry["file"])) for entry in corpus])
+    return report
+
+def accuracy(bind, corpus) -> float:
+    labels = {os.path.basename(entry["file"]): entry["label"] for entry in corpus}
+    with bind.connect() as connection:
+        rows = connection.execute(text("SELECT file_name, classified_category FROM documents")).all()
+    correct = sum(1 for file_name, predicted in rows if labels.get(file_name) == predicted)
+    return correct / len(corpus) if corpus else 0.0
+
+def run(args) -> Dict:
+    commit = git_commit()  # before the pipeline is loaded, so the forked git does not count towards peak RSS
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    database_path = workdir / "bench_results.db"
+    if database_path.exists():
+        database_path.unlink()
+    configure(args, database_path)
+    from final_script.v3.modules.database import DocumentWriter, init_db
+    from final_script.v3.modules.data_processor import create_classifier
+
+    corpus = load_corpus(args)
+    bind = create_engine(BaseConfig.DATABASE_URL)
+    init_db(bind)
+    classifier = create_classifier(args.classifier, args.classification_mode)
+
+    start = time.perf_counter()
+    writer = DocumentWriter(bind=bind)
+    if args.mode == "staged":
+        report = run_staged(corpus, classifier, writer)
+        stages = {stage: {"total": stats["busy_seconds"], "count": stats["items"], "utilization": stats["utilization"]}
+                  for stage, stats in report["stages"].items()}
+        stages["persistence"] = stages.pop("saving")
+    else:
+        times = run_serial(corpus, classifier, writer)
+        stages = {stage: summarize(values) for stage, values in times.items()}
+    flush_start = time.perf_counter()
+    writer.close()
+    stages["persistence"]["final_flush"] = time.perf_counter() - flush_start
+    elapsed = time.perf_counter() - start
+
+    pages = sum(entry["pages"] for entry in corpus)
+    return {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {
+            "mode": args.mode, "classifier": args.classifier, "classification_mode": classifier.classification_mode,
+            "llm": args.llm, "llm_latency": args.llm_latency, "pipeline_version": BaseConfig.PIPELINE_VERSION,
+            "text_layer_fast_path": BaseConfig.TEXT_LAYER_FAST_PATH, "ocr_dpi": BaseConfig.OCR_DPI,
+            "ocr_workers": BaseConfig.OCR_WORKERS, "ocr_page_window": BaseConfig.OCR_PAGE_WINDOW,
+            "llm_async": BaseConfig.LLM_ASYNC, "llm_excerpt_tokens": BaseConfig.LLM_EXCERPT_TOKENS,
+        },
+        "corpus": {"documents": len(corpus), "pages": pages, "per_class": args.per_class, "page_counts": args.pages,
+                   "kinds": args.kinds, "seed": args.seed},
+        "elapsed_seconds": elapsed,
+        "docs_per_minute": len(corpus) / elapsed * 60 if elapsed else 0.0,
+        "pages_per_minute": pages / elapsed * 60 if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_children_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),  # tesseract and pdftoppm subprocesses
+        "accuracy": accuracy(bind, corpus),
+        "stages": stages,
+    }
+
+def comparable_metrics(results: Dict) -> Dict[str, float]:
+    metrics = {name: results[name] for name in ("elapsed_seconds", "docs_per_minute", "pages_per_minute", "peak_rss_mb", "accuracy")}
+    for stage, stats in results["stages"].items():
+        metrics[f"{stage} total"] = stats["total"]
+    return metrics
+
+def compare(results: Dict, baseline: Dict):
+    """
+    Print every metric next to the baseline value and the relative change.
+    """
+    current, previous = comparable_metrics(results), comparable_metrics(baseline)
+    print(f"Compared with the run of {baseline['created_at']} ({baseline.get('git_commit') or 'unknown commit'}):")
+    for name, value in current.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        change = f"{(value - before) / before:+.1%}" if before else "n/a"
+        print(f"  {name:<24} {before:>12.3f} -> {value:>12.3f}  ({change})")
+
+def print_summary(results: Dict):
+    corpus = results["corpus"]
+    print(f"{corpus['documents']} documents, {corpus['pages']} pages in {results['elapsed_seconds']:.2f}s: "
+          f"{results['docs_per_minute']:.1f} docs/min, {results['pages_per_minute']:.1f} pages/min")
+    print(f"Peak RSS {results['peak_rss_mb']:.0f} MB (subprocesses {results['peak_children_rss_mb']:.0f} MB), accuracy {results['accuracy']:.1%}")
+    for stage, stats in results["stages"].items():
+        mean = f", mean {stats['mean'] * 1000:.1f} ms, p95 {stats['p95'] * 1000:.1f} ms" if "mean" in stats else ""
+        print(f"  {stage:<15} total {stats['total']:.3f}s{mean}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-class", type=int, default=2, help="documents per class, kind and page count")
+    parser.add_argument("--pages", default="1,3", help="comma-separated page counts")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="digital, scanned or both")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scan-dpi", type=int, default=150, help="resolution of the scanned-looking pages")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "classify_pdf_bench_corpus"))
+    parser.add_argument("--workdir", help="directory of the benchmark database, a new temporary one by default")
+    parser.add_argument("--mode", choices=("serial", "staged"), default="serial")
+    parser.add_argument("--classifier", default="llm", help="llm, rules, embedding or cascade")
+    parser.add_argument("--classification-mode", default=None, help="per_label or multi_label")
+    parser.add_argument("--llm", choices=("mock", "replay"), default="mock", help="mock LLM, or replay a recorded cassette")
+    parser.add_argument("--cassette", help="cassette file to replay")
+    parser.add_argument("--llm-latency", default="0.2", help='simulated seconds per LLM call, or "recorded"')
+    parser.add_argument("--output", help="result file, bench_results/pipeline_<timestamp>.json by default")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    args.pages = [int(pages) for pages in args.pages.split(",")]
+    args.kinds = args.kinds.split(",")
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    results = run(args)
+    print_summary(results)
+
+    output = Path(args.output or f"bench_results/pipeline_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Synthetic PDF corpus for the pipeline benchmark: documents of the six classes, either
+born-digital (with a text layer, read by the fast path) or scanned-looking (a noisy, slightly
+rotated page image with no text layer, so every page goes through OCR). The same seed always
+gives the same documents.
+
+Run from the project root:
+    python -m final_script.v3.tests.synthetic_corpus OUTPUT_DIR --per-class 3 --pages 1,5 --kinds digital,scanned
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+CLASSES = ("Compliance", "Sleep", "Order", "Delivery", "Physician", "Prescription")
+KINDS = ("digital", "scanned")
+
+FIRST_PAGES = {
+    "Compliance": [
+        "AirView Compliance Report",
+        "Patient Compliance Data - Name: {name}, DOB: {dob}, ID: {mrn}",
+        "Compliance Period: {date} - {date2}",
+        "Compliance Met: Yes, Compliance Percentage: {percent}%",
+        "Usage Days: {days}/30 days, Days with >= 4 hours usage: {days4} days",
+        "Average Usage (All Days): {hours} hours {minutes} minutes",
+        "Therapy Hours: {therapy} hours total",
+        "Device: AirSense 11 AutoSet, Serial Number: {serial}",
+        "Pressure Settings: Min {pmin} cmH2O, Max {pmax} cmH2O, EPR Level 2",
+        "Leak Rate - Median: {leak} L/min, 95th Percentile: {leak95} L/min",
+        "Events Per Hour - AHI: {ahi}",
+    ],
+    "Sleep": [
+        "Sleep Study Report",
+        "Sleep Laboratory, Institute of Sleep Medicine",
+        "Patient Name: {name}, DOB: {dob}, MRN: {mrn}",
+        "Study Date: {date}",
+        "Diagnostic polysomnography for suspected obstructive sleep apnea",
+        "Total Sleep Time: {hours} hours {minutes} minutes, sleep efficiency {percent}%",
+        "REM latency {minutes} minutes, arousal index {arousal}",
+        "Apnea Index: {apnea}, hypopnea index: {hypopnea}, AHI {ahi}",
+        "Lowest oxygen saturation {spo2}%",
+        "Impression: moderate obstructive sleep apnea; CPAP titration study recommended",
+    ],
+    "Order": [
+        "Supply Order",
+        "Order Date: {date}",
+        "MRN: {mrn}, Patient: {name}, DOB: {dob}",
+        "Provider: Dr. {doctor}, NPI: {npi}",
+        "Equipment Description: CPAP machine with heated humidifier (E0601, E0562)",
+        "Supply requested: full face mask A7030, tubing A7037 1 per 3 months, filters A7038 2 per month",
+        "Purchase requisition authorized by the ordering provider",
+        "Diagnosis: Obstructive sleep apnea G47.33",
+        "Please fax order confirmation and anticipated setup date",
+    ],
+    "Delivery": [
+        "DELIVERY RECEIPT",
+        "Proof of Delivery - Care Medical Supplies Inc.",
+        "Name: {name}, Account Number: {mrn}",
+        "Delivery Date: {date}",
+        "Equipment delivered: CPAP machine AirSense 10, Serial Number: {serial}, Quantity: 1",
+        "Supplied: heated humidifier E0562, nasal mask, tubing, filters",
+        "Shipment received and confirmed by the patient",
+        "Patient Signature: ______________ Date: {date}",
+        "Delivery confirmation signed by the driver",
+    ],
+    "Physician": [
+        "Progress Notes",
+        "Patient Name: {name}, DOB: {dob}",
+        "Physician: Dr. {doctor}, Date: {date}",
+        "Follow up: sleep study results and CPAP adherence",
+        "Symptoms: daytime sleepiness, loud snoring, morning headaches",
+        "Examination: BMI {bmi}, neck circumference {neck} cm, Mallampati 3",
+        "Assessment: obstructive sleep apnea, hypertension",
+        "Diagnosis: G47.33, I10",
+        "Plan: continue treatment, evaluation of findings in 3 months",
+    ],
+    "Prescription": [
+        "Prescription",
+        "Rx: CPAP therapy and medication order",
+        "Patient: {name}, DOB: {dob}",
+        "Medication Name: {drug}, Dosage: {dose} mg once daily",
+        "Quantity: {quantity}, Refills: {refills}",
+        "Dispense as written; pharmacy to verify insurance",
+        "Prescribed by Dr. {doctor}, NPI: {npi}",
+        "Prescription signed electronically on {date}",
+    ],
+}
+
+# Lines repeated on the pages after the first, in the style of each class
+CONTINUATION = {
+    "Compliance": "{date}  usage {hours}h {minutes}m  AHI {ahi}  leak {leak} L/min  pressure {pmin} cmH2O",
+    "Sleep": "Epoch {epoch}: stage N{stage}, {events} respiratory events, SpO2 {spo2}%, arousal {arousal}",
+    "Order": "Item {item}: supply code A70{code}, quantity {quantity}, equipment requested {date}",
+    "Delivery": "Item {item}: serial {serial}, quantity {quantity}, delivered {date}, received by {name}",
+    "Physician": "{date}: symptoms reviewed, examination findings stable, treatment plan unchanged",
+    "Prescription": "Rx {item}: {drug} {dose} mg, dispense {quantity}, refill {refills}, pharmacy notified",
+}
+
+LINES_PER_PAGE = 40
+NAMES = ("Jane Doe", "John Smith", "Maria Garcia", "Wei Chen", "Aisha Khan", "Liam Murphy")
+DOCTORS = ("Henry Lewis", "Ana Silva", "Rahul Mehta", "Grace Kim")
+DRUGS = ("Modafinil", "Gemfibrozil", "Lisinopril", "Bisacodyl")
+
+def fake_fields(rng: random.Random) -> Dict[str, object]:
+    date = f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2023"
+    return {
+        "name": rng.choice(NAMES), "doctor": rng.choice(DOCTORS), "drug": rng.choice(DRUGS),
+        "dob": f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1940, 1990)}",
+        "date": date, "date2": f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024",
+        "mrn": rng.randint(10 ** 8, 10 ** 9 - 1), "npi": rng.randint(10 ** 9, 10 ** 10 - 1),
+        "serial": rng.randint(10 ** 10, 10 ** 11 - 1), "percent": rng.randint(60, 98),
+        "days": rng.randint(18, 30), "days4": rng.randint(12, 25), "hours": rng.randint(4, 8),
+        "minutes": rng.randint(0, 59), "therapy": rng.randint(100, 240), "pmin": rng.randint(4, 8),
+        "pmax": rng.randint(12, 20), "leak": round(rng.uniform(5, 20), 1), "leak95": round(rng.uniform(20, 40), 1),
+        "ahi": round(rng.uniform(1, 40), 1), "arousal": round(rng.uniform(5, 30), 1), "apnea": round(rng.uniform(1, 20), 1),
+        "hypopnea": round(rng.uniform(1, 20), 1), "spo2": rng.randint(80, 99), "bmi": round(rng.uniform(22, 40), 1),
+        "neck": rng.randint(34, 48), "dose": rng.choice((5, 10, 20, 600)), "quantity": rng.randint(1, 90),
+        "refills": rng.randint(0, 5), "item": rng.randint(1, 99), "code": rng.randint(30, 39),
+        "epoch": rng.randint(1, 900), "stage": rng.randint(1, 3), "events": rng.randint(0, 6),
+    }
+
+def document_pages(label: str, page_count: int, rng: random.Random) -> List[List[str]]:
+    """
+    Text lines of every page: the class's first page, then pages of continuation lines.
+    """
+    pages = [[line.format(**fake_fields(rng)) for line in FIRST_PAGES[label]]]
+    for _ in range(page_count - 1):
+        pages.append([CONTINUATION[label].format(**fake_fields(rng)) for _ in range(LINES_PER_PAGE)])
+    for number, lines in enumerate(pages, start=1):
+        lines.append(f"Page {number} of {page_count}")
+    return pages
+
+def write_digital_pdf(path: Path, pages: List[List[str]]):
+    import pymupdf
+    with pymupdf.open() as doc:
+        for lines in pages:
+            page = doc.new_page(width=612, height=792)
+            page.insert_text((54, 72), lines, fontsize=10)
+        doc.save(str(path))
+
+def page_font(size: int):
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+def render_scanned_page(lines: List[str], rng: random.Random, dpi: int):
+    """
+    Page image with the look of a fax or scan: slight skew, speckle noise and blur.
+    """
+    from PIL import Image, ImageDraw, ImageFilter
+    width, height = int(8.5 * dpi), 11 * dpi
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = page_font(dpi // 7)
+    line_height = dpi // 5
+    for number, line in enumerate(lines):
+        draw.text((dpi * 0.75, dpi + number * line_height), line, fill=rng.randint(0, 60), font=font)
+    for _ in range(width * height // 2000):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randint(0, 120))
+    image = image.rotate(rng.uniform(-1.5, 1.5), fillcolor=255)
+    return image.filter(ImageFilter.GaussianBlur(0.6))
+
+def write_scanned_pdf(path: Path, pages: List[List[str]], rng: random.Random, dpi: int = 150):
+    images = [render_scanned_page(lines, rng, dpi) for lines in pages]
+    # A fixed date keeps the file bytes identical between runs with the same seed
+    date = time.strptime("2024-01-01", "%Y-%m-%d")
+    images[0].save(str(path), "PDF", resolution=dpi, save_all=True, append_images=images[1:],
+                   creationDate=date, modDate=date)
+
+def generate_corpus(output_dir, per_class: int = 2, page_counts: Sequence[int] = (1, 3), kinds: Sequence[str] = KINDS,
+                    seed: int = 0, scan_dpi: int = 150) -> List[Dict]:
+    """
+    Write per_class documents of every class, page count and kind to output_dir, with a
+    manifest.json listing the file, label, kind and page count of each.
+
+    Returns:
+        The manifest entries
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for label in CLASSES:
+        for kind in kinds:
+            for page_count in page_counts:
+                for index in range(per_class):
+                    rng = random.Random(f"{seed}-{label}-{kind}-{page_count}-{index}")
+                    path = output_dir / f"{label.lower()}_{kind}_{page_count}p_{index:03d}.pdf"
+                    pages = document_pages(label, page_count, rng)
+                    if kind == "digital":
+                        write_digital_pdf(path, pages)
+                    elif kind == "scanned":
+                        write_scanned_pdf(path, pages, rng, scan_dpi)
+                    else:
+                        raise ValueError(f"Unknown document kind: {kind}")
+                    manifest.append({"file": str(path), "label": label, "kind": kind, "pages": page_count})
+    settings = {"per_class": per_class, "page_counts": list(page_counts), "kinds": list(kinds), "seed": seed, "scan_dpi": scan_dpi}
+    with open(output_dir / "manifest.json", "w") as f:
+        json.dump({"settings": settings, "documents": manifest}, f, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir")
+    parser.add_argument("--per-class", type=int, default=2, help="documents per class, kind and page count")
+    parser.add_argument("--pages", default="1,3", help="comma-separated page counts")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="digital, scanned or both")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = generate_corpus(args.output_dir, args.per_class, [int(pages) for pages in args.pages.split(",")],
+                               args.kinds.split(","), args.seed)
+    print(f"Wrote {len(manifest)} documents to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
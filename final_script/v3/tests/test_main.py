@@ -1,15 +1,55 @@
 import pytest
 import os
-from unittest.mock import patch, MagicMock
+import re
+import json
+import hashlib
+import random
+import asyncio
+import time
+import threading
+import subprocess
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 from pathlib import Path
+from types import SimpleNamespace
 
 # Add the project root to the Python path
 project_root = str(Path(__file__).parent.parent.parent.parent)
 sys.path.insert(0, project_root)
 
+# Use litellm's bundled model cost map instead of fetching it at import time
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
 # Import the modules we want to test
 from final_script.v3.modules.log_config import track_time
+from final_script.v3.modules import data_processor
+from final_script.v3.modules.data_processor import page_windows, is_usable_text, select_files_to_process, file_hash, ocr_images
+from final_script.v3.modules.ocr_cache import OCRCache
+from final_script.v3.modules.rules_classifier import RulesClassifier, CascadeClassifier
+from final_script.v3.modules.keyword_matcher import KeywordMatcher
+from final_script.v3.modules.embedding_classifier import EmbeddingClassifier
+from final_script.v3.modules.data_cleaning import refined_clean_text, text_cleaner
+from final_script.v3.modules.llm_classifier import LLMClassifier, split_document_message
+from final_script.v3.modules.llm_cache import LLMCache
+from final_script.v3.modules.database import Base, Document, DocumentText, DocumentWriter, upsert_documents, load_document_text, move_text_columns, backfill_metrics, apply_migration, SchemaMigration, init_db
+from final_script.v3.modules import dashboard_queries
+from final_script.v3.modules.pipeline import StagedPipeline
+from final_script.v3.modules.job_queue import JobQueue, DeadLetterJob, run_worker
+from final_script.v3.modules import job_queue as job_queue_module
+from final_script.v3.modules.llm_classifier import BaseClassifier
+from final_script.v3.modules.log_config import count_document_stat, start_document_stats
+from final_script.v3.modules.rate_limiter import RateLimiter, TokenBucket, AdaptiveConcurrency
+from final_script.v3.modules.excerpt import DocumentExcerpter
+from final_script.v3.modules.llm_cassette import LLMCassette, MockProvider
+from final_script.v3.tests.synthetic_corpus import CLASSES, document_pages, generate_corpus
+from final_script.v3.config.base_config import BaseConfig
+from tokencost import TOKEN_COSTS
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
 
 class TestLogConfig:
     @patch('final_script.v3.modules.log_config.logger')
@@ -64,4 +104,1123 @@ class TestLogConfig:
         
         assert str(exc_info.value) == "Test error"
         # Verify that no time was logged (since function errored)
-        mock_logger.info.assert_not_called()
\ No newline at end of file
+        mock_logger.info.assert_not_called()
+
+
+def fake_extract_text(pdf_file):
+    if pdf_file.endswith("broken.pdf"):
+        raise RuntimeError("unreadable PDF")
+    return (f"text of {os.path.basename(pdf_file)}", {"method": "hybrid"}), 0.01
+
+
+def process_fake_document(pdf_file, content_hash):
+    """Pool task standing in for extraction and classification; module level so spawned workers can import it"""
+    (raw_text, metadata), ocr_time = fake_extract_text(pdf_file)
+    result = data_processor.new_result(pdf_file, content_hash)
+    result["raw_text"], result["metadata"]["OCR"] = raw_text, {"time": ocr_time, **metadata}
+    return data_processor.run_classification(data_processor.run_cleaning(result), RulesClassifier())
+
+
+class TestDataProcessor:
+    def test_page_windows_groups_contiguous_pages(self):
+        """Test that OCR page ranges are contiguous and capped at the window size"""
+        assert page_windows([1, 2, 3, 4, 5], 2) == [(1, 2), (3, 4), (5, 5)]
+        assert page_windows([2, 3, 7, 9, 10], 4) == [(2, 3), (7, 7), (9, 10)]
+        assert page_windows([], 4) == []
+
+    def test_is_usable_text(self):
+        """Test that scanned and garbage pages are sent to OCR while short digital pages are not"""
+        assert is_usable_text("ResMed AirView Compliance Report. Usage days: 25/30 (83%), compliance met.")
+        assert not is_usable_text("   \n  ", image_coverage=0.95)
+        assert not is_usable_text("\ufffd\ufffd~~^^@@##||" * 10)
+        assert not is_usable_text("FAX 555-0100 Page 1", image_coverage=0.9, min_chars=50)
+        assert is_usable_text("Signature: Dr. Lewis", image_coverage=0.05, min_chars=50)
+        assert is_usable_text("   \n  ")
+
+    @patch('final_script.v3.modules.data_processor.iter_text_ocr', side_effect=lambda pdf_file, pages: (f"OCR of page {page}" for page in pages))
+    @patch('final_script.v3.modules.data_processor.extract_text_layer')
+    def test_extract_text_only_ocrs_scanned_pages(self, mock_text_layer, mock_ocr, monkeypatch):
+        """Test that the fast path keeps usable text layers and OCRs only the scanned pages"""
+        monkeypatch.setattr(BaseConfig, "TEXT_LAYER_FAST_PATH", True)
+        report = "ResMed AirView Compliance Report. Usage days: 25/30 (83%), compliance met."
+        mock_text_layer.return_value = [(report, 0.0), ("Signature: Dr. Lewis", 0.05), ("FAX 555-0100", 0.97), ("", 0.0)]
+
+        (text, metadata), _ = data_processor.extract_text("scan.pdf")
+
+        assert text == f"{report}\nSignature: Dr. Lewis\nOCR of page 3\n\n"
+        assert metadata["method"] == "hybrid"
+        assert metadata["pages"] == ["text_layer", "text_layer", "ocr", "text_layer"]
+        mock_ocr.assert_called_once_with("scan.pdf", pages=[3])
+
+    @patch('final_script.v3.modules.data_processor.extract_text_ocr', return_value=("OCR text\n", 0.2))
+    @patch('final_script.v3.modules.data_processor.extract_text_layer')
+    def test_extract_text_falls_back_to_ocr(self, mock_text_layer, mock_ocr, monkeypatch):
+        """Test that every page is OCR'd when the text layer fast path is off"""
+        monkeypatch.setattr(BaseConfig, "TEXT_LAYER_FAST_PATH", False)
+        (text, metadata), _ = data_processor.extract_text("scan.pdf")
+
+        assert (text, metadata) == ("OCR text\n", {"method": "ocr"})
+        mock_text_layer.assert_not_called()
+
+    def test_text_layer_reads_one_document_at_a_time(self):
+        """Test that concurrent extraction threads never use PyMuPDF at the same time"""
+        in_flight, peak = [0], [0]
+
+        @contextlib.contextmanager
+        def open_document(pdf_file):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            yield [SimpleNamespace(rect=1.0, get_image_info=lambda: [], get_text=lambda: f"text of {pdf_file}")]
+            in_flight[0] -= 1
+
+        with patch.dict(sys.modules, {"pymupdf": SimpleNamespace(open=open_document)}):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                pages = list(executor.map(data_processor.extract_text_layer, [f"doc{i}.pdf" for i in range(8)]))
+
+        assert peak[0] == 1
+        assert pages[3] == [("text of doc3.pdf", 0.0)]
+
+    @patch('pytesseract.image_to_string', side_effect=lambda image, **kwargs: f"page {image.getpixel((0, 0))}")
+    def test_ocr_images_serves_repeated_pages_from_cache(self, mock_tesseract, tmp_path, monkeypatch):
+        """Test that identical page bitmaps are only OCR'd once and keep page order"""
+        from PIL import Image
+        monkeypatch.setattr(data_processor, "_ocr_cache", OCRCache(path=str(tmp_path / "ocr_cache.db")))
+        cover, body = Image.new("L", (8, 8), 1), Image.new("L", (8, 8), 2)
+        stats = start_document_stats()
+
+        assert ocr_images([cover, body], ocr_workers=2) == ["page 1", "page 2"]
+        assert ocr_images([cover, Image.new("L", (8, 8), 1)]) == ["page 1", "page 1"]
+        assert mock_tesseract.call_count == 2
+        assert (stats["cache_hits"], stats["cache_misses"]) == (2, 2)
+
+    @patch('final_script.v3.modules.data_processor.copy_processed_document')
+    @patch('final_script.v3.modules.data_processor.find_processed_documents')
+    def test_select_files_skips_unchanged_and_renamed(self, mock_find, mock_copy, tmp_path):
+        """Test that unchanged files are skipped and renamed or duplicated files reuse results"""
+        files = {}
+        for name, content in [("a.pdf", b"A"), ("a_renamed.pdf", b"A"), ("b.pdf", b"B"), ("c.pdf", b"C"), ("c_copy.pdf", b"C")]:
+            files[name] = str(tmp_path / name)
+            (tmp_path / name).write_bytes(content)
+        processed_a = MagicMock(file_name="a.pdf")
+        mock_find.return_value = {file_hash(files["a.pdf"]): processed_a}
+
+        to_process, duplicates = select_files_to_process(sorted(files.values()), "3.1")
+
+        assert [pdf_file for pdf_file, _ in to_process] == [files["b.pdf"], files["c.pdf"]]
+        assert list(duplicates) == [files["c_copy.pdf"]]
+        mock_copy.assert_called_once_with(processed_a, "a_renamed.pdf", files["a_renamed.pdf"])
+
+    def test_worker_pool_skips_failed_documents(self, tmp_engine):
+        """Test that a document failing in a pool worker does not stop the others being saved"""
+        to_process = [(f"/in/{name}", f"hash-{name}") for name in ["broken.pdf"] + [f"doc{i}.pdf" for i in range(4)]]
+        # Spawned workers re-import everything, so nothing patched in this process reaches them
+        with DocumentWriter(bind=tmp_engine) as writer:
+            failed = data_processor.run_document_pool(to_process, writer, workers=2, task=process_fake_document,
+                                                      initializer=None, mp_context=multiprocessing.get_context("spawn"))
+
+        assert failed == 1
+        with Session(tmp_engine) as session:
+            saved = sorted(doc.file_name for doc in session.query(Document))
+        assert saved == [f"doc{i}.pdf" for i in range(4)]
+
+    def test_pool_workers_drop_inherited_connections(self, tmp_engine, monkeypatch):
+        """Test that the pool initializer leaves forked workers no pooled connection of the parent"""
+        monkeypatch.setattr(data_processor, "database_engine", tmp_engine)
+        with tmp_engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        assert tmp_engine.pool.checkedin() == 1
+        data_processor._dispose_inherited_engines()
+        assert tmp_engine.pool.checkedin() == 0
+
+
+@pytest.fixture(autouse=True)
+def no_default_caches(monkeypatch):
+    """Keep tests from reading or writing the on-disk LLM and OCR caches"""
+    monkeypatch.setattr(BaseConfig, "LLM_CACHE_ENABLED", False)
+    monkeypatch.setattr(BaseConfig, "OCR_CACHE_ENABLED", False)
+
+
+def mock_llm_response(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+
+def label_reply(model, messages, **kwargs):
+    """Answer Yes only for the sleep study question"""
+    if "the Sleep class" in messages[-1]["content"]:
+        return mock_llm_response("Yes 92%")
+    return mock_llm_response("No 10%")
+
+
+@pytest.fixture
+def tmp_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'results.db'}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+class TestDatabase:
+    def test_writer_batches_upserts(self, tmp_engine):
+        with patch('final_script.v3.modules.database.upsert_documents', wraps=upsert_documents) as mock_upsert:
+            with DocumentWriter(batch_size=2, flush_seconds=60, bind=tmp_engine) as writer:
+                for i in range(5):
+                    writer.add(f"doc{i}.pdf", f"/in/doc{i}.pdf", "raw", "clean", "A", 0.9, {"OCR": {}}, {"A": 0.9})
+            assert mock_upsert.call_count == 3
+        assert writer.written == 5
+        with Session(tmp_engine) as session:
+            assert session.query(Document).count() == 5
+
+    def test_writer_updates_existing_rows(self, tmp_engine):
+        with DocumentWriter(batch_size=10, flush_seconds=60, bind=tmp_engine) as writer:
+            writer.add("doc.pdf", "/in/doc.pdf", "raw", "clean", "A", 0.5, {}, {})
+        with DocumentWriter(batch_size=10, flush_seconds=60, bind=tmp_engine) as writer:
+            writer.add("doc.pdf", "/in/doc.pdf", "raw", "clean", "B", 0.8, {}, {"B": 0.8}, "hash", "3.1")
+        with Session(tmp_engine) as session:
+            docs = session.query(Document).all()
+        assert len(docs) == 1
+        assert (docs[0].classified_category, docs[0].confidence, docs[0].content_hash) == ("B", 0.8, "hash")
+        assert json.loads(docs[0].high_confidence_classes) == {"B": 0.8}
+
+    def test_writer_flushes_after_interval(self, tmp_engine):
+        writer = DocumentWriter(batch_size=100, flush_seconds=0, bind=tmp_engine)
+        writer.add("doc.pdf", "/in/doc.pdf", "raw", "clean", "A", 0.5, {}, {})
+        assert writer.buffer == {}
+        assert writer.written == 1
+
+    def test_large_batches_stay_under_parameter_limit(self, tmp_engine, monkeypatch):
+        """Test that upserts and hash lookups bigger than SQLite's bound parameter limit are chunked"""
+        import sqlite3
+        from sqlalchemy import event
+        from final_script.v3.modules import database
+        from final_script.v3.modules.database import document_row, find_processed_documents
+        # Enforce the 999 parameter limit of older SQLite builds
+        tmp_engine.dispose()
+        event.listen(tmp_engine, "connect", lambda connection, _: connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999))
+        rows = [document_row(f"doc{i}.pdf", "/in", "raw", "clean", "A", 0.9, {}, {}, f"hash{i}", "3.1") for i in range(2000)]
+        upsert_documents(rows, tmp_engine)
+        monkeypatch.setattr(database, "Session", lambda: Session(tmp_engine))
+
+        processed = find_processed_documents({f"hash{i}" for i in range(5000)}, "3.1")
+        assert len(processed) == 2000
+        assert processed["hash1999"].file_name == "doc1999.pdf"
+
+    def test_text_is_stored_compressed_apart_from_documents(self, tmp_engine):
+        raw, cleaned = "Sleep study report " * 200, "sleep study report " * 200
+        with DocumentWriter(bind=tmp_engine) as writer:
+            writer.add("doc.pdf", "/in/doc.pdf", raw, cleaned, "A", 0.9, {}, {})
+        assert "raw_text" not in {column["name"] for column in inspect(tmp_engine).get_columns("documents")}
+        with Session(tmp_engine) as session:
+            stored = session.get(DocumentText, "doc.pdf")
+            assert len(stored.raw_text) < len(raw) // 10
+            doc = session.query(Document).one()
+            assert "document_text" not in doc.__dict__  # not loaded until accessed
+            assert (doc.raw_text, doc.cleaned_text) == (raw, cleaned)
+        assert load_document_text("doc.pdf", tmp_engine) == (raw, cleaned)
+        assert load_document_text("missing.pdf", tmp_engine) == (None, None)
+
+    def test_metrics_are_stored_as_typed_columns(self, tmp_engine):
+        metadata = {
+            "OCR": {"time": 4.5, "method": "hybrid"},
+            "Text Cleaning": {"time": 0.01},
+            "Classification": {"time": 2.0, "cost": 0.003, "tier": "gpt-4o-mini", "prompt_tokens": 900, "completion_tokens": 12},
+        }
+        with DocumentWriter(bind=tmp_engine) as writer:
+            writer.add("doc.pdf", "/in/doc.pdf", "raw", "clean", "A", 0.9, metadata, {})
+        with Session(tmp_engine) as session:
+            doc = session.query(Document).one()
+        assert (doc.ocr_time, doc.cleaning_time, doc.classification_time) == (4.5, 0.01, 2.0)
+        assert (doc.classification_cost, doc.prompt_tokens, doc.completion_tokens) == (0.003, 900, 12)
+        assert doc.classifier_tier == "gpt-4o-mini"
+        assert doc.processed_at is not None
+        indexed = {index["column_names"][0] for index in inspect(tmp_engine).get_indexes("documents")}
+        assert {"classified_category", "ground_truth", "processed_at"} <= indexed
+
+    def test_metrics_are_backfilled_from_metadata(self, tmp_engine):
+        metadata = json.dumps({"OCR": {"time": 3.0}, "Classification": {"time": 1.5, "cost": 0.002}})
+        with tmp_engine.begin() as connection:
+            connection.execute(Document.__table__.insert().values(file_name="old.pdf", process_metadata=metadata))
+            connection.execute(Document.__table__.insert().values(file_name="bad.pdf", process_metadata="not json"))
+
+        assert apply_migration("backfill_metrics", backfill_metrics, tmp_engine)
+
+        with Session(tmp_engine) as session:
+            docs = {doc.file_name: doc for doc in session.query(Document)}
+        assert (docs["old.pdf"].ocr_time, docs["old.pdf"].classification_time, docs["old.pdf"].classification_cost) == (3.0, 1.5, 0.002)
+        assert docs["bad.pdf"].classification_time is None
+        # Rows without timings are not rescanned on every start
+        with patch('final_script.v3.modules.database.metric_columns') as mock_metric_columns:
+            assert not apply_migration("backfill_metrics", backfill_metrics, tmp_engine)
+        mock_metric_columns.assert_not_called()
+
+    def test_legacy_text_columns_are_moved(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE documents (id INTEGER PRIMARY KEY, file_name VARCHAR UNIQUE, raw_text TEXT, cleaned_text TEXT)"))
+            connection.execute(text("INSERT INTO documents (file_name, raw_text, cleaned_text) VALUES ('a.pdf', 'raw a', 'clean a'), ('b.pdf', 'raw b', NULL)"))
+        DocumentText.__table__.create(engine)
+        SchemaMigration.__table__.create(engine)
+
+        assert apply_migration("move_text_columns", lambda bind: move_text_columns(bind, batch_size=1), engine)
+
+        assert load_document_text("a.pdf", engine) == ("raw a", "clean a")
+        assert load_document_text("b.pdf", engine) == ("raw b", None)
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT raw_text, cleaned_text FROM documents")).all() == [(None, None), (None, None)]
+        # Recorded as applied, so later opens of the database skip the scan
+        rerun = MagicMock()
+        assert not apply_migration("move_text_columns", rerun, engine)
+        rerun.assert_not_called()
+
+    def test_init_db_upgrades_an_old_database(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE documents (id INTEGER PRIMARY KEY, file_name VARCHAR UNIQUE, raw_text TEXT, cleaned_text TEXT)"))
+            connection.execute(text("INSERT INTO documents (file_name, raw_text) VALUES ('a.pdf', 'raw a')"))
+
+        init_db(engine)
+
+        assert {"revision", "classification_time"} <= {column["name"] for column in inspect(engine).get_columns("documents")}
+        assert load_document_text("a.pdf", engine) == ("raw a", None)
+        with Session(engine) as session:
+            assert {migration.name for migration in session.query(SchemaMigration)} == {"move_text_columns", "backfill_metrics", "revision_triggers"}
+        with patch('final_script.v3.modules.database.move_text_columns') as mock_move:
+            init_db(engine)
+        mock_move.assert_not_called()
+
+    def test_import_does_not_touch_the_database(self, tmp_path):
+        """Test that only init_db, not importing the modules, creates and migrates the database"""
+        database_path = tmp_path / "untouched.db"
+        subprocess.run(
+            [sys.executable, "-c", "import final_script.v3.modules.data_processor, final_script.v3.modules.dashboard_queries"],
+            cwd=project_root, env={**os.environ, "DATABASE_URL": f"sqlite:///{database_path}"}, check=True
+        )
+        assert not database_path.exists()
+
+
+def add_labelled_documents(engine, rows):
+    """Write (file_name, ground_truth, predicted, ocr_time, cost) rows and set their ground truth"""
+    with DocumentWriter(bind=engine) as writer:
+        for file_name, _, predicted, ocr_time, cost in rows:
+            metadata = {"OCR": {"time": ocr_time}, "Classification": {"time": 1.0, "cost": cost}}
+            writer.add(file_name, f"/in/{file_name}", "raw", "clean", predicted, 0.9, metadata, {predicted: 0.9})
+    with engine.begin() as connection:
+        for file_name, ground_truth, *_ in rows:
+            connection.execute(Document.__table__.update().where(Document.file_name == file_name).values(ground_truth=ground_truth))
+
+
+class TestDashboardQueries:
+    ROWS = [
+        ("a1.pdf", "A", "A", 1.0, 0.01),
+        ("a2.pdf", "A", "A", 2.0, 0.02),
+        ("a3.pdf", "A", "B", 3.0, 0.03),
+        ("b1.pdf", "B", "B", 4.0, 0.04),
+        ("c1.pdf", "C", "A", 5.0, 0.10),
+    ]
+
+    def test_classification_summary_from_confusion_pairs(self, tmp_engine):
+        add_labelled_documents(tmp_engine, self.ROWS)
+        pairs = dashboard_queries.confusion_pairs(tmp_engine)
+        assert pairs == [("A", "A", 2), ("A", "B", 1), ("B", "B", 1), ("C", "A", 1)]
+
+        summary = dashboard_queries.classification_summary(pairs)
+        report = summary["report"]
+        assert summary["accuracy"] == pytest.approx(3 / 5)
+        assert report["A"] == {"precision": pytest.approx(2 / 3), "recall": pytest.approx(2 / 3), "f1-score": pytest.approx(2 / 3), "support": 3}
+        assert report["B"]["f1-score"] == pytest.approx(2 / 3)
+        assert report["C"]["f1-score"] == 0.0
+        assert summary["weighted_f1"] == pytest.approx((3 * 2 / 3 + 2 / 3) / 5)
+        # One-vs-rest: A (1 + 2/3 - 1/2) / 2, B (1 + 1 - 1/4) / 2, C (1 + 0 - 0) / 2, weighted 3:1:1
+        assert summary["auc"] == pytest.approx((3 * 7 / 12 + 7 / 8 + 1 / 2) / 5)
+        assert summary["true_counts"] == {"A": 3, "B": 1, "C": 1}
+        assert summary["predicted_counts"] == {"A": 3, "B": 2}
+
+    def test_process_metrics_are_aggregated_in_sql(self, tmp_engine):
+        add_labelled_documents(tmp_engine, self.ROWS)
+        stage_times = dashboard_queries.stage_time_stats(tmp_engine)
+        assert stage_times["OCR"] == {"count": 5, "mean": 3.0, "percentiles": {0: 1.0, 25: 2.0, 50: 3.0, 75: 4.0, 100: 5.0}}
+
+        costs = dashboard_queries.cost_summary(tmp_engine, bins=3)
+        assert costs["total"] == pytest.approx(0.2)
+        assert [count for _, _, count in costs["histogram"]] == [4, 1]
+        assert costs["histogram"][-1][1] == pytest.approx(0.10)
+
+        (day, ocr, cleaning, classification), = dashboard_queries.daily_stage_times(tmp_engine)
+        assert (ocr, classification) == (15.0, 5.0)
+
+    def test_stage_percentiles_are_sampled_on_large_tables(self, tmp_engine):
+        rows = [(f"doc{i}.pdf", "A", "A", float(i), 0.01) for i in range(1, 401)]
+        add_labelled_documents(tmp_engine, rows)
+        exact = dashboard_queries.stage_time_stats(tmp_engine)["OCR"]["percentiles"]
+        sampled = dashboard_queries.stage_time_stats(tmp_engine, sample_size=100)["OCR"]["percentiles"]
+        assert exact == {0: 1.0, 25: 101.0, 50: 201.0, 75: 300.0, 100: 400.0}
+        assert (sampled[0], sampled[100]) == (1.0, 400.0)
+        for percentile in (25, 50, 75):
+            assert sampled[percentile] == pytest.approx(exact[percentile], abs=40)
+
+    def test_misclassified_pages_and_filters(self, tmp_engine):
+        add_labelled_documents(tmp_engine, self.ROWS)
+        first = dashboard_queries.misclassified_page(tmp_engine, limit=1)
+        second = dashboard_queries.misclassified_page(tmp_engine, after_id=first[-1]["id"], limit=1)
+        last = dashboard_queries.misclassified_page(tmp_engine, after_id=second[-1]["id"], limit=1)
+        assert [row["file_name"] for row in first + second] == ["a3.pdf", "c1.pdf"]
+        assert last == []
+        assert dashboard_queries.count_misclassified(tmp_engine) == 2
+
+        pair = {"ground_truth": "C", "classified_category": "A"}
+        assert [row["file_name"] for row in dashboard_queries.misclassified_page(tmp_engine, **pair)] == ["c1.pdf"]
+        assert dashboard_queries.count_misclassified(tmp_engine, min_confidence=0.95) == 0
+        assert dashboard_queries.count_misclassified(tmp_engine, processed_from="2000-01-01", processed_to="2000-01-02") == 0
+        assert dashboard_queries.count_misclassified(tmp_engine, processed_from="2000-01-01", max_confidence=0.9) == 2
+
+    def test_change_token_follows_new_and_resaved_rows(self, tmp_engine):
+        add_labelled_documents(tmp_engine, self.ROWS[:2])
+        token = dashboard_queries.change_token(tmp_engine)
+        assert dashboard_queries.change_token(tmp_engine) == token
+        add_labelled_documents(tmp_engine, self.ROWS[:1])
+        resaved = dashboard_queries.change_token(tmp_engine)
+        assert resaved != token
+        add_labelled_documents(tmp_engine, self.ROWS[2:3])
+        added = dashboard_queries.change_token(tmp_engine)
+        assert added not in (token, resaved)
+        # Labelling in place, from any client, changes the token too
+        with tmp_engine.begin() as connection:
+            connection.execute(text("UPDATE documents SET ground_truth = 'B' WHERE file_name = 'a1.pdf'"))
+        relabelled = dashboard_queries.change_token(tmp_engine)
+        assert relabelled != added
+        with tmp_engine.begin() as connection:
+            connection.execute(text("DELETE FROM documents WHERE file_name = 'a2.pdf'"))
+        assert dashboard_queries.change_token(tmp_engine) != relabelled
+
+
+class TestJobQueue:
+    def test_enqueue_is_idempotent_and_completion_happens_once(self, tmp_engine):
+        jobs = JobQueue("documents", bind=tmp_engine)
+        assert jobs.enqueue("3.1:abc", {"pdf_file": "/in/a.pdf"})
+        assert not jobs.enqueue("3.1:abc", {"pdf_file": "/in/a_copy.pdf"})
+
+        job = jobs.claim("worker-1")
+        assert job["payload"] == {"pdf_file": "/in/a.pdf"}
+        assert jobs.claim("worker-2") is None
+        assert jobs.complete(job, "worker-1")
+        assert not jobs.complete(job, "worker-1")
+        assert not jobs.enqueue("3.1:abc", {"pdf_file": "/in/a.pdf"})
+        assert jobs.counts() == {"done": 1}
+
+    def test_failures_back_off_then_dead_letter(self, tmp_engine):
+        jobs = JobQueue("documents", bind=tmp_engine, max_attempts=2, backoff_seconds=60)
+        jobs.enqueue("3.1:abc", {"pdf_file": "/in/a.pdf"})
+
+        job = jobs.claim("worker-1")
+        assert jobs.fail(job, "worker-1", "OCR timeout")
+        assert jobs.claim("worker-1") is None  # backing off
+        assert not jobs.is_drained()
+
+        with patch('final_script.v3.modules.job_queue.time.time', return_value=time.time() + 120):
+            job = jobs.claim("worker-1")
+        assert job["attempts"] == 2
+        assert not jobs.fail(job, "worker-1", "OCR timeout")
+        assert jobs.counts() == {"dead": 1}
+        assert jobs.is_drained()
+        with Session(tmp_engine) as session:
+            dead = session.query(DeadLetterJob).one()
+        assert (dead.key, dead.attempts, dead.last_error) == ("3.1:abc", 2, "OCR timeout")
+
+        assert jobs.retry_dead_letters() == 1
+        assert jobs.claim("worker-1")["attempts"] == 1
+
+    def test_dead_lettered_documents_are_reported_and_can_be_retried(self, tmp_engine, monkeypatch):
+        monkeypatch.setattr(job_queue_module, "engine", tmp_engine)
+        to_process = [("/in/a.pdf", "abc"), ("/in/b.pdf", "def")]
+        jobs = data_processor.enqueue_documents(to_process, "3.1")
+        with tmp_engine.begin() as connection:
+            connection.execute(text("UPDATE jobs SET status = 'dead' WHERE key = '3.1:abc'"))
+
+        with patch('final_script.v3.modules.data_processor.logger') as mock_logger:
+            data_processor.enqueue_documents(to_process, "3.1")
+        assert "1 documents were not queued because their jobs are dead-lettered" in mock_logger.warning.call_args.args[0]
+        assert jobs.statuses(["3.1:abc", "3.1:def", "3.1:missing"]) == {"3.1:abc": "dead", "3.1:def": "pending"}
+
+        assert data_processor.retry_dead_documents() == 1
+        assert jobs.counts() == {"pending": 2}
+
+    def test_expired_lease_is_reclaimed(self, tmp_engine):
+        jobs = JobQueue("documents", bind=tmp_engine, lease_seconds=30)
+        jobs.enqueue("3.1:abc", {"pdf_file": "/in/a.pdf"})
+        crashed = jobs.claim("worker-1")
+        with patch('final_script.v3.modules.job_queue.time.time', return_value=time.time() + 60):
+            job = jobs.claim("worker-2")
+        assert job["id"] == crashed["id"]
+        assert not jobs.complete(crashed, "worker-1")
+        assert jobs.complete(job, "worker-2")
+
+    def test_workers_drain_queue_concurrently(self, tmp_engine):
+        jobs = JobQueue("documents", bind=tmp_engine, backoff_seconds=0)
+        for i in range(20):
+            jobs.enqueue(f"3.1:{i}", {"n": i})
+        handled, failed_once = [], set()
+
+        def handler(payload):
+            if payload["n"] % 5 == 0 and payload["n"] not in failed_once:
+                failed_once.add(payload["n"])
+                raise RuntimeError("transient")
+            handled.append(payload["n"])
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outcomes = list(executor.map(lambda worker: run_worker(jobs, handler, f"worker-{worker}", poll_seconds=0.01), range(4)))
+
+        assert sorted(handled) == list(range(20))
+        assert sum(outcome["completed"] for outcome in outcomes) == 20
+        assert sum(outcome["retried"] for outcome in outcomes) == 4
+        assert jobs.counts() == {"done": 20}
+
+
+class SlowAsyncClassifier(BaseClassifier):
+    """Network-bound stand-in: every document waits on the 'API' and uses one token per character"""
+    def __init__(self):
+        super().__init__("slow-llm")
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def aclassify_document(self, text, file_name):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.05)
+        count_document_stat("prompt_tokens", len(text))
+        self.in_flight -= 1
+        return ("Sleep", 0.9, {"Sleep": 0.9}, 0.001), 0.05
+
+
+class SlowSyncClassifier(SlowAsyncClassifier):
+    """CPU-bound stand-in with only the sync method, like the rules and embedding classifiers"""
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    def classify_document(self, text, file_name):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        count_document_stat("prompt_tokens", len(text))
+        with self.lock:
+            self.in_flight -= 1
+        return ("Sleep", 0.9, {"Sleep": 0.9}, 0.0), 0.05
+
+    aclassify_document = BaseClassifier.aclassify_document
+
+
+class StageCrash(BaseException):
+    """Escapes the per-document error handling and takes the classification stage down"""
+
+
+class CrashingClassifier(BaseClassifier):
+    async def aclassify_document(self, text, file_name):
+        raise StageCrash()
+
+
+class TestStagedPipeline:
+    @patch('final_script.v3.modules.data_processor.extract_text', side_effect=fake_extract_text)
+    def test_processes_documents_concurrently_and_reports_stages(self, mock_extract, tmp_engine):
+        documents = [(f"/in/doc{i}.pdf", f"hash{i}") for i in range(8)] + [("/in/broken.pdf", "hash-broken")]
+        classifier = SlowAsyncClassifier()
+        with DocumentWriter(bind=tmp_engine) as writer:
+            report = StagedPipeline(classifier, writer, ocr_workers=2, classify_concurrency=4, queue_size=2).run(documents)
+
+        assert classifier.max_in_flight > 1
+        assert report["stages"]["extraction"]["failed"] == 1
+        assert [report["stages"][stage]["items"] for stage in ("extraction", "cleaning", "classification", "saving")] == [9, 8, 8, 8]
+        assert set(report["queues"]) == {"cleaning", "classification", "saving"}
+        assert report["bottleneck"] in report["stages"]
+        with Session(tmp_engine) as session:
+            docs = session.query(Document).all()
+        assert len(docs) == 8
+        # Token counts are attributed to their own document even though classifications overlapped
+        assert {doc.prompt_tokens for doc in docs} == {len(text_cleaner.clean("text of doc0.pdf"))}
+        assert {doc.classifier_tier for doc in docs} == {"slow-llm"}
+
+    @patch('final_script.v3.modules.data_processor.extract_text', side_effect=fake_extract_text)
+    def test_sync_classifiers_run_off_the_event_loop(self, mock_extract, tmp_engine):
+        documents = [(f"/in/doc{i}.pdf", f"hash{i}") for i in range(8)]
+        classifier = SlowSyncClassifier()
+        with DocumentWriter(bind=tmp_engine) as writer:
+            report = StagedPipeline(classifier, writer, classify_concurrency=4, queue_size=8).run(documents)
+
+        assert classifier.max_in_flight > 1
+        assert report["stages"]["saving"]["items"] == 8
+        with Session(tmp_engine) as session:
+            assert {doc.prompt_tokens for doc in session.query(Document).all()} == {len(text_cleaner.clean("text of doc0.pdf"))}
+
+    @patch('final_script.v3.modules.data_processor.extract_text', side_effect=fake_extract_text)
+    def test_batching_classifier_scores_ready_documents_together(self, mock_extract, tmp_engine, tmp_path):
+        documents = [(f"/in/sleep{i}.pdf", f"hash{i}") for i in range(8)]
+        encoder = KeywordEncoder()
+        classifier = EmbeddingClassifier(model=encoder, index_path=str(tmp_path / "label_index.npz"))
+        encode = encoder.encode
+        encoder.encode = lambda texts, **kwargs: time.sleep(0.05) or encode(texts, **kwargs)  # documents queue up meanwhile
+        with DocumentWriter(bind=tmp_engine) as writer:
+            report = StagedPipeline(classifier, writer, classify_concurrency=1, queue_size=8, classify_batch=4).run(documents)
+
+        batches = [len(texts) for texts in encoder.encoded[1:]]
+        assert sum(batches) == 8
+        assert 1 < max(batches) <= 4
+        assert report["stages"]["classification"]["items"] == 8
+        with Session(tmp_engine) as session:
+            docs = session.query(Document).all()
+        assert {(doc.classified_category, doc.classifier_tier) for doc in docs} == {("Sleep", classifier.model_name)}
+
+    @patch('final_script.v3.modules.data_processor.extract_text', side_effect=fake_extract_text)
+    def test_failed_classification_stage_shuts_the_pipeline_down(self, mock_extract, tmp_engine):
+        documents = [(f"/in/doc{i}.pdf", f"hash{i}") for i in range(20)]
+        outcome = {}
+
+        def run():
+            with DocumentWriter(bind=tmp_engine) as writer:
+                try:
+                    StagedPipeline(CrashingClassifier(), writer, ocr_workers=2, classify_concurrency=2, queue_size=1).run(documents)
+                except RuntimeError as error:
+                    outcome["error"] = error
+
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        runner.join(timeout=10)
+        assert not runner.is_alive()
+        assert isinstance(outcome["error"].__cause__, StageCrash)
+
+
+class MockLLMServer(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat completions endpoint answering with the scripted status codes, then 200"""
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.calls.append(request)
+        status = self.server.script.pop(0) if self.server.script else 200
+        if status == 200:
+            body = {"id": "mock", "object": "chat.completion", "created": 0, "model": request["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Yes 90%"}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15}}
+        else:
+            body = {"error": {"message": f"mock error {status}", "type": "mock"}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_llm_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockLLMServer)
+    server.calls, server.script = [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(BaseConfig, "LLM_API_BASE", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "mock-key")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestRateLimiter:
+    def test_token_bucket_spaces_out_reservations(self):
+        bucket = TokenBucket(per_minute=60)
+        assert bucket.reserve(60) == 0.0
+        assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+        assert bucket.reserve(1) == pytest.approx(2.0, abs=0.05)
+
+    def test_concurrency_halves_on_throttling_and_grows_on_success(self):
+        concurrency = AdaptiveConcurrency(maximum=8)
+        for _ in range(8):
+            assert concurrency.try_acquire()
+        assert not concurrency.try_acquire()
+        concurrency.release(throttled=True)
+        assert int(concurrency.limit) == 4
+        for _ in range(7):
+            concurrency.release()
+        assert 4 < concurrency.limit < 8
+        assert concurrency.in_flight == 0
+
+    def test_retries_throttled_calls_against_mock_endpoint(self, mock_llm_server):
+        mock_llm_server.script = [429, 503]
+        limiter = RateLimiter(max_concurrency=4, backoff_seconds=0.01)
+        classifier = LLMClassifier(model_name="openai/mock-model", rate_limiter=limiter)
+        stats = start_document_stats()
+        response = classifier.complete([{"role": "user", "content": "Sleep study"}])
+
+        assert classifier.extract_confidence(response) == 0.9
+        assert len(mock_llm_server.calls) == 3
+        assert limiter.stats == {"calls": 1, "throttled": 1, "retries": 2, "wait_seconds": pytest.approx(stats["limiter_wait"])}
+        assert stats["llm_retries"] == 2
+        assert int(limiter.concurrency.limit) == 2
+
+    def test_async_calls_share_the_limiter(self, mock_llm_server):
+        mock_llm_server.script = [429]
+        limiter = RateLimiter(requests_per_minute=600, backoff_seconds=0.01)
+        classifier = LLMClassifier(model_name="openai/mock-model", classification_mode="multi_label", rate_limiter=limiter)
+
+        async def classify_all():
+            return await asyncio.gather(*(classifier.acomplete([{"role": "user", "content": f"document {i}"}]) for i in range(15)))
+
+        responses = asyncio.run(classify_all())
+        assert len(responses) == 15
+        assert len(mock_llm_server.calls) == 16
+        assert limiter.stats["retries"] == 1
+        # 600 requests a minute start with a full bucket, so only the retry could have waited
+        assert limiter.stats["wait_seconds"] < 1
+
+    def test_client_errors_are_not_retried(self, mock_llm_server):
+        mock_llm_server.script = [400]
+        limiter = RateLimiter(backoff_seconds=0.01)
+        classifier = LLMClassifier(model_name="openai/mock-model", rate_limiter=limiter)
+        with pytest.raises(Exception):
+            classifier.complete([{"role": "user", "content": "Sleep study"}])
+        assert len(mock_llm_server.calls) == 1
+        assert limiter.concurrency.in_flight == 0
+
+
+    def test_cancelled_calls_release_their_slot_and_tokens(self):
+        limiter = RateLimiter(tokens_per_minute=6000, max_concurrency=2)
+
+        async def cancel_slow_calls():
+            for _ in range(3):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(limiter.acall(lambda: asyncio.sleep(10), estimated_tokens=1000), timeout=0.01)
+            return await limiter.acall(lambda: asyncio.sleep(0, result={"usage": {"total_tokens": 10}}), estimated_tokens=10)
+
+        assert asyncio.run(asyncio.wait_for(cancel_slow_calls(), timeout=5)) == {"usage": {"total_tokens": 10}}
+        assert limiter.concurrency.in_flight == 0
+        assert limiter.tokens.level == pytest.approx(6000 - 10, abs=5)
+
+    def test_failed_attempts_refund_their_tokens(self):
+        limiter = RateLimiter(tokens_per_minute=6000, backoff_seconds=0.001)
+        error = RuntimeError("server error")
+        error.status_code = 500
+        request = MagicMock(side_effect=[error, error, {"usage": {"total_tokens": 1000}}])
+        limiter.call(request, estimated_tokens=1000)
+        assert request.call_count == 3
+        assert limiter.tokens.level == pytest.approx(6000 - 1000, abs=5)
+
+def long_sleep_report():
+    header = "Institute of Sleep Medicine\nSleep Study Report\nPatient: Jane Doe\n"
+    filler = "".join(f"Page {page} note {line}: nothing of interest was recorded here today\n" for page in range(20) for line in range(10))
+    return header + filler + "Apnea hypopnea index AHI 22.5 events per hour on polysomnography\n" + filler
+
+
+class TestDocumentExcerpter:
+    def test_short_documents_are_kept_whole(self):
+        excerpter = DocumentExcerpter("gpt-4o-mini", budget_tokens=200)
+        excerpt, metadata = excerpter.excerpt("Sleep Study Report\nAHI 22.5")
+        assert excerpt == "Sleep Study Report\nAHI 22.5"
+        assert metadata["spans"] == [[0, len(excerpt)]]
+
+    def test_keeps_header_opening_and_keyword_lines_within_budget(self):
+        text = long_sleep_report()
+        excerpter = DocumentExcerpter("gpt-4o-mini", budget_tokens=120, lead_share=0.5)
+        excerpt, metadata = excerpter.excerpt(text)
+
+        assert excerpt.startswith("Institute of Sleep Medicine\nSleep Study Report\nPatient: Jane Doe\nPage 0 note 0")
+        assert "Apnea hypopnea index AHI 22.5" in excerpt
+        assert "Page 19 note 9" not in excerpt
+        assert metadata["document_tokens"] > 2000
+        assert metadata["tokens"] <= 120 + 2 * len(metadata["spans"])
+        assert metadata["keyword_lines"] >= 1
+        # Spans point back into the original text
+        for start, end in metadata["spans"]:
+            assert text[start:end].rstrip("\n") in excerpt
+
+
+class TestSyntheticCorpus:
+    def test_documents_read_as_their_class(self):
+        """Test that every class's synthetic text scores highest for that class"""
+        provider = MockProvider()
+        for label in CLASSES:
+            pages = document_pages(label, 3, random.Random(label))
+            scores = provider.scores(text_cleaner.clean("\n".join(line for page in pages for line in page)))
+            assert max(scores, key=scores.get) == label
+
+    def test_scanned_documents_are_deterministic(self, tmp_path):
+        """Test that scanned-looking PDFs have the requested pages and the same seed gives the same files"""
+        first = generate_corpus(tmp_path / "a", per_class=1, page_counts=(2,), kinds=("scanned",))
+        second = generate_corpus(tmp_path / "b", per_class=1, page_counts=(2,), kinds=("scanned",))
+        assert [entry["label"] for entry in first] == list(CLASSES)
+        for entry, other in zip(first, second):
+            data = Path(entry["file"]).read_bytes()
+            assert data.startswith(b"%PDF")
+            assert data.count(b"/Type /Page\n") == 2
+            assert data == Path(other["file"]).read_bytes()
+
+
+@patch('final_script.v3.modules.llm_classifier.calculate_completion_cost', return_value=0.001)
+@patch('final_script.v3.modules.llm_classifier.calculate_prompt_cost', return_value=0.002)
+class TestLLMClassifier:
+
+    def test_sends_excerpt_and_records_it(self, mock_prompt_cost, mock_completion_cost):
+        """Test that long documents are excerpted to the token budget before the per-label calls"""
+        classifier = LLMClassifier(excerpt_tokens=150)
+        stats = start_document_stats()
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=label_reply) as mock_completion:
+            (predicted_class, _, _, _), _ = classifier.classify_document(long_sleep_report(), "sleep.pdf")
+
+        assert predicted_class == "Sleep"
+        sent = {call.kwargs["messages"][1]["content"].split("\n\n")[0] for call in mock_completion.call_args_list}
+        assert len(sent) == 1
+        assert "AHI 22.5" in sent.pop()
+        assert stats["excerpt"]["tokens"] < stats["excerpt"]["document_tokens"]
+
+    def test_prompts_share_a_static_prefix(self, mock_prompt_cost, mock_completion_cost):
+        """Test that per-label calls carry a short prefix and one description, and only the comparing calls carry the examples"""
+        classifier = LLMClassifier()
+        label_calls = [classifier.label_messages(label, "Delivery receipt") for label in classifier.label_prompts]
+        label_calls.append(LLMClassifier().label_messages("Sleep", "Sleep study"))
+        example_calls = [classifier.multi_label_messages("Order form"),
+                         classifier.few_shot_messages("Order form", {"Order": 0.8, "Delivery": 0.7})]
+
+        assert {messages[0]["content"] for messages in label_calls} == {classifier.prompt_prefix}
+        assert {messages[0]["content"] for messages in example_calls} == {classifier.examples_prefix}
+        for example in classifier.examples.values():
+            assert example in classifier.examples_prefix
+            assert all(example not in messages[1]["content"] for messages in label_calls)
+        for label, messages in zip(classifier.label_prompts, label_calls):
+            assert classifier.label_prompts[label] in messages[1]["content"]
+            assert sum(prompt in messages[1]["content"] for prompt in classifier.label_prompts.values()) == 1
+        assert sum(len(message["content"]) for message in label_calls[0]) < len(classifier.examples_prefix) / 5
+        assert all(messages[1]["content"].startswith('Document: "') for messages in label_calls + example_calls)
+        assert example_calls[1][1]["content"].endswith("one of these classes: Order, Delivery.")
+
+    def test_mock_provider_understands_the_prompts(self, mock_prompt_cost, mock_completion_cost):
+        """Test that the mock answers the questions document_messages builds rather than falling back to No 0%"""
+        classifier = LLMClassifier()
+        provider = MockProvider()
+        text = text_cleaner.clean("\n".join(line for page in document_pages("Sleep", 2, random.Random(1)) for line in page))
+
+        assert split_document_message(classifier.label_messages("Sleep", text)[1]["content"])[0] == text
+        assert provider.answer(classifier.label_messages("Sleep", text)).startswith("Yes")
+        assert provider.answer(classifier.label_messages("Order", text)).startswith("No")
+        scores = json.loads(provider.answer(classifier.multi_label_messages(text)))
+        assert max(scores, key=scores.get) == "Sleep"
+        assert provider.answer(classifier.few_shot_messages(text, {"Sleep": 0.8, "Order": 0.7})) == "Class: Sleep"
+
+    def test_sync_and_async_return_same_tuple(self, mock_prompt_cost, mock_completion_cost):
+        """Test that the async fan-out returns the same result as the sequential path"""
+        classifier = LLMClassifier()
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=label_reply):
+            sync_result, _ = classifier.classify_document("Polysomnography report", "sleep.pdf")
+        with patch('final_script.v3.modules.llm_classifier.acompletion', new=AsyncMock(side_effect=label_reply)) as mock_acompletion:
+            async_result, _ = asyncio.run(classifier.aclassify_document("Polysomnography report", "sleep.pdf"))
+
+        assert sync_result == async_result
+        assert sync_result[0] == "Sleep"
+        assert sync_result[1] == pytest.approx(0.92)
+        assert sync_result[3] == pytest.approx(6 * 0.003)
+        assert mock_acompletion.await_count == 6
+
+    def test_async_falls_back_to_few_shot(self, mock_prompt_cost, mock_completion_cost):
+        """Test that the async path runs the few-shot call when no class passes the threshold"""
+        classifier = LLMClassifier(max_concurrency=2)
+        replies = [mock_llm_response("No 5%")] * 6 + [mock_llm_response("Class: Order")]
+        with patch('final_script.v3.modules.llm_classifier.acompletion', new=AsyncMock(side_effect=replies)):
+            (predicted_class, confidence, high_conf_classes, cost), _ = asyncio.run(
+                classifier.aclassify_document("Equipment order form", "order.pdf"))
+
+        assert predicted_class == "Order"
+        assert confidence == 0.9
+        assert high_conf_classes == {}
+        assert cost == pytest.approx(7 * 0.003)
+
+    def test_multi_label_mode_makes_one_call(self, mock_prompt_cost, mock_completion_cost):
+        """Test that multi-label mode scores every class from a single JSON response"""
+        classifier = LLMClassifier(classification_mode="multi_label")
+        reply = mock_llm_response('{"Compliance": 88, "Sleep": 20, "Order": "5%", "Delivery": 0, "Physician": 0}')
+        with patch('final_script.v3.modules.llm_classifier.completion', return_value=reply) as mock_completion:
+            (predicted_class, confidence, high_conf_classes, cost), _ = classifier.classify_document("AirView report", "c.pdf")
+
+        assert mock_completion.call_count == 1
+        assert predicted_class == "Compliance"
+        assert confidence == pytest.approx(0.88)
+        assert high_conf_classes == {"Compliance": pytest.approx(0.88)}
+        assert cost == pytest.approx(0.003)
+
+    def test_cache_serves_repeats(self, mock_prompt_cost, mock_completion_cost, tmp_path):
+        """Test that a repeated document is answered from the cache without billing"""
+        classifier = LLMClassifier(cache=LLMCache(path=str(tmp_path / "llm_cache.db")))
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=label_reply) as mock_completion:
+            first, _ = classifier.classify_document("Polysomnography report", "sleep.pdf")
+            second, _ = classifier.classify_document("Polysomnography report", "sleep.pdf")
+
+        assert mock_completion.call_count == 6
+        assert first[:3] == second[:3]
+        assert second[3] == 0.0
+        assert classifier.cache_stats == {"hits": 6, "misses": 6}
+
+    def test_cassette_replays_recorded_calls(self, mock_prompt_cost, mock_completion_cost, tmp_path):
+        """Test that calls recorded to a cassette are replayed without the provider, with simulated latency"""
+        path = str(tmp_path / "cassette.jsonl")
+        recorder = LLMClassifier(cassette=LLMCassette("record", path))
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=label_reply):
+            recorded, _ = recorder.classify_document("Overnight polysomnography", "sleep.pdf")
+        assert recorder.cassette.stats["recorded"] == 6
+
+        replayer = LLMClassifier(cassette=LLMCassette("replay", path, latency=0.01))
+        start = time.perf_counter()
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=AssertionError("no live calls")):
+            replayed, _ = replayer.classify_document("Overnight polysomnography", "sleep.pdf")
+        assert replayed == recorded
+        assert replayer.cassette.stats == {"recorded": 0, "replayed": 6, "mocked": 0}
+        assert time.perf_counter() - start >= 0.06
+
+    def test_cassette_records_cache_hits(self, mock_prompt_cost, mock_completion_cost, tmp_path):
+        """Test that a recording made with a warm cache still replays every call"""
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"))
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=label_reply):
+            LLMClassifier(cache=cache).classify_document("Overnight polysomnography", "sleep.pdf")
+        path = str(tmp_path / "cassette.jsonl")
+        recorder = LLMClassifier(cache=cache, cassette=LLMCassette("record", path))
+        with patch('final_script.v3.modules.llm_classifier.completion', side_effect=AssertionError("cache is warm")):
+            recorded, _ = recorder.classify_document("Overnight polysomnography", "sleep.pdf")
+        assert recorder.cache_stats["hits"] == 6
+        assert recorder.cassette.stats["recorded"] == 6
+
+        replayer = LLMClassifier(cassette=LLMCassette("replay", path, latency="recorded"))
+        replayed, _ = replayer.classify_document("Overnight polysomnography", "sleep.pdf")
+        assert replayed[:3] == recorded[:3]
+        assert replayer.cassette.stats == {"recorded": 0, "replayed": 6, "mocked": 0}
+
+    def test_cassette_turns_off_default_cache(self, mock_prompt_cost, mock_completion_cost, tmp_path, monkeypatch):
+        """Test that the default cache is not used in any cassette mode"""
+        monkeypatch.setattr(BaseConfig, "LLM_CACHE_ENABLED", True)
+        for mode in LLMCassette.MODES:
+            assert LLMClassifier(cassette=LLMCassette(mode, str(tmp_path / "cassette.jsonl"))).cache is None
+
+    def test_mock_provider_answers_unseen_prompts(self, mock_prompt_cost, mock_completion_cost, tmp_path):
+        """Test that unrecorded prompts get deterministic answers from the keyword rules"""
+        text = "Sleep Study Report. Polysomnography performed overnight. Apnea hypopnea index AHI 22.5, sleep efficiency 81%."
+        results = []
+        for mode in ("per_label", "multi_label"):
+            classifier = LLMClassifier(classification_mode=mode, cassette=LLMCassette("replay", str(tmp_path / "empty.jsonl")))
+            with patch('final_script.v3.modules.llm_classifier.acompletion', side_effect=AssertionError("no live calls")):
+                (predicted_class, confidence, _, _), _ = asyncio.run(classifier.aclassify_document(text, "sleep.pdf"))
+            results.append((predicted_class, confidence))
+        assert results[0] == results[1]
+        assert results[0][0] == "Sleep"
+        assert classifier.cache is None
+
+    def test_token_usage_is_counted(self, mock_prompt_cost, mock_completion_cost):
+        """Test that token usage reported by the provider is accumulated per classifier"""
+        classifier = LLMClassifier(classification_mode="multi_label")
+        reply = {**mock_llm_response('{"Sleep": 90}'),
+                 "usage": {"prompt_tokens": 1200, "completion_tokens": 15, "prompt_tokens_details": {"cached_tokens": 1024}}}
+        with patch('final_script.v3.modules.llm_classifier.completion', return_value=reply):
+            classifier.classify_document("Polysomnography report", "sleep.pdf")
+            stats = start_document_stats()
+            (_, _, _, cost), _ = classifier.classify_document("Polysomnography report", "sleep.pdf")
+
+        assert classifier.token_stats == {"prompt_tokens": 2400, "completion_tokens": 30, "cached_tokens": 2048}
+        assert stats["cached_tokens"] == 1024
+        # The cached part of the prompt is billed at the cached rate
+        assert cost == pytest.approx(0.002 + 0.001 - 1024 * (TOKEN_COSTS["gpt-4o-mini"]["input_cost_per_token"]
+                                                             - TOKEN_COSTS["gpt-4o-mini"]["cache_read_input_token_cost"]))
+
+
+class TestLLMCache:
+    @patch.object(LLMCache, "TOUCH_INTERVAL_SECONDS", 0)
+    def test_size_eviction_drops_least_recently_used(self, tmp_path):
+        """Test that entries are evicted oldest-access first once the size limit is exceeded"""
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_size_bytes=120)
+        response = mock_llm_response("Yes 90%")  # 50 bytes as JSON
+        cache.put("a", response)
+        cache.put("b", response)
+        assert cache.get("a") == response  # a is now more recently used than b
+        cache.put("c", response)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == response
+        assert cache.get("c") == response
+
+    def test_puts_keep_a_running_size_total(self, tmp_path):
+        """Test that puts track the stored size without summing the table, and stay within the limit"""
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_size_bytes=1000)
+        response = mock_llm_response("Yes 90%")  # 50 bytes as JSON
+        with patch.object(cache, "stored_size", wraps=cache.stored_size) as mock_stored_size:
+            for i in range(300):
+                cache.put(f"key{i % 40}", response if i % 3 else mock_llm_response("No 5%" * i))
+        assert mock_stored_size.call_count == 300 // LLMCache.MAINTENANCE_INTERVAL
+        assert cache.total_size == cache.stored_size() <= 1000
+        assert cache.get("key19") is not None  # the most recent puts are kept
+
+    def test_age_eviction(self, tmp_path):
+        """Test that expired entries are not served"""
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_age_seconds=60)
+        cache.put("a", mock_llm_response("Yes 90%"))
+        with patch('final_script.v3.modules.disk_cache.time.time', return_value=10 ** 12):
+            assert cache.get("a") is None
+
+    def test_hits_do_not_write_until_access_time_is_stale(self, tmp_path):
+        """Test that cache hits only update the access time once it is older than the touch interval"""
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"))
+        cache.put("a", mock_llm_response("Yes 90%"))
+        read_access = lambda: cache.connection.execute("SELECT accessed_at FROM llm_response_cache").fetchone()[0]
+        stored = read_access()
+        assert cache.get("a") is not None
+        assert read_access() == stored
+        with patch('final_script.v3.modules.disk_cache.time.time', return_value=stored + LLMCache.TOUCH_INTERVAL_SECONDS):
+            assert cache.get("a") is not None
+        assert read_access() == stored + LLMCache.TOUCH_INTERVAL_SECONDS
+
+    def test_zero_max_age_is_not_the_default(self, tmp_path):
+        cache = LLMCache(path=str(tmp_path / "llm_cache.db"), max_age_seconds=0)
+        assert cache.max_age_seconds == 0
+
+    def test_key_depends_on_model_messages_and_params(self):
+        messages = [{"role": "user", "content": "hello"}]
+        key = LLMCache.make_key("gpt-4o-mini", messages)
+        assert key == LLMCache.make_key("gpt-4o-mini", [dict(messages[0])])
+        assert key != LLMCache.make_key("gpt-4o", messages)
+        assert key != LLMCache.make_key("gpt-4o-mini", messages, temperature=0)
+
+
+COMPLIANCE_TEXT = (
+    "ResMed AirView Compliance Report. Compliance period 09/01/2023 - 09/30/2023. Compliance met: Yes, "
+    "compliance percentage 85%. Usage days 25/30, average usage 5 hours per night. Therapy hours 176. "
+    "Pressure settings: Min 6 cmH2O, Max 15 cmH2O. Leak rate median 12.4 L/min. AHI 3.5 events per hour."
+)
+
+
+class TestRulesClassifier:
+    def test_compliance_report_is_decisive(self):
+        """Test that a clear compliance report is decided by the rules alone"""
+        classifier = RulesClassifier()
+        scores = classifier.score_document(COMPLIANCE_TEXT)
+        assert max(scores, key=scores.get) == "Compliance"
+        assert classifier.is_decisive(scores)
+
+        (predicted_class, confidence, _, cost), _ = classifier.classify_document(COMPLIANCE_TEXT, "c.pdf")
+        assert predicted_class == "Compliance"
+        assert cost == 0.0
+
+    def test_ambiguous_text_is_not_decisive(self):
+        assert not RulesClassifier().is_decisive(RulesClassifier().score_document("Page 1 of 3"))
+
+    def test_cascade_only_calls_llm_for_ambiguous_documents(self):
+        """Test that the LLM tier is skipped when the rules tier is decisive"""
+        llm = MagicMock(model_name="gpt-4o-mini", threshold=0.5, cache_stats={"hits": 0, "misses": 0})
+        llm.classify_document.return_value = (("Physician", 0.9, {"Physician": 0.9}, 0.01), 1.0)
+        cascade = CascadeClassifier([RulesClassifier(), llm])
+
+        (predicted_class, _, _, cost), _ = cascade.classify_document(COMPLIANCE_TEXT, "c.pdf")
+        assert (predicted_class, cost, cascade.last_tier) == ("Compliance", 0.0, "rules")
+        llm.classify_document.assert_not_called()
+
+        (predicted_class, _, _, cost), _ = cascade.classify_document("Page 1 of 3", "p.pdf")
+        assert (predicted_class, cost, cascade.last_tier) == ("Physician", 0.01, "gpt-4o-mini")
+        llm.classify_document.assert_called_once()
+
+
+class TestKeywordMatcher:
+    def test_counts_distinct_terms_per_class(self):
+        """Test that overlapping terms of several classes are all found in one pass"""
+        matcher = KeywordMatcher([
+            ("Sleep", "keywords", "sleep"),
+            ("Sleep", "keywords", "sleep study"),
+            ("Sleep", "keywords", "apnea"),
+            ("Compliance", "measurements", "cmH2O"),
+            ("Order", "keywords", "order"),
+        ])
+        counts = matcher.match("SLEEP STUDY shows sleep apnea; pressure 8 cmh2o. Reorder later.")
+        assert counts == {("Sleep", "keywords"): 3, ("Compliance", "measurements"): 1, ("Order", "keywords"): 0}
+
+    @pytest.mark.parametrize("term, text", [
+        ("usage", "usage days"), ("usage", "misusage"), ("usage", "usages"),
+        ("%", "85%"), ("%", "85% used"), ("%", "a%b"), ("Follow up:", "Follow up: 2 weeks"),
+        ("Follow up:", "Follow up:x"), ("L/min", "12 L/min"), ("Rx:", "rx: 1"), ("cm", "8 cm."),
+    ])
+    def test_matches_regex_word_boundaries(self, term, text):
+        """Test that a term matches exactly when the word-boundary regex used by the rules does"""
+        expected = 1 if re.search(rf'\b{re.escape(term)}\b', text, re.IGNORECASE) else 0
+        assert KeywordMatcher([("A", "keywords", term)]).match(text)[("A", "keywords")] == expected
+
+    def test_rules_scores_match_per_term_search(self):
+        """Test that rule scores built on the matcher equal scanning for each term separately"""
+        classifier = RulesClassifier()
+        for class_name, features in classifier.rules.items():
+            for feature_type in classifier.FEATURE_WEIGHTS:
+                expected = sum(1 for term in getattr(features, feature_type)
+                               if re.search(rf'\b{re.escape(term)}\b', COMPLIANCE_TEXT, re.IGNORECASE))
+                assert classifier.matcher.match(COMPLIANCE_TEXT).get((class_name, feature_type), 0) == expected
+
+
+class KeywordEncoder:
+    """Stand-in for a SentenceTransformer that embeds texts as normalized class keyword counts"""
+    KEYWORDS = ["compliance", "sleep", "order", "delivery", "physician", "prescription"]
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, normalize_embeddings=True, **kwargs):
+        import numpy as np
+        self.encoded.append(list(texts))
+        vectors = np.array([[text.lower().count(keyword) for keyword in self.KEYWORDS] for text in texts], dtype=float) + 0.01
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestEmbeddingClassifier:
+    def test_label_index_is_persisted(self, tmp_path):
+        """Test that description embeddings are computed once and reloaded from the index file"""
+        index_path = str(tmp_path / "label_index.npz")
+        encoder = KeywordEncoder()
+        EmbeddingClassifier(model=encoder, index_path=index_path)
+        EmbeddingClassifier(model=encoder, index_path=index_path)
+        assert len(encoder.encoded) == 1
+        assert len(encoder.encoded[0]) == 24
+
+    def test_batch_scores_match_single_document_scores(self, tmp_path):
+        """Test that one batched matrix product scores every document against every class"""
+        encoder = KeywordEncoder()
+        classifier = EmbeddingClassifier(model=encoder, index_path=str(tmp_path / "label_index.npz"))
+        texts = ["Sleep study: sleep efficiency and sleep stages", "Delivery receipt, delivery date"]
+
+        batch_scores = classifier.score_documents(texts)
+        assert len(encoder.encoded[-1]) == 2
+        assert batch_scores[0] == pytest.approx(classifier.score_document(texts[0]))
+        assert [result[0] for result in classifier.classify_batch(texts)] == ["Sleep", "Delivery"]
+
+    def test_cascade_scores_a_batch_with_one_encode(self, tmp_path):
+        """Test that the cascade's embedding tier encodes a batch once and leaves ambiguous documents to the final tier"""
+        encoder = KeywordEncoder()
+        embedding = EmbeddingClassifier(model=encoder, index_path=str(tmp_path / "label_index.npz"))
+        cascade = CascadeClassifier([embedding, SlowAsyncClassifier()])
+
+        decisions = cascade.decide_batch(["Sleep study: sleep efficiency and sleep stages", "Sleep delivery"])
+
+        assert len(encoder.encoded) == 2  # the label index, then the batch
+        assert decisions[0][0][0] == "Sleep" and decisions[0][1] == embedding.model_name
+        assert decisions[1] is None
+        assert cascade.supports_batch
+
+
+class TestDataCleaning:
+    @pytest.mark.parametrize("text, expected", [
+        ("Phone: 555-1234\nPatient: e oor aye eee Jane\n\n\n  Date : 05/12/2023 ,12%x", "Patient: Jane Date: 05/12/2023, 12 %x"),
+        ("##  AHI:3.5,85%\t\tused 8cmH20 , 12L/min", "AHI:3. 5, 85 % used 8 cmH20, 12 L/min"),
+        ("Fax 555\nEmail: a@b.c\nTotal Usage Days: 25/30 days (83%).Next", "Total Usage Days: 25/30 days 83 %. Next"),
+        ("", ""),
+    ])
+    def test_refined_clean_text(self, text, expected):
+        cleaned_text, _ = refined_clean_text(text)
+        assert cleaned_text == expected
+
+    def test_golden_corpus_is_unchanged(self):
+        """Test that cleaning the stored OCR corpus gives byte-identical output to the original passes"""
+        corpus_path = Path(project_root) / "experiments" / "1_data_processing" / "selected_results.json"
+        with open(corpus_path, encoding="utf-8") as f:
+            texts = json.load(f)["texts"]
+        with open(Path(__file__).parent / "golden_cleaning.json") as f:
+            golden = json.load(f)
+
+        assert set(texts) == set(golden)
+        for file_name, text in texts.items():
+            cleaned_text = text_cleaner.clean(text)
+            assert hashlib.sha256(cleaned_text.encode("utf-8")).hexdigest() == golden[file_name], file_name
+            assert text_cleaner.clean_pages(iter(text.splitlines(keepends=True))) == cleaned_text
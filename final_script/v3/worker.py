@@ -0,0 +1,22 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Add the project root to Python path
+project_root = str(Path(__file__).parent.parent.parent)
+sys.path.insert(0, project_root)
+
+from final_script.v3.modules.data_processor import work_document_queue, retry_dead_documents
+from final_script.v3.modules.database import init_db
+
+if __name__ == "__main__":
+    # Standalone worker for the document job queue; several can run on hosts sharing the database
+    parser = argparse.ArgumentParser(description="Work the document job queue")
+    parser.add_argument("--retry-dead-letters", action="store_true",
+                        help="put dead-lettered documents back in the queue before working it")
+    args = parser.parse_args()
+    init_db()
+    if args.retry_dead_letters:
+        retry_dead_documents()
+    work_document_queue(exit_when_drained=os.getenv("JOB_WORKER_EXIT_WHEN_DRAINED", "false").lower() == "true")